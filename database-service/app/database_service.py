@@ -1,6 +1,7 @@
 from flask import Flask, jsonify, request
 from redis_client import RedisMovieClient
 from mongo_client import MongoMovieClient
+from single_flight import SingleFlight
 import os
 from dotenv import load_dotenv
 from flask_cors import CORS
@@ -26,6 +27,9 @@ mongo_client = MongoMovieClient(
     collection_name=os.getenv("MONGO_COLLECTION", "movies")
 )
 
+# Одинаковые одновременные поисковые запросы выполняются в Redis один раз
+search_flight = SingleFlight()
+
 def auto_sync_mongodb_to_redis():
     """
     Функция для автоматической синхронизации Redis с MongoDB.
@@ -77,14 +81,15 @@ def search_movies():
     country = request.args.get("country")
     category = request.args.get("category")
     
-    results = redis_client.search_movies(
+    flight_key = (query, genre, year, movie_type, country, category)
+    results, _ = search_flight.do(flight_key, lambda: redis_client.search_movies(
         query=query,
         genre=genre,
         year=year,
         movie_type=movie_type,
         country=country,
         category=category
-    )
+    ))
     
     return jsonify(results)
 
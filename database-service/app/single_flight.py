@@ -0,0 +1,61 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight).
+
+Первый запрос с данным ключом выполняет вычисление, а запросы с тем же ключом,
+пришедшие, пока оно идёт, ждут его и получают тот же результат (или то же
+исключение). После завершения ключ освобождается: следующий запрос вычисляет заново
+(или берёт результат из кэша, если вызывающий код его использует).
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Выполняет fn один раз для всех одновременных вызовов с одинаковым ключом"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Возвращает (результат, shared), где shared - результат получен от другого вызова"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        """Статистика для /status"""
+        with self.lock:
+            in_flight = len(self.calls)
+        return {"executed": self.executed, "shared": self.shared, "in_flight": in_flight}
@@ -0,0 +1,112 @@
+"""
+Разреженная матрица признаков фильмов для мягких бустов ранжирования.
+
+Строки матрицы CSR - фильмы (строки EmbeddingStore), столбцы - бинарные признаки:
+жанры, страны, типы и десятилетия выпуска. Бусты запроса задаются столбцами признаков,
+и оценка кандидатов - произведение строк-кандидатов матрицы на вектор весов вместо
+поиска кандидатов в списках строк по каждому атрибуту. Новый вид буста добавляется
+столбцами в FEATURE_FIELDS без изменения кода ранжирования.
+
+Доля атрибутов в итоговой оценке (BOOST_SCALE) заложена в значения матрицы при сборке,
+а произведение строк-кандидатов на вектор весов скомпилированное ядро CSR scipy
+прибавляет прямо к буферу оценок кандидатов. Вектор весов свой у каждого потока
+и переиспользуется между запросами.
+"""
+import threading
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse._sparsetools import csr_matvec
+
+# Атрибуты FilterIndex, из которых строятся столбцы матрицы
+FEATURE_FIELDS = ("genre", "country", "type")
+
+# Вклад одного совпавшего атрибута запроса в оценку бустов
+ATTRIBUTE_WEIGHT = 0.1
+
+# Доля оценки бустов в итоговой оценке кандидата (0.85 * текст + 0.05 * год + 0.1 * атрибуты)
+BOOST_SCALE = 0.1
+
+
+class BoostFeatures:
+    """Матрица фильм x признак (CSR, значения уже умножены на BOOST_SCALE) и номера столбцов признаков"""
+
+    def __init__(self, matrix, columns):
+        self.matrix = matrix
+        # (атрибут, значение) -> номер столбца
+        self.columns = columns
+        self.buffers = threading.local()
+
+    @classmethod
+    def from_filter_index(cls, filter_index):
+        """Признаки по спискам строк FilterIndex и десятилетиям по годам"""
+        count = filter_index.count
+        columns = {}
+        row_parts = []
+        for field in FEATURE_FIELDS:
+            for value, rows in filter_index.postings[field].items():
+                columns[(field, value)] = len(columns)
+                row_parts.append(rows)
+
+        # Десятилетие выпуска: "1990" для 1990-1999
+        decades = filter_index.years // 10 * 10
+        decade_values, decade_codes = np.unique(decades, return_inverse=True)
+        for value in decade_values.tolist():
+            columns[("decade", str(value))] = len(columns)
+        decade_start = len(columns) - len(decade_values)
+
+        sizes = [len(rows) for rows in row_parts]
+        rows = np.concatenate(row_parts + [np.arange(count, dtype=np.int64)])
+        cols = np.concatenate([
+            np.repeat(np.arange(len(sizes), dtype=np.int32), sizes),
+            decade_start + decade_codes.astype(np.int32)
+        ])
+        data = np.full(len(rows), BOOST_SCALE, dtype=np.float32)
+        matrix = sparse.csr_matrix((data, (rows, cols)), shape=(count, len(columns)), dtype=np.float32)
+        matrix.sum_duplicates()
+        return cls(matrix, columns)
+
+    @property
+    def count(self):
+        return len(self.columns)
+
+    @staticmethod
+    def decades(year_from, year_to):
+        """Признаки десятилетий, которые пересекает диапазон лет [year_from, year_to]"""
+        return [("decade", str(decade)) for decade in range(year_from // 10 * 10, year_to + 1, 10)]
+
+    def columns_for(self, attributes):
+        """Столбцы признаков для атрибутов запроса [(атрибут, значение)]; None, если ни один не известен"""
+        columns = tuple(self.columns[attribute] for attribute in attributes if attribute in self.columns)
+        return columns or None
+
+    def _thread_weights(self):
+        """Вектор весов запроса потока: нулевой между запросами"""
+        weights = getattr(self.buffers, "weights", None)
+        if weights is None:
+            weights = self.buffers.weights = np.zeros(self.count, dtype=np.float32)
+        return weights
+
+    def add_scores(self, rows, columns, out):
+        """
+        Прибавляет к out оценки бустов строк rows для столбцов запроса columns:
+        строки rows матрицы на вектор весов, произведение считает ядро CSR scipy прямо в out
+        """
+        weights = self._thread_weights()
+        for column in columns:
+            weights[column] += ATTRIBUTE_WEIGHT
+        try:
+            selected = self.matrix[rows]
+            csr_matvec(len(rows), self.count, selected.indptr, selected.indices, selected.data, weights, out)
+        finally:
+            # Вектор весов общий для запросов потока: возвращаем его к нулям
+            for column in columns:
+                weights[column] = 0
+
+    def describe(self):
+        """Размер матрицы для /status"""
+        return {
+            "features": self.count,
+            "nnz": int(self.matrix.nnz),
+            "size_mb": round((self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes) / (1024 * 1024), 2)
+        }
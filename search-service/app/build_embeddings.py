@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Офлайн-генерация эмбеддингов фильмов для search-service.
+
+Пример:
+    python build_embeddings.py --workers 4 --batch-size 64
+
+Документы читаются из MongoDB потоком (по возрастанию _id) и кодируются локальной
+моделью в пуле процессов. Каждый готовый шард (<work-dir>/shard_XXXXX.npy и
+shard_XXXXX.ids.npy) сохраняется атомарно, поэтому прерванный запуск продолжается
+с места остановки: уже закодированные фильмы пропускаются. В конце шарды сливаются
+в EMBEDDINGS_FILE (и movies_embeddings.ids.npy рядом), который сервис подхватывает
+при старте без повторной генерации.
+
+Фильмы, которые не удалось закодировать после повторных попыток, не заполняются
+нулями: они перечисляются в <work-dir>/failures.json, а код возврата ненулевой.
+Повторный запуск попробует закодировать их снова.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from time import time
+
+import numpy as np
+
+BUILD_FILE = "build.json"
+FAILURES_FILE = "failures.json"
+SHARD_PATTERN = re.compile(r"^shard_(\d+)\.npy$")
+
+# Кодировщик процесса-воркера, создаётся один раз в _init_worker
+_encoder = None
+
+
+def _init_worker(threads):
+    global _encoder
+    if threads:
+        os.environ["ENCODER_THREADS"] = str(threads)
+
+    from query_encoder import create_query_encoder
+    from search_service import API_URL, HEADERS
+
+    _encoder = create_query_encoder(API_URL, HEADERS)
+
+
+def _encode_shard(shard, ids, texts, batch_size, retries):
+    """Кодирует шард в процессе-воркере; возвращает (шард, id, векторы, {id: ошибка})"""
+    from query_encoder import encode_batches
+
+    vectors, embedded, failures = encode_batches(
+        _encoder, texts,
+        batch_size=batch_size,
+        retries=retries,
+        pause=1.0 if _encoder.backend == "remote" else 0.0
+    )
+    return shard, [ids[i] for i in embedded], vectors, {ids[i]: error for i, error in failures.items()}
+
+
+def _atomic_save(path, array):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as tmp_file:
+        np.save(tmp_file, array)
+    os.replace(tmp_path, path)
+
+
+def _shard_paths(work_dir, shard):
+    base = os.path.join(work_dir, f"shard_{shard:05d}")
+    return f"{base}.npy", f"{base}.ids.npy"
+
+
+def _completed_shards(work_dir):
+    """Номера шардов, для которых записаны и векторы, и id"""
+    shards = []
+    for name in os.listdir(work_dir):
+        match = SHARD_PATTERN.match(name)
+        if match and os.path.exists(_shard_paths(work_dir, int(match.group(1)))[1]):
+            shards.append(int(match.group(1)))
+    return sorted(shards)
+
+
+def _write_shard(work_dir, shard, ids, vectors):
+    vectors_path, ids_path = _shard_paths(work_dir, shard)
+    _atomic_save(ids_path, np.asarray(ids, dtype=np.int64))
+    # Шард считается готовым, когда записан файл векторов
+    _atomic_save(vectors_path, np.asarray(vectors, dtype=np.float32))
+
+
+def _check_build_info(work_dir, info, restart):
+    """Проверяет, что незавершённая сборка в work_dir сделана той же моделью"""
+    path = os.path.join(work_dir, BUILD_FILE)
+    if restart and os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as build_file:
+            previous = json.load(build_file)
+        if previous.get("model_name") != info["model_name"]:
+            raise SystemExit(f"❌ В {work_dir} шарды модели {previous.get('model_name')}, а сейчас {info['model_name']}. "
+                             f"Запустите с --restart")
+    with open(path, "w", encoding="utf-8") as build_file:
+        json.dump(info, build_file, ensure_ascii=False, indent=2)
+
+
+def iter_catalog(collection):
+    """Потоково отдаёт (ключ, фильм) для фильмов каталога так же, как их загружает сервис"""
+    from search_service import METADATA_PROJECTION, TurboMovieSearch, movie_key
+
+    seen_keys = set()
+    for doc in collection.find({}, METADATA_PROJECTION).sort("_id", 1).batch_size(1000):
+        movie = TurboMovieSearch._clean_movie(doc)
+        if movie is None:
+            continue
+        key = movie_key(movie)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        yield key, movie
+
+
+def merge_shards(work_dir, keys, output):
+    """Сливает шарды в итоговый файл эмбеддингов в порядке keys; возвращает число строк"""
+    from embedding_store import ids_path_for
+
+    shards = _completed_shards(work_dir)
+    available = set()
+    for shard in shards:
+        available.update(np.load(_shard_paths(work_dir, shard)[1]).tolist())
+
+    # В итоговый файл попадают только фильмы, которые есть в каталоге сейчас
+    present = [key for key in keys if key in available]
+    position = {key: row for row, key in enumerate(present)}
+    if not present:
+        raise SystemExit("❌ Нет ни одного эмбеддинга для слияния")
+
+    dim = np.load(_shard_paths(work_dir, shards[0])[0], mmap_mode="r").shape[1]
+    tmp_output = f"{output}.tmp.npy"
+    merged = np.lib.format.open_memmap(tmp_output, mode="w+", dtype=np.float32, shape=(len(present), dim))
+    for shard in shards:
+        vectors_path, ids_path = _shard_paths(work_dir, shard)
+        rows = np.array([position.get(movie_id, -1) for movie_id in np.load(ids_path).tolist()], dtype=np.int64)
+        found = rows >= 0
+        if found.any():
+            merged[rows[found]] = np.load(vectors_path, mmap_mode="r")[found]
+    merged.flush()
+    del merged
+
+    np.save(ids_path_for(output), np.asarray(present, dtype=np.int64))
+    os.replace(tmp_output, output)
+    return len(present)
+
+
+def build(collection, work_dir, output, workers, batch_size, shard_size, retries, restart=False):
+    from query_encoder import DEFAULT_MODEL_NAME
+
+    start_time = time()
+    _check_build_info(work_dir, {
+        "model_name": os.getenv("ENCODER_MODEL_NAME", DEFAULT_MODEL_NAME),
+        "shard_size": shard_size
+    }, restart)
+
+    shards = _completed_shards(work_dir)
+    done_ids = set()
+    for shard in shards:
+        done_ids.update(np.load(_shard_paths(work_dir, shard)[1]).tolist())
+    next_shard = shards[-1] + 1 if shards else 0
+    if done_ids:
+        print(f"♻️ Продолжение сборки: {len(done_ids)} фильмов уже закодировано в {len(shards)} шардах")
+
+    keys = []
+    movies_by_id = {}
+    failures = {}
+    encoded = 0
+
+    threads = int(os.getenv("ENCODER_THREADS", 0)) or max(1, (os.cpu_count() or 1) // max(workers, 1))
+    if workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads,)
+        )
+    else:
+        # Без пула: кодирование в текущем процессе
+        _init_worker(threads)
+        executor = None
+    pending = set()
+
+    def collect(result):
+        nonlocal encoded
+        shard, ids, vectors, shard_failures = result
+        if ids:
+            _write_shard(work_dir, shard, ids, vectors)
+        encoded += len(ids)
+        for movie_id, error in shard_failures.items():
+            movie = movies_by_id.get(movie_id, {})
+            failures[movie_id] = {"mongodb_id": movie.get("mongodb_id"), "name": movie.get("name"), "error": error}
+        for movie_id in ids:
+            movies_by_id.pop(movie_id, None)
+        for movie_id in shard_failures:
+            movies_by_id.pop(movie_id, None)
+        print(f"📦 Шард {shard}: {len(ids)} эмбеддингов, {len(shard_failures)} ошибок "
+              f"(всего {encoded}, {encoded / (time() - start_time):.1f} фильмов/сек)")
+
+    def submit(ids, texts):
+        nonlocal next_shard
+        if executor is None:
+            collect(_encode_shard(next_shard, ids, texts, batch_size, retries))
+        else:
+            # Ограничиваем число шардов в очереди, чтобы не держать весь каталог в памяти
+            while len(pending) >= workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(finished)
+                for future in finished:
+                    collect(future.result())
+            pending.add(executor.submit(_encode_shard, next_shard, ids, texts, batch_size, retries))
+        next_shard += 1
+
+    from search_service import TurboMovieSearch
+
+    try:
+        buffer_ids, buffer_texts = [], []
+        for key, movie in iter_catalog(collection):
+            keys.append(key)
+            if key in done_ids:
+                continue
+            movies_by_id[key] = {"mongodb_id": movie["mongodb_id"], "name": movie.get("name")}
+            buffer_ids.append(key)
+            buffer_texts.append(TurboMovieSearch._movie_text(movie))
+            if len(buffer_ids) >= shard_size:
+                submit(buffer_ids, buffer_texts)
+                buffer_ids, buffer_texts = [], []
+        if buffer_ids:
+            submit(buffer_ids, buffer_texts)
+
+        if pending:
+            finished, _ = wait(pending)
+            for future in finished:
+                collect(future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    with open(os.path.join(work_dir, FAILURES_FILE), "w", encoding="utf-8") as failures_file:
+        json.dump([{"id": movie_id, **info} for movie_id, info in failures.items()],
+                  failures_file, ensure_ascii=False, indent=2)
+
+    count = merge_shards(work_dir, keys, output)
+    print(f"✅ {output}: {count} эмбеддингов из {len(keys)} фильмов каталога, "
+          f"закодировано в этом запуске {encoded} за {time() - start_time:.1f} сек")
+    if failures:
+        print(f"⚠️ Не удалось закодировать {len(failures)} фильмов, список в {os.path.join(work_dir, FAILURES_FILE)}. "
+              f"Повторный запуск попробует их снова")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-генерация эмбеддингов фильмов")
+    parser.add_argument("--output", default=os.getenv("EMBEDDINGS_FILE", "movies_embeddings.npy"),
+                        help="Итоговый файл эмбеддингов (EMBEDDINGS_FILE)")
+    parser.add_argument("--work-dir", default="embeddings_build", help="Каталог шардов и контрольных точек")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Число процессов кодирования (0 - без пула)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--shard-size", type=int, default=4096, help="Число фильмов в шарде")
+    parser.add_argument("--retries", type=int, default=3, help="Число попыток кодирования пакета")
+    parser.add_argument("--restart", action="store_true", help="Удалить шарды прошлой сборки и начать заново")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://mongodb:27017")
+    collection = MongoClient(mongo_uri)[os.getenv("MONGO_DB", "movies_db")][os.getenv("MONGO_COLLECTION", "movies")]
+
+    failures = build(collection, args.work_dir, args.output, args.workers, args.batch_size,
+                     args.shard_size, args.retries, restart=args.restart)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Сборка версионированного артефакта поискового индекса.
+
+Пример:
+    SEARCH_ARTIFACT_DIR=/app/search_index python build_index.py
+
+Загружает фильмы из MongoDB и эмбеддинги (EMBEDDINGS_FILE), строит индекс по
+INDEX_TYPE и записывает новую версию артефакта, которую search-service
+загрузит при следующем старте без перестроения.
+"""
+import argparse
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка артефакта поискового индекса")
+    parser.add_argument("--output", default=os.getenv("SEARCH_ARTIFACT_DIR", "search_index"),
+                        help="Каталог артефактов (SEARCH_ARTIFACT_DIR)")
+    args = parser.parse_args()
+
+    os.environ["SEARCH_ARTIFACT_DIR"] = args.output
+
+    from search_service import TurboMovieSearch
+
+    searcher = TurboMovieSearch(use_artifact=False)
+    path = searcher.write_artifact()
+    if not path:
+        sys.exit(1)
+    print(f"✅ Артефакт записан: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Двухуровневый кэш эмбеддингов поисковых запросов.
+
+Ключ - нормализованный текст запроса (пробелы схлопываются, Unicode NFC) и имя
+модели кодировщика, фильтры в ключ не входят: один и тот же текст с разными
+фильтрами кодируется один раз.
+
+L1 - LRU в памяти процесса (ResultCache), L2 - общий Redis (EMBEDDING_CACHE_REDIS_URL),
+где вектор хранится компактно в виде байтов float16. L2 переживает перезапуски и
+общий для всех реплик search-service. Ошибки Redis не ломают поиск: запрос просто
+кодируется заново, а обращения к Redis приостанавливаются на EMBEDDING_CACHE_REDIS_BACKOFF
+секунд.
+"""
+import os
+import hashlib
+import logging
+import unicodedata
+from time import monotonic
+
+import numpy as np
+
+from result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "search:emb"
+
+
+def normalize_query_text(text):
+    """Нормализованный текст запроса для ключа кэша и кодирования"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов запросов: LRU в памяти процесса и float16 в Redis"""
+
+    def __init__(self, model_name, max_entries=10000, redis_client=None, redis_ttl=7 * 24 * 3600, redis_backoff=30.0):
+        self.model_name = model_name
+        self.model_tag = hashlib.sha1(model_name.encode()).hexdigest()[:12]
+        self.memory = ResultCache(max_entries=max_entries, max_bytes=max_entries * 8192, ttl=0)
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.redis_backoff = redis_backoff
+        self.redis_disabled_until = 0.0
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    @classmethod
+    def from_env(cls, model_name):
+        redis_client = None
+        redis_url = os.getenv("EMBEDDING_CACHE_REDIS_URL")
+        if redis_url:
+            import redis
+
+            timeout = float(os.getenv("EMBEDDING_CACHE_REDIS_TIMEOUT", 0.1))
+            redis_client = redis.Redis.from_url(redis_url, socket_timeout=timeout, socket_connect_timeout=timeout)
+            logger.info(f"🗄 Кэш эмбеддингов запросов в Redis: {redis_url}")
+        return cls(
+            model_name,
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000)),
+            redis_client=redis_client,
+            redis_ttl=int(os.getenv("EMBEDDING_CACHE_REDIS_TTL", 7 * 24 * 3600)),
+            redis_backoff=float(os.getenv("EMBEDDING_CACHE_REDIS_BACKOFF", 30))
+        )
+
+    def _redis_key(self, text):
+        return f"{KEY_PREFIX}:{self.model_tag}:{hashlib.sha1(text.encode()).hexdigest()}"
+
+    def _redis_available(self):
+        return self.redis is not None and monotonic() >= self.redis_disabled_until
+
+    def _redis_failed(self, e):
+        self.redis_errors += 1
+        self.redis_disabled_until = monotonic() + self.redis_backoff
+        logger.warning(f"⚠️ Кэш эмбеддингов в Redis недоступен, пауза {self.redis_backoff:.0f} сек: {str(e)}")
+
+    def get_many(self, texts):
+        """Эмбеддинги нормализованных текстов из кэша: {текст: float32-вектор}"""
+        found = {}
+        missing = []
+        for text in texts:
+            vector = self.memory.get(text, version=self.model_name)
+            if vector is not None:
+                found[text] = vector
+            else:
+                missing.append(text)
+
+        if missing and self._redis_available():
+            try:
+                values = self.redis.mget([self._redis_key(text) for text in missing])
+            except Exception as e:
+                self._redis_failed(e)
+                values = []
+            for text, value in zip(missing, values):
+                if value is None:
+                    self.redis_misses += 1
+                    continue
+                self.redis_hits += 1
+                vector = np.frombuffer(value, dtype=np.float16).astype(np.float32)
+                found[text] = vector
+                self.memory.set(text, vector, version=self.model_name, size=vector.nbytes)
+        return found
+
+    def set_many(self, texts, vectors):
+        """Сохраняет эмбеддинги нормализованных текстов на обоих уровнях"""
+        for text, vector in zip(texts, vectors):
+            self.memory.set(text, vector, version=self.model_name, size=vector.nbytes)
+
+        if texts and self._redis_available():
+            try:
+                pipeline = self.redis.pipeline(transaction=False)
+                for text, vector in zip(texts, vectors):
+                    pipeline.set(self._redis_key(text), np.asarray(vector, dtype=np.float16).tobytes(), ex=self.redis_ttl)
+                pipeline.execute()
+            except Exception as e:
+                self._redis_failed(e)
+
+    def stats(self):
+        """Статистика для /status"""
+        memory = self.memory.stats()
+        return {
+            "memory_entries": memory["entries"],
+            "memory_hits": memory["hits"],
+            "memory_misses": memory["misses"],
+            "memory_evictions": memory["evictions"],
+            "redis": self.redis is not None,
+            "redis_hits": self.redis_hits,
+            "redis_misses": self.redis_misses,
+            "redis_errors": self.redis_errors
+        }
@@ -0,0 +1,207 @@
+"""
+Хранилище эмбеддингов фильмов для search-service.
+
+Держит единственную непрерывную нормализованную матрицу (float32 или float16),
+которую совместно используют точный поиск и ранжирование. Для float16 скалярные
+произведения считаются блоками с накоплением во float32.
+
+Нормализованную матрицу можно сохранить на диск и открыть через mmap только для
+чтения: тогда несколько процессов-воркеров делят одни и те же страницы page cache.
+
+Строки матрицы привязаны к id фильмов (Кинопоиск) через выровненный массив int64,
+который хранится рядом с матрицей (<имя>.ids.npy), и словарь id -> номер строки.
+Это позволяет искать, добавлять/обновлять и удалять векторы по id, не завязываясь
+на порядок документов в MongoDB.
+"""
+import os
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DTYPES = ("float32", "float16")
+
+# Размер блока строк при вычислениях над float16-матрицей
+CHUNK_ROWS = 16384
+
+
+def normalize_inplace(vectors):
+    """L2-нормализация строк float32-матрицы без дополнительной копии N x d"""
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    norms[norms == 0] = 1.0
+    vectors /= norms[:, np.newaxis]
+    return vectors
+
+
+def ids_path_for(path):
+    """Путь к файлу id, сопровождающему файл матрицы"""
+    return f"{os.path.splitext(path)[0]}.ids.npy"
+
+
+class EmbeddingStore:
+    """Единственная копия нормализованной матрицы эмбеддингов с привязкой строк к id фильмов"""
+
+    def __init__(self, vectors, ids=None, dtype="float32", normalized=False):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Неизвестный тип хранения эмбеддингов: {dtype}. Допустимые значения: {', '.join(STORAGE_DTYPES)}")
+
+        self.dtype = np.dtype(dtype)
+        vectors = np.asarray(vectors)
+
+        if normalized and vectors.dtype == self.dtype:
+            self.vectors = np.ascontiguousarray(vectors)
+        else:
+            # Копия во float32 создаётся только если исходная матрица другого типа
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            if not vectors.flags.writeable:
+                vectors = vectors.copy()
+            if not normalized:
+                normalize_inplace(vectors)
+            self.vectors = vectors if self.dtype == np.float32 else vectors.astype(self.dtype)
+
+        # Путь к файлу, если матрица открыта через mmap
+        self.mmap_path = None
+        self.set_ids(ids)
+
+    def set_ids(self, ids):
+        """Задаёт id фильмов для строк матрицы (None - id неизвестны)"""
+        if ids is None:
+            self.ids = None
+            self.id_to_row = {}
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) != self.count:
+            raise ValueError(f"Число id ({len(ids)}) не совпадает с числом векторов ({self.count})")
+        self.ids = ids
+        self.id_to_row = {movie_id: row for row, movie_id in enumerate(ids.tolist())}
+        if len(self.id_to_row) != len(ids):
+            raise ValueError("В хранилище эмбеддингов есть повторяющиеся id")
+
+    def __contains__(self, movie_id):
+        return movie_id in self.id_to_row
+
+    def rows_for(self, movie_ids):
+        """Номера строк для списка id (-1 для отсутствующих)"""
+        return np.array([self.id_to_row.get(int(movie_id), -1) for movie_id in movie_ids], dtype=np.int64)
+
+    def with_changes(self, upsert_ids=(), vectors=None, delete_ids=()):
+        """
+        Возвращает новое хранилище, в котором удалены delete_ids, а векторы upsert_ids
+        добавлены или заменены. Сохранённые строки идут в прежнем порядке, векторы
+        upsert_ids - в конце матрицы. Текущее хранилище не меняется, поэтому поиски,
+        которые идут параллельно с обновлением, продолжают работать со старой копией.
+
+        Возвращает (хранилище, keep), где keep - маска сохранённых строк текущей матрицы.
+        """
+        upsert_ids = np.asarray(upsert_ids, dtype=np.int64)
+        delete_ids = np.asarray(delete_ids, dtype=np.int64)
+        dropped = self.rows_for(np.concatenate([delete_ids, upsert_ids]))
+
+        keep = np.ones(self.count, dtype=bool)
+        keep[dropped[dropped >= 0]] = False
+        kept = int(keep.sum())
+
+        # Одна новая матрица без промежуточных копий
+        new_vectors = np.empty((kept + len(upsert_ids), self.dim), dtype=self.dtype)
+        np.compress(keep, self.vectors, axis=0, out=new_vectors[:kept])
+        if len(upsert_ids):
+            new_vectors[kept:] = normalize_inplace(np.array(vectors, dtype=np.float32).reshape(len(upsert_ids), -1))
+
+        store = EmbeddingStore(new_vectors, ids=np.concatenate([self.ids[keep], upsert_ids]),
+                               dtype=self.dtype.name, normalized=True)
+        return store, keep
+
+    @staticmethod
+    def load_ids(path, ids_path=None):
+        """Загружает массив id, сопровождающий файл матрицы (None, если его нет)"""
+        ids_path = ids_path or ids_path_for(path)
+        return np.load(ids_path) if os.path.exists(ids_path) else None
+
+    @classmethod
+    def open_mmap(cls, path, ids_path=None):
+        """Открывает сохранённую нормализованную матрицу через mmap (только чтение)"""
+        vectors = np.load(path, mmap_mode="r")
+        store = cls(vectors, ids=cls.load_ids(path, ids_path), dtype=vectors.dtype.name, normalized=True)
+        store.mmap_path = path
+        logger.info(f"✅ Эмбеддинги {vectors.shape} {vectors.dtype.name} открыты через mmap: {path}")
+        return store
+
+    @staticmethod
+    def _atomic_save(path, array):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            np.save(tmp_file, array)
+        os.replace(tmp_path, path)
+
+    def save(self, path, ids_path=None):
+        """Атомарно сохраняет нормализованную матрицу в .npy и id строк рядом с ней"""
+        if self.ids is not None:
+            self._atomic_save(ids_path or ids_path_for(path), self.ids)
+        self._atomic_save(path, self.vectors)
+        logger.info(f"💾 Нормализованные эмбеддинги сохранены в {path}")
+
+    @property
+    def is_mmap(self):
+        return self.mmap_path is not None
+
+    @property
+    def count(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    @property
+    def shape(self):
+        return self.vectors.shape
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes
+
+    def iter_float32_chunks(self, chunk_rows=CHUNK_ROWS):
+        """Итерирует по матрице блоками (start, float32-блок)"""
+        for start in range(0, self.count, chunk_rows):
+            chunk = self.vectors[start:start + chunk_rows]
+            yield start, chunk if chunk.dtype == np.float32 else chunk.astype(np.float32)
+
+    def take(self, rows):
+        """Возвращает float32-копию выбранных строк"""
+        return self.vectors[rows].astype(np.float32, copy=False)
+
+    def dot(self, queries, rows=None, start=0, end=None):
+        """
+        Скалярные произведения строк матрицы с запросами.
+
+        queries - матрица (nq, d) нормализованных запросов;
+        rows - необязательный массив номеров строк, по которым считать;
+        start, end - диапазон строк матрицы, если rows не задан (для поиска по частям).
+        Возвращает float32-матрицу (len(rows) или end - start, nq).
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+
+        if rows is not None:
+            return self.take(rows) @ queries.T
+
+        end = self.count if end is None else end
+        if self.dtype == np.float32:
+            return self.vectors[start:end] @ queries.T
+
+        scores = np.empty((end - start, queries.shape[0]), dtype=np.float32)
+        for offset in range(start, end, CHUNK_ROWS):
+            chunk = self.vectors[offset:min(offset + CHUNK_ROWS, end)].astype(np.float32)
+            np.matmul(chunk, queries.T, out=scores[offset - start:offset - start + len(chunk)])
+        return scores
+
+    def describe(self):
+        """Параметры хранилища для /status"""
+        return {
+            "dtype": self.dtype.name,
+            "shape": list(self.shape),
+            "size_mb": round(self.nbytes / (1024 * 1024), 1),
+            "mmap": self.is_mmap
+        }
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Экспорт модели кодировщика запросов в ONNX для LocalQueryEncoder.
+
+Пример:
+    python export_encoder.py --output model_cache/e5-onnx --quantize
+
+В каталоге появятся model.onnx, model_quantized.onnx (с --quantize) и файлы токенизатора.
+Экспорт требует доступа к модели (сеть или локальный кэш), дальнейшая работа сервиса - нет.
+"""
+import argparse
+import os
+
+from query_encoder import DEFAULT_MODEL_NAME, QUERY_PREFIX
+
+
+def export(model_name, output_dir, quantize=False, opset=14):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    sample = tokenizer([f"{QUERY_PREFIX}фильм про космос"], return_tensors="pt")
+    onnx_path = os.path.join(output_dir, "model.onnx")
+
+    print(f"📦 Экспорт {model_name} в {onnx_path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=opset
+        )
+    tokenizer.save_pretrained(output_dir)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantized_path = os.path.join(output_dir, "model_quantized.onnx")
+        print(f"🗜 Int8-квантование в {quantized_path}...")
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+
+    print("✅ Экспорт завершён")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт кодировщика запросов в ONNX")
+    parser.add_argument("--model", default=os.getenv("ENCODER_MODEL_NAME", DEFAULT_MODEL_NAME))
+    parser.add_argument("--output", default=os.getenv("LOCAL_ENCODER_PATH", "model_cache/e5-onnx"))
+    parser.add_argument("--quantize", action="store_true", help="Дополнительно сохранить int8-квантованную модель")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    export(args.model, args.output, quantize=args.quantize, opset=args.opset)
@@ -0,0 +1,31 @@
+"""
+Настройки gunicorn для search-service.
+
+Поисковая система загружается один раз в мастер-процессе (preload_app + when_ready),
+до запуска воркеров: артефакт или эмбеддинги читаются и, если нужно, записываются
+единственным процессом, а воркеры получают готовый индекс через fork и делят с мастером
+страницы матрицы, открытой через mmap. Мастер не запускает фоновых потоков и не держит
+модель кодировщика: после fork каждый воркер создаёт собственный клиент MongoDB,
+загружает и прогревает модель (ONNX Runtime не переживает fork) и запускает фоновые потоки.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5002)}"
+workers = int(os.getenv("SEARCH_WORKERS", 1))
+threads = int(os.getenv("SEARCH_WORKER_THREADS", 8))
+worker_class = "gthread"
+# Обновление каталога может кодировать много фильмов в запросе /update_index
+timeout = int(os.getenv("SEARCH_WORKER_TIMEOUT", 600))
+preload_app = True
+
+
+def when_ready(server):
+    from search_service import get_turbo_movie_search_instance
+
+    get_turbo_movie_search_instance(preload=True)
+
+
+def post_fork(server, worker):
+    from search_service import get_turbo_movie_search_instance
+
+    get_turbo_movie_search_instance().after_fork()
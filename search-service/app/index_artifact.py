@@ -0,0 +1,271 @@
+"""
+Версионированный артефакт поискового индекса для быстрого холодного старта.
+
+Структура каталога SEARCH_ARTIFACT_DIR:
+    CURRENT                      - имя актуальной версии
+    <version>/manifest.json      - модель, параметры индекса, водяной знак каталога и sha256 файлов
+    <version>/embeddings.npy     - нормализованная матрица эмбеддингов (открывается через mmap)
+    <version>/ids.npy            - id фильмов, выровненные по строкам матрицы (ключи EmbeddingStore)
+    <version>/catalog/           - колонки MovieCatalog: массивы .npy, байты строк .bin и
+                                   catalog.json с таблицами значений (открываются через mmap)
+    <version>/index.faiss        - индекс FAISS (для типов кроме flat)
+    <version>/deltas/<N>.npz     - журнал дельт: изменения каталога после записи версии
+
+Повреждённый артефакт определяется по контрольным суммам файлов (включая файлы колонок
+каталога). Обновление каталога не переписывает версию целиком: в журнал дописывается
+только дельта (изменённые векторы, документы и удаления), а при загрузке дельты
+применяются к версии по порядку. Полная версия записывается заново редко (сжатие
+журнала), а изменения MongoDB после последней дельты догоняются по водяному знаку.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import zipfile
+from datetime import datetime, timezone
+from time import time
+
+import faiss
+import numpy as np
+
+from embedding_store import EmbeddingStore
+from movie_catalog import MovieCatalog
+from vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 3
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.npy"
+CATALOG_DIR = "catalog"
+INDEX_FILE = "index.faiss"
+DELTAS_DIR = "deltas"
+
+
+class ArtifactError(Exception):
+    """Артефакт отсутствует, повреждён или не соответствует текущей конфигурации"""
+
+
+class SearchArtifact:
+    """Загруженный артефакт: метаданные, хранилище эмбеддингов и индекс"""
+
+    def __init__(self, version, manifest, metadata, ids, store, index):
+        self.version = version
+        self.manifest = manifest
+        self.metadata = metadata
+        self.ids = ids
+        self.store = store
+        self.index = index
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _list_files(directory):
+    """Относительные пути всех файлов каталога (рекурсивно, в стабильном порядке)"""
+    files = []
+    for current, dirs, names in os.walk(directory):
+        dirs.sort()
+        files.extend(os.path.relpath(os.path.join(current, name), directory) for name in sorted(names))
+    return files
+
+
+def current_version(root):
+    """Имя актуальной версии артефакта или None"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as current_file:
+            return current_file.read().strip() or None
+    except OSError:
+        return None
+
+
+def _prune_versions(root, keep):
+    """Удаляет старые версии артефакта, оставляя keep последних"""
+    versions = sorted(name for name in os.listdir(root)
+                      if not name.startswith(".") and os.path.isdir(os.path.join(root, name)))
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        logger.info(f"🗑 Удалена старая версия артефакта {name}")
+
+
+def write_artifact(root, metadata, store, vector_index, model_name, watermark, keep_versions=3):
+    """
+    Записывает новую версию артефакта и делает её актуальной.
+    watermark - сериализованный водяной знак каталога, которому соответствует версия.
+    """
+    start_time = time()
+    os.makedirs(root, exist_ok=True)
+
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}-{vector_index.index_type}"
+    tmp_dir = os.path.join(root, f".{version}.tmp")
+    os.makedirs(tmp_dir)
+    try:
+        manifest = _write_files(tmp_dir, version, metadata, store, vector_index, model_name, watermark)
+        os.rename(tmp_dir, os.path.join(root, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # Атомарно переключаем указатель на новую версию
+    current_tmp = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(current_tmp, "w") as current_file:
+        current_file.write(version)
+    os.replace(current_tmp, os.path.join(root, CURRENT_FILE))
+
+    _prune_versions(root, keep_versions)
+
+    logger.info(f"💾 Артефакт индекса {version} ({manifest['count']} фильмов) записан за {time() - start_time:.2f} сек")
+    return os.path.join(root, version)
+
+
+def _write_files(tmp_dir, version, metadata, store, vector_index, model_name, watermark):
+    """Записывает файлы артефакта и манифест в каталог tmp_dir (metadata - MovieCatalog)"""
+    if store.ids is None:
+        raise ArtifactError("Хранилище эмбеддингов без id строк нельзя сохранить в артефакт")
+    store.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), ids_path=os.path.join(tmp_dir, IDS_FILE))
+
+    metadata.save(os.path.join(tmp_dir, CATALOG_DIR))
+
+    if vector_index.index is not None:
+        faiss.write_index(vector_index.index, os.path.join(tmp_dir, INDEX_FILE))
+
+    files = {}
+    for name in _list_files(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        files[name] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "model_name": model_name,
+        "catalog_watermark": watermark,
+        "count": store.count,
+        "dim": store.dim,
+        "embeddings_dtype": store.dtype.name,
+        "index": vector_index.describe(),
+        "files": files
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_artifact(root, model_name, index_type, embeddings_dtype, mmap=True, verify=True):
+    """
+    Загружает актуальную версию артефакта (без журнала дельт, см. read_deltas).
+
+    Бросает ArtifactError, если артефакт отсутствует, повреждён (sha256 не совпадает)
+    или построен для другой модели, типа индекса или типа хранения.
+    """
+    start_time = time()
+    version = current_version(root)
+    if not version:
+        raise ArtifactError(f"В {root} нет актуального артефакта")
+
+    artifact_dir = os.path.join(root, version)
+    try:
+        with open(os.path.join(artifact_dir, MANIFEST_FILE), encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"Не удалось прочитать манифест {version}: {str(e)}")
+
+    expected = {
+        "format_version": FORMAT_VERSION,
+        "model_name": model_name,
+        "embeddings_dtype": embeddings_dtype
+    }
+    for key, value in expected.items():
+        if manifest.get(key) != value:
+            raise ArtifactError(f"Артефакт {version} не соответствует: {key}={manifest.get(key)!r}, ожидалось {value!r}")
+    if manifest["index"]["type"] != index_type:
+        raise ArtifactError(f"Артефакт {version} построен для индекса {manifest['index']['type']}, ожидался {index_type}")
+
+    if verify:
+        for name, info in manifest["files"].items():
+            path = os.path.join(artifact_dir, name)
+            if not os.path.exists(path) or _sha256(path) != info["sha256"]:
+                raise ArtifactError(f"Контрольная сумма файла {name} в артефакте {version} не совпадает")
+
+    embeddings_path = os.path.join(artifact_dir, EMBEDDINGS_FILE)
+    ids_path = os.path.join(artifact_dir, IDS_FILE)
+    try:
+        if mmap:
+            store = EmbeddingStore.open_mmap(embeddings_path, ids_path=ids_path)
+        else:
+            store = EmbeddingStore(np.load(embeddings_path), ids=np.load(ids_path),
+                                   dtype=embeddings_dtype, normalized=True)
+    except ValueError as e:
+        raise ArtifactError(f"Не удалось открыть эмбеддинги артефакта {version}: {str(e)}")
+    if store.ids is None:
+        raise ArtifactError(f"В артефакте {version} нет id строк")
+    ids = store.ids
+
+    try:
+        metadata = MovieCatalog.load(os.path.join(artifact_dir, CATALOG_DIR), keys=ids)
+    except (OSError, ValueError, KeyError) as e:
+        raise ArtifactError(f"Не удалось открыть каталог артефакта {version}: {str(e)}")
+
+    if not (len(metadata) == len(ids) == store.count == manifest["count"]):
+        raise ArtifactError(f"Размеры файлов артефакта {version} не согласованы")
+
+    index_path = os.path.join(artifact_dir, INDEX_FILE)
+    faiss_index = faiss.read_index(index_path) if os.path.exists(index_path) else None
+    vector_index = VectorIndex.from_description(manifest["index"]).attach(store, faiss_index)
+
+    logger.info(f"✅ Артефакт индекса {version} загружен за {time() - start_time:.2f} сек: {store.count} фильмов")
+    return SearchArtifact(version, manifest, metadata, ids, store, vector_index)
+
+
+def _delta_seq(name):
+    stem, ext = os.path.splitext(name)
+    return int(stem) if ext == ".npz" and stem.isdigit() else None
+
+
+def append_delta(root, version, arrays):
+    """
+    Дописывает запись в журнал дельт версии version и возвращает её номер.
+    Запись появляется атомарно (временный файл + os.replace); вызывающий держит
+    блокировку писателя, поэтому номера не пересекаются.
+    """
+    deltas_dir = os.path.join(root, version, DELTAS_DIR)
+    os.makedirs(deltas_dir, exist_ok=True)
+    seq = max((_delta_seq(name) or 0 for name in os.listdir(deltas_dir)), default=0) + 1
+    path = os.path.join(deltas_dir, f"{seq:06d}.npz")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as target:
+            np.savez(target, **arrays)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return seq
+
+
+def read_deltas(root, version, after=0):
+    """
+    Записи журнала дельт версии version с номером больше after: список (номер, массивы)
+    по порядку. Бросает ArtifactError, если запись повреждена (CRC архива npz).
+    """
+    deltas_dir = os.path.join(root, version, DELTAS_DIR)
+    if not os.path.isdir(deltas_dir):
+        return []
+    seqs = sorted(seq for seq in map(_delta_seq, os.listdir(deltas_dir)) if seq is not None and seq > after)
+    records = []
+    for seq in seqs:
+        try:
+            with np.load(os.path.join(deltas_dir, f"{seq:06d}.npz")) as record:
+                records.append((seq, {name: record[name] for name in record.files}))
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            raise ArtifactError(f"Не удалось прочитать дельту {seq} артефакта {version}: {str(e)}")
+    return records
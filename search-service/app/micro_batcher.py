@@ -0,0 +1,118 @@
+"""
+Динамическое объединение одновременных вызовов кодировщика в пакеты (micro-batching).
+
+Запросы на кодирование от параллельных поисков попадают в очередь. Фоновый поток
+берёт первый запрос, дожидается остальных не дольше ENCODER_BATCH_MAX_WAIT_MS
+миллисекунд (или пока пакет не наберёт ENCODER_BATCH_MAX_SIZE текстов), кодирует
+всё одним вызовом и раздаёт векторы ожидающим запросам. Одинаковые тексты внутри
+пакета кодируются один раз. Пока кодировщик занят, новые запросы накапливаются и
+уходят следующим пакетом, поэтому под нагрузкой пакеты растут сами, а одиночный
+запрос ждёт не больше max_wait.
+"""
+import os
+import queue
+import threading
+from time import monotonic
+
+import numpy as np
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Объединяет одновременные вызовы encode_fn(texts) в пакеты"""
+
+    def __init__(self, encode_fn, max_batch=32, max_wait=0.002):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.worker = None
+        self.start_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    @classmethod
+    def from_env(cls, encode_fn):
+        return cls(
+            encode_fn,
+            max_batch=int(os.getenv("ENCODER_BATCH_MAX_SIZE", 32)),
+            max_wait=float(os.getenv("ENCODER_BATCH_MAX_WAIT_MS", 2)) / 1000
+        )
+
+    @property
+    def enabled(self):
+        return self.max_batch > 1
+
+    def encode(self, texts):
+        """Векторы для texts; вызов блокируется до обработки пакета, в который он попал"""
+        if not self.enabled:
+            return self.encode_fn(texts)
+
+        self._ensure_worker()
+        request = _Request(list(texts))
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _ensure_worker(self):
+        if self.worker is not None:
+            return
+        with self.start_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="encoder-micro-batcher", daemon=True)
+                self.worker.start()
+
+    def _collect(self):
+        """Первый запрос из очереди и те, что успели прийти за max_wait"""
+        batch = [self.queue.get()]
+        size = len(batch[0].texts)
+        deadline = monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - monotonic()
+            try:
+                request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            unique = list(dict.fromkeys(text for request in batch for text in request.texts))
+            try:
+                vectors = np.asarray(self.encode_fn(unique), dtype=np.float32)
+                positions = {text: i for i, text in enumerate(unique)}
+                for request in batch:
+                    request.result = vectors[[positions[text] for text in request.texts]]
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                self.batches += 1
+                self.requests += len(batch)
+                self.texts += len(unique)
+                for request in batch:
+                    request.done.set()
+
+    def stats(self):
+        """Статистика для /status"""
+        return {
+            "enabled": self.enabled,
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_texts": round(self.texts / self.batches, 2) if self.batches else 0.0
+        }
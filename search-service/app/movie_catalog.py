@@ -0,0 +1,715 @@
+"""
+Колоночный каталог метаданных фильмов для search-service.
+
+Вместо списка документов MongoDB (словари с вложенными рейтингами, постерами, жанрами
+и странами - сотни байт накладных расходов Python на каждый фильм) метаданные хранятся
+колонками, выровненными по строкам EmbeddingStore:
+
+    строки (название, mongodb_id)             - UTF-8 байты подряд + смещения int64
+    описания (HEAVY_FIELDS)                   - отрезки [начало, конец) в общих буферах байт
+    тип и категория                           - коды int32 + таблица значений
+    жанры и страны                            - CSR: смещения int64 + коды int32 + таблица значений
+    id и год                                  - int64
+    рейтинг                                   - float64 по ключам (kp, imdb, ...), NaN - нет значения
+    постер                                    - строковые колонки по ключам (url, previewUrl)
+
+Документ фильма (словарь) собирается только при обращении к строке, то есть только для
+итоговых результатов поиска. Значения, которые не укладываются в схему колонок (например,
+строковый постер или неизвестное поле), хранятся как есть в разреженном словаре extra.
+
+Длинные тексты (HEAVY_FIELDS) в ранжировании не участвуют: spill() переносит их байты
+в файлы, открытые через mmap только для чтения. В памяти процесса остаются смещения,
+а страницы с текстами подгружаются ядром только для показанных фильмов и вытесняются
+из page cache при нехватке памяти. take() и concat() строковых и текстовых колонок
+не копируют байты, поэтому каталог после дельты по-прежнему ссылается на общие файлы,
+а в памяти процесса появляются только строки новых фильмов.
+
+save()/load() сохраняют каталог в каталог артефакта без JSON-документов: массивы колонок -
+файлами .npy, байты строк - файлами .bin, таблицы значений и разреженные extra - в
+catalog.json. load() открывает массивы и байты через mmap только для чтения, поэтому
+загрузка не разбирает документы, а процессы, открывшие один артефакт, делят страницы.
+"""
+import os
+import json
+import mmap
+import math
+import hashlib
+import tempfile
+
+import numpy as np
+
+CATALOG_META_FILE = "catalog.json"
+
+
+def movie_key(movie):
+    """Ключ фильма в хранилище эмбеддингов: id Кинопоиска (или числовой _id)"""
+    for field in ("id", "_id"):
+        value = movie.get(field)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    # Для документов без числового id используем стабильный 63-битный хэш ObjectId
+    object_id = movie.get("mongodb_id") or str(movie.get("_id"))
+    return int.from_bytes(hashlib.blake2b(object_id.encode(), digest_size=8).digest(), "big") >> 1
+
+
+# Длинные текстовые поля: нужны только для ответа и эмбеддингов, в ранжировании не участвуют
+HEAVY_FIELDS = ("description", "shortDescription")
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _save_array(path, array):
+    np.save(path, np.ascontiguousarray(array))
+
+
+def _load_array(path):
+    """Массив .npy через mmap только для чтения (пустые массивы читаются обычным образом)"""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+def _save_blob(path, data):
+    with open(path, "wb") as target:
+        target.write(data)
+
+
+def _load_blob(path):
+    """Байты файла через mmap только для чтения"""
+    if not os.path.getsize(path):
+        return b""
+    with open(path, "rb") as source:
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _is_mapped(buffer):
+    return isinstance(buffer, (mmap.mmap, np.memmap))
+
+
+def resident_nbytes(buffers):
+    """Байты буферов колонки в памяти процесса"""
+    return sum(len(buffer) if isinstance(buffer, bytes) else buffer.nbytes
+               for buffer in buffers if not _is_mapped(buffer))
+
+
+def mapped_nbytes(buffers):
+    """Байты буферов колонки, отображённых из файлов через mmap"""
+    return sum(len(buffer) if isinstance(buffer, mmap.mmap) else buffer.nbytes
+               for buffer in buffers if _is_mapped(buffer))
+
+
+def _remap_codes(codes, source_values, target_values):
+    """Переводит коды из таблицы source_values в target_values (дополняя её); -1 сохраняется"""
+    positions = {value: code for code, value in enumerate(target_values)}
+    mapping = np.empty(len(source_values), dtype=np.int32)
+    for code, value in enumerate(source_values):
+        if value not in positions:
+            positions[value] = len(target_values)
+            target_values.append(value)
+        mapping[code] = positions[value]
+    if not len(mapping):
+        return codes.copy()
+    return np.where(codes >= 0, mapping[np.maximum(codes, 0)], -1).astype(np.int32)
+
+
+class StringColumn:
+    """
+    Строки одной колонкой: UTF-8 байты подряд и смещения. take() и concat() возвращают
+    TextColumn, который ссылается на те же байты (например, отображённый файл артефакта):
+    после дельты в памяти процесса появляются только строки новых фильмов.
+    """
+
+    def __init__(self, data, offsets, present):
+        self.data = data
+        self.offsets = offsets
+        self.present = present
+
+    @staticmethod
+    def fits(value):
+        return isinstance(value, str)
+
+    @classmethod
+    def build(cls, values):
+        encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        present = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        return cls(b"".join(encoded), offsets, present)
+
+    def get(self, row):
+        if not self.present[row]:
+            return None
+        return self.data[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def as_text(self):
+        """Те же строки отрезками буфера data (без копирования байт)"""
+        return TextColumn([self.data], self.offsets[:-1], self.offsets[1:], self.present)
+
+    def take(self, rows):
+        return self.as_text().take(rows)
+
+    def concat(self, other):
+        return self.as_text().concat(other)
+
+    def save(self, prefix):
+        _save_blob(f"{prefix}.data.bin", self.data)
+        _save_array(f"{prefix}.offsets.npy", self.offsets)
+        _save_array(f"{prefix}.present.npy", self.present)
+        return {}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        return cls(_load_blob(f"{prefix}.data.bin"), _load_array(f"{prefix}.offsets.npy"),
+                   _load_array(f"{prefix}.present.npy"))
+
+    @property
+    def buffers(self):
+        return (self.data, self.offsets, self.present)
+
+
+class TextColumn:
+    """
+    Длинные тексты: строка - отрезок [starts, ends) UTF-8 байт в одном из буферов parts
+    (bytes или mmap). take() и concat() меняют только отрезки и список буферов, не копируя
+    байты. Сохраняется в том же формате, что StringColumn (байты подряд + смещения).
+    """
+
+    def __init__(self, parts, starts, ends, present, part_index=None):
+        self.parts = parts
+        self.starts = starts
+        self.ends = ends
+        self.present = present
+        # Номер буфера для каждой строки; None - все строки в parts[0]
+        self.part_index = part_index
+
+    @staticmethod
+    def fits(value):
+        return isinstance(value, str)
+
+    @classmethod
+    def build(cls, values):
+        return StringColumn.build(values).as_text()
+
+    def get(self, row):
+        if not self.present[row]:
+            return None
+        part = self.parts[0 if self.part_index is None else self.part_index[row]]
+        return part[self.starts[row]:self.ends[row]].decode("utf-8")
+
+    def take(self, rows):
+        return TextColumn(self.parts, self.starts[rows], self.ends[rows], self.present[rows],
+                          None if self.part_index is None else self.part_index[rows])
+
+    def as_text(self):
+        return self
+
+    def _part_indices(self):
+        if self.part_index is None:
+            return np.zeros(len(self.starts), dtype=np.int32)
+        return self.part_index
+
+    def concat(self, other):
+        other = other.as_text()
+        return TextColumn(
+            self.parts + other.parts,
+            np.concatenate([self.starts, other.starts]),
+            np.concatenate([self.ends, other.ends]),
+            np.concatenate([self.present, other.present]),
+            np.concatenate([self._part_indices(), other._part_indices() + len(self.parts)])
+        )
+
+    def spill(self, directory):
+        """Переносит буферы, которые ещё лежат в памяти, в файлы в directory и открывает их через mmap"""
+        parts = []
+        for part in self.parts:
+            if part and not isinstance(part, mmap.mmap):
+                fd, path = tempfile.mkstemp(prefix="catalog_text.", suffix=".bin", dir=directory)
+                try:
+                    with os.fdopen(fd, "wb") as target:
+                        target.write(part)
+                    with open(path, "rb") as source:
+                        part = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+                finally:
+                    # Отображение остаётся действительным и после удаления файла
+                    os.unlink(path)
+            parts.append(part)
+        # Список буферов общий с каталогами, из которых получена колонка, поэтому не меняется на месте
+        self.parts = parts
+
+    def save(self, prefix):
+        """Записывает тексты строк подряд (буферы сжимаются в один файл) и смещения"""
+        lengths = self.ends - self.starts
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        with open(f"{prefix}.data.bin", "wb") as target:
+            if self.part_index is None and np.array_equal(self.starts[1:], self.ends[:-1]):
+                # Строки и так лежат подряд в одном буфере
+                if len(lengths):
+                    target.write(memoryview(self.parts[0])[int(self.starts[0]):int(self.ends[-1])])
+            else:
+                part_indices = self._part_indices()
+                for part, start, end in zip(part_indices.tolist(), self.starts.tolist(), self.ends.tolist()):
+                    target.write(memoryview(self.parts[part])[start:end])
+        _save_array(f"{prefix}.offsets.npy", offsets)
+        _save_array(f"{prefix}.present.npy", self.present)
+        return {}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        offsets = _load_array(f"{prefix}.offsets.npy")
+        return cls([_load_blob(f"{prefix}.data.bin")], offsets[:-1], offsets[1:], _load_array(f"{prefix}.present.npy"))
+
+    @property
+    def buffers(self):
+        arrays = (self.starts, self.ends, self.present) + ((self.part_index,) if self.part_index is not None else ())
+        return tuple(self.parts) + arrays
+
+
+class CodeColumn:
+    """Интернированные строковые значения: коды int32 (-1 - нет значения) и таблица значений"""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    @staticmethod
+    def fits(value):
+        return isinstance(value, str)
+
+    @classmethod
+    def build(cls, values):
+        table = {}
+        codes = np.array([-1 if value is None else table.setdefault(value, len(table)) for value in values],
+                         dtype=np.int32)
+        return cls(codes, list(table))
+
+    def get(self, row):
+        code = self.codes[row]
+        return self.values[code] if code >= 0 else None
+
+    def take(self, rows):
+        return CodeColumn(self.codes[rows], self.values)
+
+    def concat(self, other):
+        values = list(self.values)
+        codes = _remap_codes(other.codes, other.values, values)
+        return CodeColumn(np.concatenate([self.codes, codes]), values)
+
+    def postings(self):
+        """Строки по значениям: {значение: строки}"""
+        order = np.argsort(self.codes, kind="stable")
+        counts = np.bincount(self.codes[self.codes >= 0], minlength=len(self.values))
+        start = int((self.codes < 0).sum())
+        postings = {}
+        for code, count in enumerate(counts.tolist()):
+            postings[self.values[code]] = order[start:start + count].astype(np.int64)
+            start += count
+        return postings
+
+    def save(self, prefix):
+        _save_array(f"{prefix}.codes.npy", self.codes)
+        return {"values": self.values}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        return cls(_load_array(f"{prefix}.codes.npy"), meta["values"])
+
+    @property
+    def buffers(self):
+        return (self.codes,)
+
+
+class ListColumn:
+    """Списки значений ({"name": ...}) в формате CSR: смещения, коды и таблица значений"""
+
+    def __init__(self, offsets, codes, values, present):
+        self.offsets = offsets
+        self.codes = codes
+        self.values = values
+        self.present = present
+
+    @staticmethod
+    def fits(value):
+        return isinstance(value, list) and all(
+            isinstance(item, dict) and len(item) == 1 and isinstance(item.get("name"), str) for item in value
+        )
+
+    @classmethod
+    def build(cls, values):
+        table = {}
+        codes = [table.setdefault(item["name"], len(table)) for items in values if items for item in items]
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(items) if items else 0 for items in values), dtype=np.int64, count=len(values)),
+                  out=offsets[1:])
+        present = np.fromiter((items is not None for items in values), dtype=bool, count=len(values))
+        return cls(offsets, np.asarray(codes, dtype=np.int32), list(table), present)
+
+    def get(self, row):
+        if not self.present[row]:
+            return None
+        return [{"name": self.values[code]} for code in self.codes[self.offsets[row]:self.offsets[row + 1]].tolist()]
+
+    def take(self, rows):
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return ListColumn(offsets, self.codes[positions], self.values, self.present[rows])
+
+    def concat(self, other):
+        values = list(self.values)
+        codes = _remap_codes(other.codes, other.values, values)
+        return ListColumn(
+            np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]),
+            np.concatenate([self.codes, codes]),
+            values,
+            np.concatenate([self.present, other.present])
+        )
+
+    def postings(self):
+        """Строки по значениям: {значение: строки}"""
+        rows = np.repeat(np.arange(len(self.present), dtype=np.int64), np.diff(self.offsets))
+        order = np.argsort(self.codes, kind="stable")
+        counts = np.bincount(self.codes, minlength=len(self.values))
+        postings = {}
+        start = 0
+        for code, count in enumerate(counts.tolist()):
+            postings[self.values[code]] = rows[order[start:start + count]]
+            start += count
+        return postings
+
+    def save(self, prefix):
+        _save_array(f"{prefix}.offsets.npy", self.offsets)
+        _save_array(f"{prefix}.codes.npy", self.codes)
+        _save_array(f"{prefix}.present.npy", self.present)
+        return {"values": self.values}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        return cls(_load_array(f"{prefix}.offsets.npy"), _load_array(f"{prefix}.codes.npy"), meta["values"],
+                   _load_array(f"{prefix}.present.npy"))
+
+    @property
+    def buffers(self):
+        return (self.offsets, self.codes, self.present)
+
+
+class IntColumn:
+    """Целые значения int64 с маской наличия"""
+
+    def __init__(self, values, present):
+        self.values = values
+        self.present = present
+
+    @staticmethod
+    def fits(value):
+        return _is_int(value) and -2 ** 63 <= value < 2 ** 63
+
+    @classmethod
+    def build(cls, values):
+        present = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        return cls(np.array([0 if value is None else value for value in values], dtype=np.int64), present)
+
+    def get(self, row):
+        return int(self.values[row]) if self.present[row] else None
+
+    def take(self, rows):
+        return IntColumn(self.values[rows], self.present[rows])
+
+    def concat(self, other):
+        return IntColumn(np.concatenate([self.values, other.values]), np.concatenate([self.present, other.present]))
+
+    def save(self, prefix):
+        _save_array(f"{prefix}.values.npy", self.values)
+        _save_array(f"{prefix}.present.npy", self.present)
+        return {}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        return cls(_load_array(f"{prefix}.values.npy"), _load_array(f"{prefix}.present.npy"))
+
+    @property
+    def buffers(self):
+        return (self.values, self.present)
+
+
+class NumberDictColumn:
+    """Словари чисел (рейтинги): матрица float64 по ключам, NaN - нет значения"""
+
+    def __init__(self, keys, matrix, present):
+        self.keys = keys
+        self.matrix = matrix
+        self.present = present
+
+    @staticmethod
+    def fits(value):
+        return isinstance(value, dict) and all(
+            isinstance(key, str) and (item is None or (isinstance(item, (int, float)) and not isinstance(item, bool)))
+            for key, item in value.items()
+        )
+
+    @classmethod
+    def build(cls, values):
+        keys = list(dict.fromkeys(key for value in values if value for key in value))
+        positions = {key: i for i, key in enumerate(keys)}
+        matrix = np.full((len(values), len(keys)), np.nan, dtype=np.float64)
+        for row, value in enumerate(values):
+            for key, item in (value or {}).items():
+                if item is not None:
+                    matrix[row, positions[key]] = item
+        present = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        return cls(keys, matrix, present)
+
+    def get(self, row):
+        if not self.present[row]:
+            return None
+        return {key: item for key, item in zip(self.keys, self.matrix[row].tolist()) if not math.isnan(item)}
+
+    def take(self, rows):
+        return NumberDictColumn(self.keys, self.matrix[rows], self.present[rows])
+
+    def concat(self, other):
+        keys = list(dict.fromkeys(self.keys + other.keys))
+        matrix = np.full((len(self.present) + len(other.present), len(keys)), np.nan, dtype=np.float64)
+        for part, offset in ((self, 0), (other, len(self.present))):
+            for i, key in enumerate(part.keys):
+                matrix[offset:offset + len(part.present), keys.index(key)] = part.matrix[:, i]
+        return NumberDictColumn(keys, matrix, np.concatenate([self.present, other.present]))
+
+    def save(self, prefix):
+        _save_array(f"{prefix}.matrix.npy", self.matrix)
+        _save_array(f"{prefix}.present.npy", self.present)
+        return {"keys": self.keys}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        return cls(meta["keys"], _load_array(f"{prefix}.matrix.npy"), _load_array(f"{prefix}.present.npy"))
+
+    @property
+    def buffers(self):
+        return (self.matrix, self.present)
+
+
+class StringDictColumn:
+    """Словари строк (постер: url, previewUrl): строковая колонка на каждый ключ"""
+
+    def __init__(self, columns, present):
+        self.columns = columns
+        self.present = present
+
+    @staticmethod
+    def fits(value):
+        return isinstance(value, dict) and all(
+            isinstance(key, str) and (item is None or isinstance(item, str)) for key, item in value.items()
+        )
+
+    @classmethod
+    def build(cls, values):
+        keys = list(dict.fromkeys(key for value in values if value for key in value))
+        columns = {key: StringColumn.build([(value or {}).get(key) for value in values]) for key in keys}
+        present = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        return cls(columns, present)
+
+    def get(self, row):
+        if not self.present[row]:
+            return None
+        value = {}
+        for key, column in self.columns.items():
+            item = column.get(row)
+            if item is not None:
+                value[key] = item
+        return value
+
+    def take(self, rows):
+        return StringDictColumn({key: column.take(rows) for key, column in self.columns.items()}, self.present[rows])
+
+    def concat(self, other):
+        count, other_count = len(self.present), len(other.present)
+        empty = lambda size: StringColumn.build([None] * size)
+        columns = {}
+        for key in dict.fromkeys(list(self.columns) + list(other.columns)):
+            columns[key] = self.columns.get(key, empty(count)).concat(other.columns.get(key, empty(other_count)))
+        return StringDictColumn(columns, np.concatenate([self.present, other.present]))
+
+    def save(self, prefix):
+        # Ключи словаря - произвольные строки, поэтому файлы нумеруются по порядку ключей
+        for number, column in enumerate(self.columns.values()):
+            column.save(f"{prefix}.{number}")
+        _save_array(f"{prefix}.present.npy", self.present)
+        return {"keys": list(self.columns)}
+
+    @classmethod
+    def load(cls, prefix, meta):
+        columns = {key: StringColumn.load(f"{prefix}.{number}", {}) for number, key in enumerate(meta["keys"])}
+        return cls(columns, _load_array(f"{prefix}.present.npy"))
+
+    @property
+    def buffers(self):
+        return (self.present,) + tuple(buffer for column in self.columns.values() for buffer in column.buffers)
+
+
+# Типы колонок по имени (catalog.json)
+COLUMN_TYPES = {column_type.__name__: column_type for column_type in (
+    StringColumn, TextColumn, CodeColumn, ListColumn, IntColumn, NumberDictColumn, StringDictColumn
+)}
+
+# Схема колонок: поле документа -> тип колонки
+SCHEMA = {
+    "mongodb_id": StringColumn,
+    "id": IntColumn,
+    "name": StringColumn,
+    "alternativeName": StringColumn,
+    "description": TextColumn,
+    "shortDescription": TextColumn,
+    "year": IntColumn,
+    "type": CodeColumn,
+    "category": CodeColumn,
+    "genres": ListColumn,
+    "countries": ListColumn,
+    "rating": NumberDictColumn,
+    "poster": StringDictColumn
+}
+
+
+class MovieCatalog:
+    """Метаданные фильмов по колонкам; catalog[row] собирает документ фильма"""
+
+    def __init__(self, count, columns, keys, extra=None):
+        self.count = count
+        self.columns = columns
+        # Ключи EmbeddingStore (movie_key) по строкам
+        self.keys = keys
+        # Значения вне схемы колонок: {строка: {поле: значение}}
+        self.extra = extra or {}
+
+    @classmethod
+    def from_movies(cls, movies, keys=None):
+        """
+        Каталог из списка документов фильмов (после TurboMovieSearch._clean_movie).
+        keys - готовые ключи строк (например, id из артефакта), иначе считаются movie_key.
+        """
+        movies = list(movies)
+        if keys is None:
+            keys = np.fromiter((movie_key(movie) for movie in movies), dtype=np.int64, count=len(movies))
+        keys = np.asarray(keys, dtype=np.int64)
+        extra = {}
+        columns = {}
+        for field, column_type in SCHEMA.items():
+            values = []
+            for row, movie in enumerate(movies):
+                value = movie.get(field)
+                if value is not None and not column_type.fits(value):
+                    extra.setdefault(row, {})[field] = value
+                    value = None
+                values.append(value)
+            columns[field] = column_type.build(values)
+
+        for row, movie in enumerate(movies):
+            for field, value in movie.items():
+                # ObjectId дублирует mongodb_id; числовой _id сохраняется
+                if field in SCHEMA or (field == "_id" and not _is_int(value)):
+                    continue
+                extra.setdefault(row, {})[field] = value
+        return cls(len(movies), columns, keys, extra)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError(f"Строка {row} вне каталога из {self.count} фильмов")
+        movie = {}
+        for field, column in self.columns.items():
+            value = column.get(row)
+            if value is not None:
+                movie[field] = value
+        extra = self.extra.get(int(row))
+        if extra:
+            movie.update(extra)
+        return movie
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self[row]
+
+    @property
+    def years(self):
+        """Годы по строкам (2000 для фильмов без года)"""
+        column = self.columns["year"]
+        return np.where(column.present, column.values, 2000)
+
+    def mongodb_id(self, row):
+        return self.columns["mongodb_id"].get(row)
+
+    def mongodb_ids(self):
+        return [self.mongodb_id(row) for row in range(self.count)]
+
+    def take(self, rows):
+        """Каталог из строк rows (в указанном порядке)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = {old: new for new, old in enumerate(rows.tolist()) if old in self.extra}
+        return MovieCatalog(
+            len(rows),
+            {field: column.take(rows) for field, column in self.columns.items()},
+            self.keys[rows],
+            {new: self.extra[old] for old, new in positions.items()}
+        )
+
+    def concat(self, other):
+        """Каталог из строк self, за которыми идут строки other"""
+        columns = {field: column.concat(other.columns[field]) for field, column in self.columns.items()}
+        extra = dict(self.extra)
+        extra.update({self.count + row: values for row, values in other.extra.items()})
+        return MovieCatalog(self.count + other.count, columns, np.concatenate([self.keys, other.keys]), extra)
+
+    def patched(self, keep, new_movies):
+        """Каталог после EmbeddingStore.with_changes: строки из маски keep, затем new_movies"""
+        return self.take(np.flatnonzero(keep)).concat(MovieCatalog.from_movies(new_movies))
+
+    def spill(self, directory=None):
+        """Переносит длинные текстовые колонки (HEAVY_FIELDS) в файлы, открытые через mmap"""
+        for field in HEAVY_FIELDS:
+            self.columns[field].spill(directory)
+
+    def save(self, directory):
+        """Сохраняет колонки в directory: массивы .npy, байты строк .bin и catalog.json"""
+        os.makedirs(directory, exist_ok=True)
+        columns = {}
+        for field, column in self.columns.items():
+            meta = column.save(os.path.join(directory, field))
+            columns[field] = dict(meta, type=type(column).__name__)
+        meta = {
+            "count": self.count,
+            "columns": columns,
+            "extra": {str(row): values for row, values in self.extra.items()}
+        }
+        with open(os.path.join(directory, CATALOG_META_FILE), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False, default=str)
+
+    @classmethod
+    def load(cls, directory, keys):
+        """Каталог, сохранённый save(): колонки открываются через mmap только для чтения"""
+        with open(os.path.join(directory, CATALOG_META_FILE), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        columns = {
+            field: COLUMN_TYPES[column_meta["type"]].load(os.path.join(directory, field), column_meta)
+            for field, column_meta in meta["columns"].items()
+        }
+        extra = {int(row): values for row, values in meta["extra"].items()}
+        return cls(meta["count"], columns, np.asarray(keys, dtype=np.int64), extra)
+
+    def stats(self):
+        """Размер колонок для /status: в памяти процесса и отображённых через mmap"""
+        buffers = [buffer for column in self.columns.values() for buffer in column.buffers] + [self.keys]
+        return {
+            "movies": self.count,
+            "columns_mb": round(resident_nbytes(buffers) / (1024 * 1024), 2),
+            "mapped_mb": round(mapped_nbytes(buffers) / (1024 * 1024), 2),
+            "extra_rows": len(self.extra)
+        }
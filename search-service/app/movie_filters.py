@@ -0,0 +1,181 @@
+"""
+Жёсткие фильтры векторного поиска по году, жанру, типу, стране и категории.
+
+FilterIndex строится один раз по метаданным (строки выровнены с EmbeddingStore) и
+хранит для каждого атрибута отсортированные списки строк (posting lists), а годы -
+в отсортированном виде для выборки диапазона через searchsorted. select() возвращает
+номера строк, подходящих под все фильтры: пересечение начинается с самого короткого
+списка, поэтому чем уже фильтр, тем меньше работы и у отбора, и у ранжирования.
+"""
+import re
+
+import numpy as np
+
+# Атрибуты фильма, по которым строятся списки строк
+FILTER_FIELDS = ("genre", "type", "country", "category")
+
+YEAR_RANGE_PATTERN = re.compile(r"^\s*(\d{4})?\s*(?:-|–|\.\.)\s*(\d{4})?\s*$")
+
+
+def parse_year_range(value):
+    """
+    Разбирает фильтр года: "1999", "1990-1999", "1990-" или "-1999".
+    Возвращает (year_from, year_to); границы включительно, None - без ограничения.
+    """
+    if value is None or value == "":
+        return None, None
+    if isinstance(value, int):
+        return value, value
+
+    value = str(value)
+    if value.strip().isdigit():
+        year = int(value)
+        return year, year
+
+    match = YEAR_RANGE_PATTERN.match(value)
+    if not match or not any(match.groups()):
+        raise ValueError(f"Некорректный фильтр года: {value}")
+    year_from, year_to = (int(group) if group else None for group in match.groups())
+    return year_from, year_to
+
+
+def split_values(value):
+    """Значения фильтра атрибута: строка через запятую или список, в нижнем регистре"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [item.strip().lower() for item in value if item and item.strip()]
+
+
+def movie_values(movie):
+    """Значения фильтруемых атрибутов фильма в нижнем регистре"""
+    values = {field: [] for field in FILTER_FIELDS}
+
+    for field, key in (("genre", "genres"), ("country", "countries")):
+        for item in movie.get(key) or []:
+            # Значения представлены словарями с полем 'name' или строками
+            name = item.get("name") if isinstance(item, dict) else item
+            if isinstance(name, str) and name:
+                values[field].append(name.lower())
+
+    for field in ("type", "category"):
+        value = movie.get(field)
+        if isinstance(value, str) and value:
+            values[field].append(value.lower())
+    return values
+
+
+class FilterIndex:
+    """Списки строк по значениям атрибутов и отсортированные годы для жёсткой фильтрации"""
+
+    def __init__(self, years, postings):
+        self.years = np.asarray(years, dtype=np.int32)
+        self.postings = postings
+        # Порядок строк по году: диапазон лет выбирается двумя searchsorted
+        self.year_order = np.argsort(self.years, kind="stable")
+        self.sorted_years = self.years[self.year_order]
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """Индекс по колоночному каталогу (MovieCatalog): списки строк берутся из кодов колонок"""
+        postings = {field: {} for field in FILTER_FIELDS}
+        for field, column in (("genre", "genres"), ("country", "countries"), ("type", "type"), ("category", "category")):
+            for value, rows in catalog.columns[column].postings().items():
+                if value:
+                    postings[field].setdefault(value.lower(), []).append(rows)
+        # Значения вне схемы колонок хранятся в extra как в исходном документе
+        for row, values in catalog.extra.items():
+            for field, items in movie_values(values).items():
+                for value in items:
+                    postings[field].setdefault(value, []).append(np.array([row], dtype=np.int64))
+
+        arrays = {
+            field: {value: np.unique(np.concatenate(parts)) for value, parts in field_postings.items()}
+            for field, field_postings in postings.items()
+        }
+        return cls(catalog.years, arrays)
+
+    def patched(self, keep, new_movies):
+        """
+        Индекс после EmbeddingStore.with_changes без полного пересчёта:
+        строки из маски keep сдвигаются, значения new_movies дописываются в конец.
+        """
+        kept = int(keep.sum())
+        remap = np.full(len(keep), -1, dtype=np.int64)
+        remap[keep] = np.arange(kept)
+
+        postings = {field: {} for field in FILTER_FIELDS}
+        for field, field_postings in self.postings.items():
+            for value, rows in field_postings.items():
+                rows = remap[rows]
+                postings[field][value] = [rows[rows >= 0]]
+        for offset, movie in enumerate(new_movies):
+            for field, values in movie_values(movie).items():
+                for value in values:
+                    postings[field].setdefault(value, []).append(np.array([kept + offset], dtype=np.int64))
+
+        years = np.concatenate([self.years[keep], np.array([movie.get("year", 2000) for movie in new_movies], dtype=np.int32)])
+        arrays = {
+            field: {value: np.unique(np.concatenate(parts)) for value, parts in field_postings.items()}
+            for field, field_postings in postings.items()
+        }
+        # Значения, у которых не осталось фильмов, удаляем
+        arrays = {field: {value: rows for value, rows in field_postings.items() if len(rows)}
+                  for field, field_postings in arrays.items()}
+        return FilterIndex(years, arrays)
+
+    @property
+    def count(self):
+        return len(self.years)
+
+    def values(self, field):
+        """Известные значения атрибута"""
+        return list(self.postings[field].keys())
+
+    def field_rows(self, field, values):
+        """Строки, у которых атрибут field принимает любое из values"""
+        field_postings = self.postings[field]
+        parts = [field_postings[value] for value in values if value in field_postings]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.unique(np.concatenate(parts))
+
+    def year_rows(self, year_from=None, year_to=None):
+        """Строки с годом в диапазоне [year_from, year_to]"""
+        start = np.searchsorted(self.sorted_years, year_from, side="left") if year_from is not None else 0
+        end = np.searchsorted(self.sorted_years, year_to, side="right") if year_to is not None else len(self.sorted_years)
+        return np.sort(self.year_order[start:end])
+
+    def select(self, year_from=None, year_to=None, **fields):
+        """
+        Строки, подходящие под все фильтры (внутри атрибута значения объединяются по ИЛИ).
+        fields - значения атрибутов из FILTER_FIELDS. Возвращает None, если фильтров нет.
+        """
+        candidates = []
+        for field, value in fields.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Неизвестный фильтр: {field}")
+            values = split_values(value)
+            if values:
+                candidates.append(self.field_rows(field, values))
+        if year_from is not None or year_to is not None:
+            candidates.append(self.year_rows(year_from, year_to))
+
+        if not candidates:
+            return None
+
+        # Пересекаем начиная с самого короткого списка
+        candidates.sort(key=len)
+        rows = candidates[0]
+        for other in candidates[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    def describe(self):
+        """Число значений по атрибутам для /status"""
+        return {field: len(field_postings) for field, field_postings in self.postings.items()}
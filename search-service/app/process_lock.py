@@ -0,0 +1,45 @@
+"""
+Межпроцессная блокировка единственного писателя на файле (fcntl.flock).
+
+Несколько воркеров gunicorn (и реплик с общим томом) читают одни и те же файлы
+эмбеддингов и артефактов, но записывать их должен только один процесс за раз:
+сборка артефакта при старте, сохранение нормализованной матрицы и обновления каталога
+выполняются под ProcessLock. Внутри процесса блокировка повторно входимая, поэтому
+метод, уже держащий её, может вызвать другой метод, который тоже её берёт.
+"""
+import os
+import fcntl
+import threading
+
+
+class ProcessLock:
+    """Эксклюзивная блокировка файла path между процессами и потоками (повторно входимая в потоке)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                lock_file = open(self.path, "a")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except Exception:
+                self.thread_lock.release()
+                raise
+            self.lock_file = lock_file
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+        return False
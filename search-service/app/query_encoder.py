@@ -0,0 +1,255 @@
+"""
+Кодировщики поисковых запросов для search-service.
+
+RemoteQueryEncoder обращается к Hugging Face Inference API (исходное поведение),
+LocalQueryEncoder работает полностью офлайн: либо с экспортированной ONNX-моделью
+(в том числе int8-квантованной, см. export_encoder.py), либо с исходной моделью через
+sentence-transformers. Модель загружается и прогревается в каждом процессе отдельно
+(load() или первый encode()): пул потоков ONNX Runtime и torch не переживает fork,
+поэтому мастер gunicorn освобождает модель (release()) до запуска воркеров.
+
+Оба кодировщика добавляют префикс "query: " и возвращают L2-нормализованные векторы
+float32, поэтому совместимы с уже сохранёнными movies_embeddings.npy.
+"""
+import os
+import logging
+import threading
+from time import time, sleep
+
+import numpy as np
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "intfloat/multilingual-e5-large-instruct"
+QUERY_PREFIX = "query: "
+
+# Имена ONNX-файлов в порядке предпочтения: квантованная модель быстрее на CPU
+ONNX_FILE_NAMES = ("model_quantized.onnx", "model.onnx")
+
+# Модели, унаследованные воркером через fork: не освобождаются, потому что потоки
+# их пулов остались в родительском процессе
+_inherited_models = []
+
+
+def normalize_rows(vectors):
+    """L2-нормализация строк матрицы (нулевые строки остаются нулевыми)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class RemoteQueryEncoder:
+    """Кодировщик через Hugging Face Inference API"""
+
+    backend = "remote"
+
+    def __init__(self, api_url, headers, model_name=DEFAULT_MODEL_NAME, timeout=30):
+        self.api_url = api_url
+        self.headers = headers
+        self.model_name = model_name
+        self.timeout = timeout
+
+    def encode(self, texts):
+        """Возвращает матрицу (len(texts), dim) нормализованных эмбеддингов"""
+        payload = {"inputs": [f"{QUERY_PREFIX}{text}" for text in texts]}
+        response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"Ошибка API: {response.text}")
+        return normalize_rows(response.json())
+
+    def load(self):
+        """Удалённому кодировщику нечего загружать"""
+
+    def release(self):
+        """Удалённому кодировщику нечего освобождать"""
+
+
+class LocalQueryEncoder:
+    """Локальный кодировщик: ONNX Runtime или sentence-transformers, без обращения к сети"""
+
+    def __init__(self, model_path, model_name=DEFAULT_MODEL_NAME, max_length=512, num_threads=None):
+        self.model_path = model_path
+        self.model_name = model_name
+        self.max_length = max_length
+        self.num_threads = num_threads
+
+        self.onnx_file = self._find_onnx_file(model_path)
+        self.backend = f"onnx:{os.path.basename(self.onnx_file)}" if self.onnx_file else "sentence-transformers"
+        self.session = None
+        self.model = None
+        # Процесс, в котором загружена модель
+        self.pid = None
+        self.load_lock = threading.Lock()
+
+    def load(self):
+        """Загружает и прогревает модель в текущем процессе (повторный вызов ничего не делает)"""
+        if self.pid == os.getpid():
+            return
+        with self.load_lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                # Модель загружена родителем до fork: её пул потоков здесь не работает
+                _inherited_models.append((self.session, self.model))
+                self.session = self.model = None
+
+            start_time = time()
+            if self.onnx_file:
+                self._init_onnx(self.onnx_file, self.num_threads)
+            else:
+                self._init_sentence_transformers(self.num_threads)
+            self.pid = os.getpid()
+
+            # Прогрев: первый прогон заметно медленнее последующих
+            self.encode(["прогрев"])
+            logger.info(f"✅ Локальный кодировщик ({self.backend}) загружен из {self.model_path} за {time() - start_time:.2f} сек")
+
+    def release(self):
+        """Освобождает модель в процессе, который её загрузил (мастер gunicorn перед fork)"""
+        with self.load_lock:
+            if self.pid == os.getpid():
+                self.session = self.model = None
+                self.pid = None
+
+    @staticmethod
+    def _find_onnx_file(model_path):
+        preferred = os.getenv("LOCAL_ENCODER_ONNX_FILE")
+        names = (preferred,) if preferred else ONNX_FILE_NAMES
+        for name in names:
+            path = os.path.join(model_path, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _init_onnx(self, onnx_file, num_threads):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, local_files_only=True)
+        self.session = ort.InferenceSession(onnx_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+
+    def _init_sentence_transformers(self, num_threads):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(self.model_path, device="cpu")
+        self.model.max_seq_length = self.max_length
+
+    def encode(self, texts):
+        """Возвращает матрицу (len(texts), dim) нормализованных эмбеддингов"""
+        self.load()
+        prefixed = [f"{QUERY_PREFIX}{text}" for text in texts]
+
+        if self.onnx_file is None:
+            vectors = self.model.encode(
+                prefixed,
+                batch_size=len(prefixed),
+                convert_to_numpy=True,
+                normalize_embeddings=False,
+                show_progress_bar=False
+            )
+            return normalize_rows(vectors)
+
+        tokens = self.tokenizer(
+            prefixed,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        feed = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+        hidden_state = self.session.run(None, feed)[0]
+
+        # Mean pooling по маске внимания, как в sentence-transformers для e5
+        mask = tokens["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return normalize_rows(pooled)
+
+
+def encode_batches(encoder, texts, batch_size=32, retries=3, backoff=1.0, pause=0.0, progress=None):
+    """
+    Кодирует тексты пакетами с повторными попытками.
+
+    Пакет, который не удалось закодировать после retries попыток, делится пополам,
+    чтобы отделить проблемные тексты от остальных. Неудачные тексты не заполняются
+    нулевыми векторами, а возвращаются отдельно.
+
+    Возвращает (векторы float32 для успешных текстов, их позиции, {позиция: ошибка}).
+    """
+    vectors = []
+    positions = []
+    failures = {}
+
+    def encode_range(start, end):
+        batch = texts[start:end]
+        error = None
+        for attempt in range(retries):
+            try:
+                batch_vectors = normalize_rows(encoder.encode(batch))
+                if batch_vectors.shape[0] != len(batch):
+                    raise RuntimeError(f"Кодировщик вернул {batch_vectors.shape[0]} векторов вместо {len(batch)}")
+                vectors.append(batch_vectors)
+                positions.extend(range(start, end))
+                return
+            except Exception as e:
+                error = e
+                if attempt < retries - 1:
+                    sleep(backoff * 2 ** attempt)
+
+        if end - start > 1:
+            middle = (start + end) // 2
+            encode_range(start, middle)
+            encode_range(middle, end)
+        else:
+            failures[start] = str(error)
+
+    for start in range(0, len(texts), batch_size):
+        encode_range(start, min(start + batch_size, len(texts)))
+        if progress:
+            progress(min(start + batch_size, len(texts)), len(texts))
+        if pause:
+            # Пауза между пакетами, чтобы не перегружать удалённый API
+            sleep(pause)
+
+    if vectors:
+        vectors = np.concatenate(vectors)
+    else:
+        vectors = np.empty((0, 0), dtype=np.float32)
+    return vectors, positions, failures
+
+
+def create_query_encoder(api_url, headers):
+    """
+    Создаёт кодировщик по переменным окружения.
+
+    ENCODER_BACKEND: remote | local | auto (local, если модель найдена на диске, иначе remote)
+    LOCAL_ENCODER_PATH: каталог с моделью (ONNX + токенизатор или модель sentence-transformers)
+    """
+    backend = os.getenv("ENCODER_BACKEND", "auto").lower()
+    model_name = os.getenv("ENCODER_MODEL_NAME", DEFAULT_MODEL_NAME)
+    model_path = os.getenv("LOCAL_ENCODER_PATH", "model_cache/e5-onnx")
+    num_threads = int(os.getenv("ENCODER_THREADS", 0)) or None
+    max_length = int(os.getenv("ENCODER_MAX_LENGTH", 512))
+
+    if backend == "auto":
+        backend = "local" if os.path.isdir(model_path) else "remote"
+
+    if backend == "local":
+        logger.info(f"🧠 Загрузка локального кодировщика из {model_path}...")
+        return LocalQueryEncoder(model_path, model_name=model_name, max_length=max_length, num_threads=num_threads)
+
+    logger.info("🌐 Используется удалённый кодировщик (Hugging Face API)")
+    return RemoteQueryEncoder(api_url, headers, model_name=model_name)
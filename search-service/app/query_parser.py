@@ -0,0 +1,98 @@
+"""
+Разбор поискового запроса на структурированные фильтры.
+
+Словарь жанров, стран и типов вместе с шаблонами годов компилируется один раз в
+единственное регулярное выражение-альтернативу, поэтому запрос разбирается за один
+проход независимо от размера словаря. Распознаются:
+- год: "1999";
+- диапазон лет: "2010-2015", "2010 по 2015";
+- десятилетие: "90-х", "90-е", "1990-х", "00-х";
+- жанры, страны и типы (включая русские названия типов: "сериал", "мультфильм", ...).
+"""
+import re
+
+YEAR_PATTERN = r"19\d{2}|20[0-2]\d"
+
+# Русские названия типов Кинопоиска; добавляются, только если тип есть в каталоге
+TYPE_SYNONYMS = {
+    "сериал": "tv-series",
+    "сериалы": "tv-series",
+    "мультфильм": "cartoon",
+    "мультфильмы": "cartoon",
+    "мультсериал": "animated-series",
+    "мультсериалы": "animated-series",
+    "аниме": "anime"
+}
+
+
+class ParsedQuery:
+    """Результат разбора запроса: исходный текст и найденные фильтры (год - диапазон [year_from, year_to])"""
+
+    def __init__(self, text, year_from=None, year_to=None, genres=None, countries=None, types=None):
+        self.text = text
+        self.year_from = year_from
+        self.year_to = year_to
+        self.genres = genres or []
+        self.countries = countries or []
+        self.types = types or []
+
+
+class QueryParser:
+    """Скомпилированный разборщик запросов по словарю жанров, стран и типов"""
+
+    def __init__(self, genres=(), countries=(), types=()):
+        self.terms = {}
+        for field, values in (("genres", genres), ("countries", countries), ("types", types)):
+            for value in values:
+                if isinstance(value, str) and value.strip():
+                    self.terms.setdefault(value.lower(), (field, value))
+        for synonym, value in TYPE_SYNONYMS.items():
+            if value in types:
+                self.terms.setdefault(synonym, ("types", value))
+
+        alternatives = [
+            rf"(?P<range_from>{YEAR_PATTERN})\s*(?:-|–|—|по|до)\s*(?P<range_to>{YEAR_PATTERN})",
+            r"(?P<decade>(?:19|20)?\d0)-?(?:х|е|ых|ые)",
+            rf"(?P<year>{YEAR_PATTERN})"
+        ]
+        if self.terms:
+            # Длинные термины раньше коротких, чтобы "мультсериал" не распознавался как "сериал"
+            terms = sorted(self.terms, key=len, reverse=True)
+            alternatives.append("(?P<term>" + "|".join(re.escape(term) for term in terms) + ")")
+        self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+
+    @classmethod
+    def from_filter_index(cls, filter_index):
+        """Словарь разборщика из значений FilterIndex"""
+        return cls(
+            genres=filter_index.values("genre"),
+            countries=filter_index.values("country"),
+            types=filter_index.values("type")
+        )
+
+    @staticmethod
+    def _decade_range(decade):
+        decade = int(decade)
+        if decade < 100:
+            # "00-х" и "10-х" - XXI век, остальные двузначные - XX век
+            decade += 2000 if decade <= 10 else 1900
+        return decade, decade + 9
+
+    def parse(self, query):
+        """Разбирает запрос за один проход и возвращает ParsedQuery"""
+        parsed = ParsedQuery(query)
+        for match in self.pattern.finditer(query):
+            if match.group("range_from"):
+                year_from, year_to = sorted((int(match.group("range_from")), int(match.group("range_to"))))
+                parsed.year_from, parsed.year_to = year_from, year_to
+            elif match.group("decade"):
+                parsed.year_from, parsed.year_to = self._decade_range(match.group("decade"))
+            elif match.group("year"):
+                if parsed.year_from is None:
+                    parsed.year_from = parsed.year_to = int(match.group("year"))
+            else:
+                field, value = self.terms[match.group("term").lower()]
+                values = getattr(parsed, field)
+                if value not in values:
+                    values.append(value)
+        return parsed
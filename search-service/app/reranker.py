@@ -0,0 +1,308 @@
+"""
+Этап переранжирования результатов векторного поиска (cross-encoder или LLM).
+
+Лучшие RERANK_DEPTH кандидатов поиска проверяются "судьёй" на соответствие запросу:
+локальным cross-encoder (RERANK_BACKEND=cross_encoder) или LLM через OpenAI-совместимый
+эндпоинт /chat/completions (RERANK_BACKEND=llm). Судья возвращает оценку 0..1 для каждой
+пары (запрос, фильм); фильм релевантен, если оценка не ниже RERANK_THRESHOLD.
+
+Кандидаты проверяются окнами по порядку ранжирования: окно делится на пакеты по
+RERANK_BATCH_SIZE, которые отправляются судье параллельно (RERANK_WORKERS потоков).
+Проверка останавливается, как только подтверждено limit релевантных фильмов, или по
+истечении бюджета времени RERANK_BUDGET_MS. Вердикты кэшируются по (нормализованный
+запрос, id фильма) и имени судьи, поэтому повторные и похожие поиски почти не обращаются
+к модели. Пакеты, которые судья уже проверяет к концу бюджета, дописывают вердикты в кэш
+в фоне, а ещё не начатые отменяются. Число пакетов в работе и в очереди общего пула
+ограничено RERANK_QUEUE_SIZE: запрос, которому не хватило места, не ждёт чужие пакеты,
+а оставляет кандидатов непроверенными, поэтому медленный судья не копит очередь.
+
+RERANK_BACKEND=stub - детерминированный судья без модели (доля слов запроса в тексте
+фильма, задержка RERANK_STUB_DELAY_MS) для тестов и нагрузочных прогонов.
+
+Фильмы, признанные нерелевантными, отбрасываются; непроверенные (бюджет или ошибка
+судьи) идут после подтверждённых в исходном порядке.
+"""
+import os
+import re
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import monotonic, sleep
+
+import numpy as np
+import requests
+
+from result_cache import ResultCache
+from embedding_cache import normalize_query_text
+
+logger = logging.getLogger(__name__)
+
+
+def movie_text(movie, max_chars=500):
+    """Текст фильма для судьи: название, год, жанры и описание"""
+    title = movie.get("name") or movie.get("alternativeName") or ""
+    if movie.get("year"):
+        title = f"{title} ({movie['year']})"
+    genres = movie.get("genres") or []
+    genres = ", ".join(genre.get("name", "") if isinstance(genre, dict) else str(genre) for genre in genres)
+    description = movie.get("description") or movie.get("shortDescription") or ""
+    text = f"{title}. Жанры: {genres}. {description}" if genres else f"{title}. {description}"
+    return text[:max_chars]
+
+
+class CrossEncoderJudge:
+    """Локальный cross-encoder (sentence-transformers): оценка пары (запрос, текст фильма)"""
+
+    def __init__(self, model_path, max_length=512):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_path, max_length=max_length, device="cpu")
+        self.name = f"cross_encoder:{os.path.basename(os.path.normpath(model_path))}"
+
+    def score(self, query, texts):
+        scores = np.asarray(self.model.predict([(query, text) for text in texts], show_progress_bar=False),
+                            dtype=np.float32).reshape(len(texts), -1)[:, -1]
+        if scores.min() < 0 or scores.max() > 1:
+            # Модель возвращает логиты - переводим в вероятность
+            scores = 1 / (1 + np.exp(-scores))
+        return scores.tolist()
+
+
+class StubJudge:
+    """Детерминированный судья без модели: доля слов запроса, встречающихся в тексте фильма"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.name = "stub"
+
+    def score(self, query, texts):
+        if self.delay:
+            sleep(self.delay)
+        words = set(re.findall(r"\w+", query.casefold()))
+        scores = []
+        for text in texts:
+            text_words = set(re.findall(r"\w+", text.casefold()))
+            scores.append(len(words & text_words) / len(words) if words else 0.0)
+        return scores
+
+
+class LLMJudge:
+    """LLM через OpenAI-совместимый эндпоинт /chat/completions: оценка релевантности списка фильмов"""
+
+    PROMPT = (
+        "Запрос пользователя к поиску фильмов: \"{query}\".\n"
+        "Для каждого фильма ниже оцени, соответствует ли он запросу, числом от 0 до 1 "
+        "(1 - точно подходит, 0 - не подходит).\n"
+        "Ответь только JSON-массивом из {count} чисел в порядке фильмов, без пояснений.\n\n{movies}"
+    )
+
+    def __init__(self, api_url, model, api_key=None, timeout=10):
+        self.api_url = api_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.name = f"llm:{model}"
+
+    def score(self, query, texts):
+        movies = "\n".join(f"{number}. {text}" for number, text in enumerate(texts, start=1))
+        payload = {
+            "model": self.model,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": self.PROMPT.format(query=query, count=len(texts), movies=movies)}]
+        }
+        response = requests.post(f"{self.api_url}/chat/completions", headers=self.headers, json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"Ошибка LLM: {response.status_code} {response.text[:200]}")
+
+        content = response.json()["choices"][0]["message"]["content"]
+        match = re.search(r"\[.*?\]", content, re.S)
+        if match is None:
+            raise RuntimeError(f"LLM вернула ответ без JSON-массива: {content[:200]}")
+        scores = [min(max(float(value), 0.0), 1.0) for value in json.loads(match.group(0))]
+        if len(scores) != len(texts):
+            raise RuntimeError(f"LLM вернула {len(scores)} оценок вместо {len(texts)}")
+        return scores
+
+
+class Reranker:
+    """Проверка кандидатов судьёй с кэшем вердиктов, ранней остановкой и бюджетом времени"""
+
+    def __init__(self, judge, depth=100, threshold=0.5, batch_size=10, workers=4, budget=1.5,
+                 cache_size=50000, cache_ttl=24 * 3600, max_chars=500, queue_size=None):
+        self.judge = judge
+        self.depth = depth
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.workers = workers
+        self.budget = budget
+        self.max_chars = max_chars
+        self.verdicts = ResultCache(max_entries=cache_size, max_bytes=cache_size * 256, ttl=cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reranker")
+        # Места для пакетов в работе и в очереди пула; освобождаются по завершении или отмене пакета
+        self.queue_size = queue_size or workers * 2
+        self.slots = threading.BoundedSemaphore(self.queue_size)
+        self.latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.judged = 0
+        self.batches = 0
+        self.errors = 0
+        self.early_stops = 0
+        self.budget_exceeded = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        """Этап переранжирования по RERANK_BACKEND или None, если он не настроен"""
+        backend = os.getenv("RERANK_BACKEND", "none").lower()
+        if backend == "cross_encoder":
+            model_path = os.getenv("RERANK_MODEL_PATH", "model_cache/cross-encoder")
+            logger.info(f"🧠 Загрузка cross-encoder для переранжирования из {model_path}...")
+            judge = CrossEncoderJudge(model_path, max_length=int(os.getenv("RERANK_MAX_LENGTH", 512)))
+        elif backend == "stub":
+            judge = StubJudge(delay=float(os.getenv("RERANK_STUB_DELAY_MS", 0)) / 1000)
+        elif backend == "llm":
+            api_url = os.getenv("RERANK_LLM_URL", "http://localhost:8000/v1")
+            logger.info(f"🤖 Переранжирование через LLM: {api_url}")
+            judge = LLMJudge(
+                api_url,
+                model=os.getenv("RERANK_LLM_MODEL", "qwen2.5-7b-instruct"),
+                api_key=os.getenv("RERANK_LLM_API_KEY"),
+                timeout=float(os.getenv("RERANK_LLM_TIMEOUT", 10))
+            )
+        else:
+            return None
+        return cls(
+            judge,
+            depth=int(os.getenv("RERANK_DEPTH", 100)),
+            threshold=float(os.getenv("RERANK_THRESHOLD", 0.5)),
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE", 10)),
+            workers=int(os.getenv("RERANK_WORKERS", 4)),
+            budget=float(os.getenv("RERANK_BUDGET_MS", 1500)) / 1000,
+            cache_size=int(os.getenv("RERANK_CACHE_SIZE", 50000)),
+            cache_ttl=float(os.getenv("RERANK_CACHE_TTL", 24 * 3600)),
+            max_chars=int(os.getenv("RERANK_MAX_CHARS", 500)),
+            queue_size=int(os.getenv("RERANK_QUEUE_SIZE", 0)) or None
+        )
+
+    @staticmethod
+    def _verdict_key(query_key, movie):
+        return f"{query_key}\x00{movie.get('id') or movie.get('_id')}"
+
+    def _judge_batch(self, query, query_key, movies):
+        """Оценки пакета фильмов; вердикты сохраняются в кэш, даже если запрос уже не ждёт их"""
+        scores = self.judge.score(query, [movie_text(movie, self.max_chars) for movie in movies])
+        for movie, score in zip(movies, scores):
+            self.verdicts.set(self._verdict_key(query_key, movie), float(score), version=self.judge.name, size=64)
+        return scores
+
+    def rerank(self, query, candidates, limit):
+        """Кандидаты, подтверждённые судьёй (по убыванию оценки), затем непроверенные; не больше limit"""
+        start = monotonic()
+        deadline = start + self.budget
+        query_key = normalize_query_text(query).casefold()
+        candidates = candidates[:self.depth]
+        scores = [None] * len(candidates)
+        relevant = 0
+        checked = 0
+        window = self.batch_size * self.workers
+        self.requests += 1
+
+        while checked < len(candidates):
+            if relevant >= limit:
+                self.early_stops += 1
+                break
+            if monotonic() >= deadline:
+                self.budget_exceeded += 1
+                break
+
+            end = min(checked + window, len(candidates))
+            missing = []
+            for position in range(checked, end):
+                score = self.verdicts.get(self._verdict_key(query_key, candidates[position]), version=self.judge.name)
+                if score is None:
+                    missing.append(position)
+                else:
+                    scores[position] = score
+
+            futures = {}
+            rejected = False
+            for offset in range(0, len(missing), self.batch_size):
+                if not self.slots.acquire(blocking=False):
+                    # Очередь пула занята пакетами других запросов: остальные кандидаты не проверяются
+                    rejected = True
+                    break
+                positions = missing[offset:offset + self.batch_size]
+                future = self.executor.submit(self._judge_batch, query, query_key, [candidates[p] for p in positions])
+                future.add_done_callback(self._release_slot)
+                futures[future] = positions
+            self.batches += len(futures)
+            self.judged += sum(len(positions) for positions in futures.values())
+
+            done, not_done = wait(futures, timeout=max(0.0, deadline - monotonic()))
+            for future in done:
+                try:
+                    for position, score in zip(futures[future], future.result()):
+                        scores[position] = score
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"⚠️ Ошибка судьи переранжирования ({self.judge.name}): {str(e)}")
+
+            relevant += sum(1 for score in scores[checked:end] if score is not None and score >= self.threshold)
+            checked = end
+            if not_done:
+                # Не начатые пакеты отменяются, уже проверяемые допишут вердикты в кэш в фоне
+                self.cancelled += sum(1 for future in not_done if future.cancel())
+                self.budget_exceeded += 1
+                break
+            if rejected:
+                self.rejected += 1
+                break
+
+        confirmed = sorted(
+            (position for position, score in enumerate(scores) if score is not None and score >= self.threshold),
+            key=lambda position: -scores[position]
+        )
+        unchecked = [position for position, score in enumerate(scores) if score is None]
+        results = []
+        for position in (confirmed + unchecked)[:limit]:
+            movie = dict(candidates[position])
+            if scores[position] is not None:
+                movie["rerank_score"] = round(float(scores[position]), 4)
+            results.append(movie)
+
+        elapsed = monotonic() - start
+        self.latencies.append(elapsed)
+        logger.info(f"🧐 Переранжирование за {elapsed:.2f}s | проверено {checked}/{len(candidates)} | "
+                    f"подтверждено {len(confirmed)} | не проверено {len(unchecked)}")
+        return results
+
+    def _release_slot(self, future):
+        self.slots.release()
+
+    def stats(self):
+        """Статистика для /status"""
+        latencies = np.asarray(self.latencies, dtype=np.float64) * 1000
+        cache = self.verdicts.stats()
+        return {
+            "judge": self.judge.name,
+            "depth": self.depth,
+            "budget_ms": round(self.budget * 1000),
+            "requests": self.requests,
+            "judged": self.judged,
+            "batches": self.batches,
+            "errors": self.errors,
+            "early_stops": self.early_stops,
+            "budget_exceeded": self.budget_exceeded,
+            "cancelled_batches": self.cancelled,
+            "rejected": self.rejected,
+            "queue_size": self.queue_size,
+            "latency_avg_ms": round(float(latencies.mean()), 1) if len(latencies) else 0.0,
+            "latency_p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else 0.0,
+            "cache_entries": cache["entries"],
+            "cache_hits": cache["hits"],
+            "cache_misses": cache["misses"],
+            "cache_hit_rate": round(self.verdicts.hit_rate, 4)
+        }
@@ -0,0 +1,130 @@
+"""
+Потокобезопасный кэш результатов поиска для search-service.
+
+Записи вытесняются по LRU при превышении числа записей (RESULT_CACHE_MAX_ENTRIES)
+или суммарного размера в байтах (RESULT_CACHE_MAX_MB) и устаревают по TTL
+(RESULT_CACHE_TTL, секунды; 0 - без ограничения). Каждая запись помечена версией
+данных, для которой она вычислена: после обновления каталога поиск запрашивает
+записи с новой версией, а старые считаются промахом и удаляются при обращении или
+вытесняются по LRU, поэтому полная очистка кэша не нужна.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+def estimate_size(value):
+    """Приблизительный размер значения в байтах (рекурсивно по dict, list, tuple)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += estimate_size(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+class ResultCache:
+    """LRU-кэш с TTL, ограничением по числу записей и байтам и версиями данных"""
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (значение, версия, размер, момент устаревания)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 1000)),
+            max_bytes=int(float(os.getenv("RESULT_CACHE_MAX_MB", 64)) * 1024 * 1024),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", 3600))
+        )
+
+    def _remove(self, key):
+        _, _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key, version=None):
+        """Значение по ключу для версии данных version или None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, entry_version, _, expires_at = entry
+            if entry_version != version:
+                # Запись вычислена для другой версии каталога
+                self._remove(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            if expires_at is not None and expires_at <= monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, version=None, size=None):
+        """Сохраняет значение; слишком большие значения не кэшируются"""
+        size = estimate_size(value) if size is None else size
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return False
+
+        expires_at = monotonic() + self.ttl if self.ttl > 0 else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, version, size, expires_at)
+            self.bytes += size
+
+            # Вытесняем давно не использованные записи
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """Статистика для /status"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "size_mb": round(self.bytes / (1024 * 1024), 2),
+                "max_entries": self.max_entries,
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale": self.stale
+            }
@@ -3,7 +3,6 @@ import logging
 import numpy as np
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import faiss
 from time import time, sleep
 import requests
 from dotenv import load_dotenv
@@ -13,7 +12,24 @@ import json
 from datetime import datetime
 import re
 import hashlib
-from sklearn.preprocessing import normalize
+import resource
+import threading
+import uuid
+from query_encoder import create_query_encoder, encode_batches
+from vector_index import VectorIndex
+from embedding_store import EmbeddingStore
+from movie_filters import FilterIndex, parse_year_range, split_values
+from movie_catalog import MovieCatalog, movie_key
+from boost_features import BoostFeatures
+from query_parser import QueryParser
+from result_cache import ResultCache
+from embedding_cache import EmbeddingCache, normalize_query_text
+from shared_result_cache import SharedResultCache
+from single_flight import SingleFlight
+from micro_batcher import MicroBatcher
+from reranker import Reranker
+from process_lock import ProcessLock
+from index_artifact import ArtifactError, append_delta, current_version, load_artifact, read_deltas, write_artifact
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -32,11 +48,145 @@ logger = logging.getLogger(__name__)
 # Глобальная переменная для хранения единственного экземпляра TurboMovieSearch
 _turbo_movie_search_instance = None
 
+# Поля документа фильма, которые нужны для поиска
+METADATA_PROJECTION = {
+    "_id": 1, 
+    "id": 1,  # Добавляем поле id если оно есть
+    "name": 1, 
+    "alternativeName": 1,
+    "description": 1, 
+    "shortDescription": 1,
+    "year": 1, 
+    "genres": 1,
+    "rating": 1,
+    "poster": 1,
+    "type": 1,
+    "countries": 1,
+    "category": 1
+}
+
+class SearchCursorError(ValueError):
+    """Курсор постраничного поиска некорректен или истёк"""
+
+# Способы объединения векторов в /similar
+SIMILAR_MODES = ("mean", "weighted", "max")
+
+# Расстояние в годах от диапазона запроса, на котором буст по году убывает до нуля
+YEAR_BOOST_SPAN = 125
+
 class TurboMovieSearch:
-    def __init__(self):
+    def __init__(self, use_artifact=True, preload=False):
         logger.info("🚀 Инициализация поисковой системы...")
+        # Загрузка в мастере gunicorn до fork: без фоновых потоков и без модели кодировщика,
+        # которые не переживают fork (они создаются в каждом воркере в after_fork)
+        self.preload = preload
+
+        self.connect()
+
+        # Кодировщик запросов: локальная модель или удалённый API
+        self.encoder = create_query_encoder(API_URL, HEADERS)
+        # Кэш эмбеддингов запросов: в памяти процесса и (опционально) общий в Redis
+        self.embedding_cache = EmbeddingCache.from_env(self.encoder.model_name)
+        # Одновременные запросы кодируются общими пакетами
+        self.encode_batcher = MicroBatcher.from_env(self.encoder.encode)
+
+        # Тип хранения эмбеддингов: float32 или float16 (с накоплением во float32)
+        self.embeddings_dtype = os.getenv("EMBEDDINGS_DTYPE", "float32").lower()
+        # Нормализованная матрица на диске, открываемая через mmap и общая для всех воркеров
+        self.embeddings_mmap = os.getenv("EMBEDDINGS_MMAP", "0").lower() in ["1", "true", "yes"]
+        # Длинные тексты каталога (описания) хранятся в файлах через mmap, а не в памяти процесса
+        self.catalog_text_mmap = os.getenv("CATALOG_TEXT_MMAP", "1").lower() in ["1", "true", "yes"]
+        self.catalog_text_dir = os.getenv("CATALOG_TEXT_DIR") or None
+
+        # Каталог с версионированным артефактом индекса для быстрого старта
+        self.artifact_root = os.getenv("SEARCH_ARTIFACT_DIR")
+        self.artifact_version = None
+        # Дельты каталога после последнего полного снимка (номер последней записи журнала артефакта)
+        self.pending_deltas = 0
+        # После SEARCH_ARTIFACT_COMPACT_DELTAS дельт полный снимок записывается заново в фоне
+        self.compact_deltas = int(os.getenv("SEARCH_ARTIFACT_COMPACT_DELTAS", 20))
+        self.compaction_running = False
+        # Единственный писатель файлов эмбеддингов и артефактов среди воркеров и реплик
+        lock_path = (os.path.join(self.artifact_root, ".writer.lock") if self.artifact_root
+                     else f"{self._normalized_embeddings_file()}.lock")
+        self.writer_lock = ProcessLock(lock_path)
+
+        # Блокировка подмены состояния поиска и сериализация инкрементальных обновлений
+        self.state_lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self.last_update = None
+        # Версия данных поиска: меняется при каждом обновлении каталога и помечает записи кэша
+        self.dataset_version = 0
+        # _id фильмов, для которых не удалось получить эмбеддинг (повторяются при обновлении)
+        self.embedding_failures = set()
+
+        # Водяной знак каталога читается до загрузки, чтобы не пропустить изменения во время старта
+        self.catalog_watermark = self._read_catalog_watermark()
+
+        if not (use_artifact and self.artifact_root and self._load_from_artifact()):
+            # Сборку выполняет один процесс: остальные ждут блокировку и загружают его артефакт
+            with self.writer_lock:
+                if not (use_artifact and self.artifact_root and self._load_from_artifact()):
+                    # Загружаем данные из MongoDB
+                    self.metadata = self._load_metadata()
+                    self._build_search_structures(self._load_embedding_store())
+
+                    if use_artifact and self.artifact_root and os.getenv("SEARCH_ARTIFACT_AUTO_BUILD", "1").lower() in ["1", "true", "yes"]:
+                        # Переходим на записанную версию: тексты и колонки каталога открываются из её
+                        # файлов, и все воркеры и реплики делят одну копию в page cache
+                        if self.write_artifact():
+                            self._load_from_artifact()
+
+        # Количество кандидатов из индекса, к которым применяются бусты по году и жанру
+        self.search_candidates = int(os.getenv("SEARCH_CANDIDATES", 1000))
+        # Буферы оценок кандидатов: свои у каждого потока, переиспользуются между запросами
+        self.score_buffers = threading.local()
+        
+        # Кэш результатов поиска: LRU с TTL и ограничением по памяти, записи помечены версией данных
+        self.result_cache = ResultCache.from_env()
+        # Общий для реплик кэш id и оценок результатов в Redis (если задан RESULT_CACHE_REDIS_URL)
+        self.shared_cache = SharedResultCache.from_env()
+        self.index_version = self._index_version()
+        # Одинаковые одновременные запросы считаются один раз
+        self.single_flight = SingleFlight()
+        # Проверка лучших кандидатов cross-encoder или LLM (если задан RERANK_BACKEND)
+        self.reranker = Reranker.from_env()
+
+        # Курсоры постраничного поиска: id и оценки до SEARCH_CURSOR_DEPTH лучших кандидатов
+        self.cursor_depth = int(os.getenv("SEARCH_CURSOR_DEPTH", 1000))
+        self.cursors = ResultCache(
+            max_entries=int(os.getenv("SEARCH_CURSOR_MAX", 2000)),
+            max_bytes=int(float(os.getenv("SEARCH_CURSOR_MAX_MB", 32)) * 1024 * 1024),
+            ttl=float(os.getenv("SEARCH_CURSOR_TTL", 300))
+        )
+        # Сессии поиска: id уже показанных фильмов исключаются из следующих раундов
+        self.sessions = ResultCache(
+            max_entries=int(os.getenv("SEARCH_SESSION_MAX", 10000)),
+            max_bytes=int(float(os.getenv("SEARCH_SESSION_MAX_MB", 32)) * 1024 * 1024),
+            ttl=float(os.getenv("SEARCH_SESSION_TTL", 1800))
+        )
+        self.session_lock = threading.Lock()
+        
+        # Сохраняем количество фильмов для отслеживания изменений
+        self.movie_count = len(self.metadata)
+
+        if self.artifact_version:
+            # Артефакт соответствует водяному знаку своей последней дельты: догоняем изменения MongoDB
+            self.check_for_updates()
+
+        if preload:
+            # Полный снимок, который не запускался в фоне, записываем до fork
+            if 0 < self.compact_deltas <= self.pending_deltas:
+                self._compact()
+            # Модель, загруженная для эмбеддингов каталога, освобождается: воркеры загрузят свою
+            self.encoder.release()
+        else:
+            self.encoder.load()
         
-        # Получаем данные MongoDB из переменных окружения
+        logger.info("✅ Поисковая система готова к работе!")
+
+    def connect(self):
+        """Подключение к MongoDB по переменным окружения"""
         mongo_uri = os.getenv("MONGO_URI", "mongodb://mongodb:27017")
         mongo_db = os.getenv("MONGO_DB", "movies_db")
         mongo_collection = os.getenv("MONGO_COLLECTION", "movies")
@@ -47,29 +197,37 @@ class TurboMovieSearch:
         self.db = self.client[mongo_db]
         self.collection = self.db[mongo_collection]
 
-        # Загружаем данные из MongoDB
-        self.metadata = self._load_metadata()
-        self.embeddings = self._load_or_generate_embeddings()
+    def after_fork(self):
+        """
+        Вызывается в воркере gunicorn после fork: индекс и матрица уже загружены мастером,
+        а клиент MongoDB и модель кодировщика нельзя использовать в дочернем процессе -
+        создаём свои. Воркер, перезапущенный после обновлений, сразу применяет дельты
+        из журнала артефакта.
+        """
+        self.preload = False
+        self.connect()
+        self.encoder.load()
+        self.follow_artifact()
+        self.start_artifact_follower()
 
-        # FAISS Index
-        self.index = faiss.IndexFlatL2(self.embeddings.shape[1])
-        self.index.add(self.embeddings)
+    def start_artifact_follower(self):
+        """
+        Фоновый поток, который каждые SEARCH_ARTIFACT_POLL секунд применяет дельты,
+        записанные в журнал артефакта другими воркерами и репликами
+        """
+        interval = float(os.getenv("SEARCH_ARTIFACT_POLL", 5))
+        if not self.artifact_root or interval <= 0:
+            return
 
-        # Предварительный расчёт для поиска по жанрам и годам
-        self._precompute_features()
-        
-        # Инициализация кэша результатов поиска
-        self.search_cache = {}
-        self.cache_hits = 0
-        self.total_searches = 0
-        
-        # Сохраняем количество фильмов для отслеживания изменений
-        self.movie_count = len(self.metadata)
-        
-        logger.info("✅ Поисковая система готова к работе!")
+        def follow():
+            while True:
+                sleep(interval)
+                self.follow_artifact()
+
+        threading.Thread(target=follow, name="artifact-follower", daemon=True).start()
 
     def _load_metadata(self):
-        """Загружает метаданные из MongoDB"""
+        """Загружает метаданные из MongoDB в колоночный каталог"""
         logger.info("📊 Загрузка метаданных фильмов из MongoDB...")
         
         max_retries = 5
@@ -78,20 +236,7 @@ class TurboMovieSearch:
         for retry in range(max_retries):
             start_time = time()
             try:
-                movies = list(self.collection.find({}, {
-                    "_id": 1, 
-                    "id": 1,  # Добавляем поле id если оно есть
-                    "name": 1, 
-                    "alternativeName": 1,
-                    "description": 1, 
-                    "shortDescription": 1,
-                    "year": 1, 
-                    "genres": 1,
-                    "rating": 1,
-                    "poster": 1,
-                    "type": 1,
-                    "countries": 1
-                }))
+                movies = list(self.collection.find({}, METADATA_PROJECTION))
                 
                 if not movies:
                     if retry < max_retries - 1:
@@ -101,42 +246,29 @@ class TurboMovieSearch:
                         continue
                     else:
                         logger.warning("⚠️ В MongoDB не найдены фильмы после всех попыток!")
-                        return []
+                        return MovieCatalog.from_movies([])
                 
                 # Фильтруем некорректные данные
                 filtered_movies = []
+                seen_keys = set()
                 for movie in movies:
-                    # Проверяем, что фильм имеет ID и имя
-                    if "_id" not in movie or "name" not in movie:
+                    movie = self._clean_movie(movie)
+                    if movie is None:
                         continue
-                        
-                    # Фильтруем фильмы без названия
-                    if not movie.get("name"):
-                        continue
-                        
-                    # Проверка на фиктивные записи
-                    if isinstance(movie.get("name"), str) and "тестовый_фильм" in movie.get("name", "").lower():
+                    
+                    # Дубликаты по id фильма делили бы одну строку в хранилище эмбеддингов
+                    key = movie_key(movie)
+                    if key in seen_keys:
                         continue
-                        
-                    # Проверяем корректность года
-                    if not isinstance(movie.get("year"), int) or movie.get("year") < 1900:
-                        if "year" in movie:
-                            try:
-                                movie["year"] = int(movie["year"])
-                            except:
-                                movie["year"] = 2000
-                        else:
-                            movie["year"] = 2000
-                            
-                    # Сохраняем оригинальный MongoDB ID
-                    movie["mongodb_id"] = str(movie["_id"])
+                    seen_keys.add(key)
                             
                     filtered_movies.append(movie)
                     
                 load_time = time() - start_time
                 logger.info(f"✅ Загружено {len(filtered_movies)} фильмов из {len(movies)} ({len(movies) - len(filtered_movies)} отфильтровано) за {load_time:.2f} сек")
                 
-                return filtered_movies
+                # Метаданные хранятся по колонкам, документы собираются только для результатов
+                return MovieCatalog.from_movies(filtered_movies)
             except Exception as e:
                 logger.error(f"❌ Ошибка при загрузке фильмов из MongoDB: {str(e)}")
                 if retry < max_retries - 1:
@@ -145,16 +277,51 @@ class TurboMovieSearch:
                     retry_interval *= 1.5
                 else:
                     logger.error("❌ Не удалось загрузить данные из MongoDB после всех попыток")
-                    return []
+                    return MovieCatalog.from_movies([])
 
-    def _load_or_generate_embeddings(self):
-        """Загружает эмбеддинги из файла или генерирует новые"""
+    @staticmethod
+    def _clean_movie(movie):
+        """Проверяет и нормализует документ фильма; None, если фильм нужно отфильтровать"""
+        # Проверяем, что фильм имеет ID и имя
+        if "_id" not in movie or "name" not in movie:
+            return None
+            
+        # Фильтруем фильмы без названия
+        if not movie.get("name"):
+            return None
+            
+        # Проверка на фиктивные записи
+        if isinstance(movie.get("name"), str) and "тестовый_фильм" in movie.get("name", "").lower():
+            return None
+            
+        # Проверяем корректность года
+        if not isinstance(movie.get("year"), int) or movie.get("year") < 1900:
+            if "year" in movie:
+                try:
+                    movie["year"] = int(movie["year"])
+                except:
+                    movie["year"] = 2000
+            else:
+                movie["year"] = 2000
+                
+        # Сохраняем оригинальный MongoDB ID
+        movie["mongodb_id"] = str(movie["_id"])
+        return movie
+
+    def _load_embedding_store(self):
+        """Загружает хранилище эмбеддингов из файла; None, если его нужно создать заново"""
         embeddings_file = os.getenv("EMBEDDINGS_FILE", "movies_embeddings.npy")
         
         # Проверяем наличие файла с эмбеддингами
         try:
-            logger.info(f"Попытка загрузки эмбеддингов из файла: {embeddings_file}")
-            embeddings = np.load(embeddings_file)
+            store = self._open_normalized_store(embeddings_file)
+            if store is None:
+                logger.info(f"Попытка загрузки эмбеддингов из файла: {embeddings_file}")
+                store = EmbeddingStore(
+                    np.load(embeddings_file),
+                    ids=EmbeddingStore.load_ids(embeddings_file),
+                    dtype=self.embeddings_dtype
+                )
             
             # Проверяем наличие фильмов в MongoDB
             if not self.metadata:
@@ -163,7 +330,7 @@ class TurboMovieSearch:
                 wait_time = 10  # начальное время ожидания в секундах
                 
                 for retry in range(max_retries):
-                    logger.warning(f"⚠️ В MongoDB нет фильмов, но найдены эмбеддинги для {embeddings.shape[0]} фильмов")
+                    logger.warning(f"⚠️ В MongoDB нет фильмов, но найдены эмбеддинги для {store.count} фильмов")
                     logger.info(f"Ожидание загрузки данных в MongoDB... ({retry+1}/{max_retries})")
                     
                     # Ждем некоторое время перед повторной попыткой
@@ -185,268 +352,1102 @@ class TurboMovieSearch:
                     logger.error("❌ Сервис не может быть запущен без реальных данных из MongoDB")
                     raise Exception("В MongoDB нет данных о фильмах. Дождитесь загрузки данных в базу и перезапустите сервис.")
             
-            # Проверяем соответствие размерностей
-            if len(self.metadata) != embeddings.shape[0]:
-                logger.warning(f"⚠️ Несоответствие размеров: {len(self.metadata)} фильмов в базе, но {embeddings.shape[0]} эмбеддингов в файле")
-                logger.info("🔄 Генерация новых эмбеддингов с актуальными данными...")
-                return self._generate_embeddings()
+            # Файл без id строк (старый формат): строки сопоставляются с фильмами по порядку,
+            # что возможно только при совпадении размеров
+            if store.ids is None:
+                if len(self.metadata) != store.count:
+                    logger.warning(f"⚠️ Несоответствие размеров: {len(self.metadata)} фильмов в базе, но {store.count} эмбеддингов в файле без id")
+                    return None
+                store.set_ids(self.metadata.keys)
                 
-            logger.info(f"✅ Эмбеддинги загружены из файла: {embeddings.shape}")
-            return embeddings
+            logger.info(f"✅ Эмбеддинги загружены из файла: {store.shape}")
+            return store
         except Exception as e:
             logger.warning(f"⚠️ Не удалось загрузить эмбеддинги из файла: {str(e)}")
-            logger.info("🔄 Генерация новых эмбеддингов...")
-            return self._generate_embeddings()
+            return None
+
+    def _sync_store_with_metadata(self, store):
+        """
+        Приводит хранилище эмбеддингов в соответствие с метаданными по id фильмов:
+        генерирует эмбеддинги только для новых фильмов, удаляет исчезнувшие и
+        упорядочивает метаданные по строкам хранилища.
+        """
+        keys = self.metadata.keys
+
+        if store is None:
+            logger.info("🔄 Генерация новых эмбеддингов для всех фильмов...")
+            vectors, embedded = self._generate_embeddings(self.metadata)
+            store = EmbeddingStore(vectors, ids=keys[embedded], dtype=self.embeddings_dtype)
+            changed = True
+        else:
+            key_set = set(keys.tolist())
+            stale_ids = [movie_id for movie_id in store.ids.tolist() if movie_id not in key_set]
+            missing_movies = [self.metadata[row] for row in np.flatnonzero(store.rows_for(keys) < 0)]
+
+            if stale_ids:
+                logger.info(f"🗑 Удаление эмбеддингов {len(stale_ids)} фильмов, которых больше нет в базе")
+            if missing_movies:
+                logger.info(f"🔄 Генерация эмбеддингов только для {len(missing_movies)} новых фильмов")
+            if stale_ids or missing_movies:
+                vectors, embedded = self._generate_embeddings(missing_movies) if missing_movies else (None, [])
+                store, _ = store.with_changes([movie_key(missing_movies[i]) for i in embedded], vectors, stale_ids)
+            changed = bool(stale_ids or missing_movies)
+
+        # Метаданные выравниваются по строкам хранилища, а не наоборот: матрицу не нужно копировать.
+        # Фильмы без эмбеддинга (ошибка кодировщика) в поиск не попадают до следующего обновления
+        rows = store.rows_for(keys)
+        present = np.flatnonzero(rows >= 0)
+        self.metadata = self.metadata.take(present[np.argsort(rows[present])])
+
+        if changed:
+            store = self._save_embeddings(store)
+        return store
+
+    def _save_embeddings(self, store):
+        """
+        Атомарно сохраняет нормализованную матрицу и id строк в отдельный файл
+        (NORMALIZED_EMBEDDINGS_FILE). Исходный EMBEDDINGS_FILE никогда не перезаписывается:
+        в нём остаются исходные векторы в полной точности. Возвращает хранилище, открытое
+        через mmap при EMBEDDINGS_MMAP, иначе store.
+        """
+        normalized_file = self._normalized_embeddings_file()
+        try:
+            with self.writer_lock:
+                store.save(normalized_file)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить эмбеддинги: {str(e)}")
+            return store
+        if self.embeddings_mmap:
+            return EmbeddingStore.open_mmap(normalized_file)
+        return store
     
-    def _generate_embeddings(self):
-        """Генерирует эмбеддинги для фильмов"""
-        logger.info("🧠 Генерация эмбеддингов для фильмов...")
+    def _spill_catalog_text(self, catalog):
+        """
+        Переносит описания фильмов каталога в файлы через mmap (если включено CATALOG_TEXT_MMAP).
+        Вызывается при сборке каталога в мастер-процессе до fork, поэтому воркеры наследуют одно
+        отображение; каталог из артефакта уже отображён из его файлов и не копируется
+        """
+        if not self.catalog_text_mmap:
+            return catalog
+        try:
+            catalog.spill(self.catalog_text_dir)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось перенести описания фильмов в mmap, они остаются в памяти: {str(e)}")
+        return catalog
+
+    def _normalized_embeddings_file(self):
+        """Путь к нормализованной копии эмбеддингов для mmap"""
+        embeddings_file = os.getenv("EMBEDDINGS_FILE", "movies_embeddings.npy")
+        default_path = f"{os.path.splitext(embeddings_file)[0]}.{self.embeddings_dtype}.normalized.npy"
+        return os.getenv("NORMALIZED_EMBEDDINGS_FILE", default_path)
+
+    def _open_normalized_store(self, embeddings_file):
+        """
+        Открывает нормализованную копию (через mmap при EMBEDDINGS_MMAP), если она не старее
+        исходного файла: в ней сохранены и эмбеддинги фильмов, добавленных после его создания
+        """
+        normalized_file = self._normalized_embeddings_file()
+        if not os.path.exists(normalized_file):
+            return None
+        if os.path.exists(embeddings_file) and os.path.getmtime(normalized_file) < os.path.getmtime(embeddings_file):
+            logger.info(f"🔄 Нормализованная копия {normalized_file} устарела и будет пересоздана")
+            return None
+
+        if self.embeddings_mmap:
+            logger.info(f"Попытка открытия нормализованных эмбеддингов через mmap: {normalized_file}")
+            store = EmbeddingStore.open_mmap(normalized_file)
+        else:
+            logger.info(f"Попытка загрузки нормализованных эмбеддингов: {normalized_file}")
+            vectors = np.load(normalized_file)
+            store = EmbeddingStore(vectors, ids=EmbeddingStore.load_ids(normalized_file),
+                                   dtype=vectors.dtype.name, normalized=True)
+        if store.dtype != np.dtype(self.embeddings_dtype):
+            return None
+        return store
+
+    @staticmethod
+    def _movie_text(movie):
+        """Текстовое представление фильма для эмбеддинга"""
+        # Базовые поля
+        name = movie.get("name", "")
+        alt_name = movie.get("alternativeName", "")
+        description = movie.get("description", "") or movie.get("shortDescription", "") or ""
+        
+        # Жанры
+        genres_text = ""
+        genres = movie.get("genres", [])
+        if genres and isinstance(genres, list):
+            genre_names = []
+            for genre in genres:
+                if isinstance(genre, dict) and "name" in genre:
+                    genre_names.append(genre["name"])
+                elif isinstance(genre, str):
+                    genre_names.append(genre)
+            genres_text = " ".join(genre_names)
+        
+        # Формируем итоговый текст, разделяя поля пробелами
+        text_fields = []
+        if name:
+            text_fields.append(name)
+        if alt_name and alt_name != name:
+            text_fields.append(alt_name)
+        if genres_text:
+            text_fields.append(genres_text)
+        if description:
+            # Сокращаем описание, чтобы не перегружать эмбеддинг
+            description_words = description.split()[:100]
+            text_fields.append(" ".join(description_words))
+            
+        # Объединяем все поля в одну строку и убираем лишние пробелы
+        text = " ".join(text_fields)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def _generate_embeddings(self, movies):
+        """
+        Генерирует эмбеддинги для переданных фильмов пакетами с повторными попытками.
+        Фильмы, для которых эмбеддинг так и не получен, не заполняются нулевыми векторами:
+        они пропускаются и повторяются при следующем обновлении каталога.
+        Возвращает (векторы, позиции фильмов, для которых получены эмбеддинги).
+        """
+        logger.info(f"🧠 Генерация эмбеддингов для {len(movies)} фильмов...")
         
         start_time = time()
         
         # Формируем текстовые представления фильмов
-        texts = []
-        for movie in self.metadata:
-            # Базовые поля
-            name = movie.get("name", "")
-            alt_name = movie.get("alternativeName", "")
-            description = movie.get("description", "") or movie.get("shortDescription", "") or ""
-            
-            # Жанры
-            genres_text = ""
-            genres = movie.get("genres", [])
-            if genres and isinstance(genres, list):
-                genre_names = []
-                for genre in genres:
-                    if isinstance(genre, dict) and "name" in genre:
-                        genre_names.append(genre["name"])
-                    elif isinstance(genre, str):
-                        genre_names.append(genre)
-                genres_text = " ".join(genre_names)
-            
-            # Формируем итоговый текст, разделяя поля пробелами
-            text_fields = []
-            if name:
-                text_fields.append(name)
-            if alt_name and alt_name != name:
-                text_fields.append(alt_name)
-            if genres_text:
-                text_fields.append(genres_text)
-            if description:
-                # Сокращаем описание, чтобы не перегружать эмбеддинг
-                description_words = description.split()[:100]
-                text_fields.append(" ".join(description_words))
-                
-            # Объединяем все поля в одну строку
-            text = " ".join(text_fields)
-            
-            # Убираем лишние пробелы и символы
-            text = re.sub(r'\s+', ' ', text).strip()
-            texts.append(text)
-            
+        texts = [self._movie_text(movie) for movie in movies]
         logger.info(f"🔤 Подготовлено {len(texts)} текстовых представлений фильмов")
         
-        # Генерируем эмбеддинги через Hugging Face API
-        embeddings = []
-        batch_size = 10  # Размер пакета для API запросов
+        batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+        vectors, embedded, failures = encode_batches(
+            self.encoder,
+            texts,
+            batch_size=batch_size,
+            retries=int(os.getenv("EMBEDDING_RETRIES", 3)),
+            # Небольшая пауза между пакетами, чтобы не перегружать API
+            pause=1.0 if self.encoder.backend == "remote" else 0.0,
+            progress=lambda done, total: logger.info(f"Обработка пакета {(done - 1) // batch_size + 1}/{(total - 1) // batch_size + 1}")
+        )
+        
+        for position, error in failures.items():
+            movie = movies[position]
+            logger.warning(f"⚠️ Не удалось получить эмбеддинг для фильма «{movie.get('name')}» ({movie.get('mongodb_id')}): {error}")
+            if "_id" in movie:
+                self.embedding_failures.add(movie["_id"])
+        
+        if movies and not embedded:
+            raise RuntimeError("Не удалось получить ни одного эмбеддинга")
         
+        embedding_time = time() - start_time
+        logger.info(f"✅ Эмбеддинги сгенерированы за {embedding_time:.2f} сек: {len(embedded)} успешно, {len(failures)} с ошибкой")
+        return vectors, embedded
+
+    def _set_catalog(self, metadata, store, index, years, filter_index):
+        """
+        Рассчитывает признаки ранжирования и подменяет состояние поиска целиком:
+        поиски, идущие параллельно, видят либо старую, либо новую версию
+        """
+        # Разборщик запросов компилируется один раз по словарю жанров, стран и типов
+        query_parser = QueryParser.from_filter_index(filter_index)
+        # Матрица фильм x признак (жанры, страны, типы, десятилетия) для бустов ранжирования
+        boost_features = BoostFeatures.from_filter_index(filter_index)
+
+        with self.state_lock:
+            self.store = store
+            self.embeddings = store.vectors
+            self.metadata = metadata
+            self.years = years
+            # Списки строк по жанру, типу, стране, категории и году для жёстких фильтров;
+            # жанровые списки используются и для буста по жанрам из запроса
+            self.filter_index, self.genre_index = filter_index, filter_index.postings["genre"]
+            self.query_parser = query_parser
+            self.boost_features = boost_features
+            self.index = index
+            self.movie_count = len(metadata)
+
+    def _set_full_catalog(self, metadata, store, index):
+        """Подменяет состояние поиска, рассчитывая признаки каталога с нуля"""
+        self._set_catalog(metadata, store, index, metadata.years.astype(np.float32), FilterIndex.from_catalog(metadata))
+
+    def _patched_features(self, keep, new_movies):
+        """
+        Признаки после EmbeddingStore.with_changes без полного пересчёта:
+        строки из маски keep сдвигаются, признаки new_movies дописываются в конец.
+        """
+        years = np.concatenate([self.years[keep], np.array([movie.get('year', 2000) for movie in new_movies], dtype=np.float32)])
+        return years, self.filter_index.patched(keep, new_movies)
+
+    def _build_search_structures(self, store):
+        """Синхронизирует хранилище эмбеддингов с метаданными, создаёт признаки и индекс поиска"""
+        # Единственная нормализованная копия матрицы: её используют и ранжирование, и индекс
+        store = self._sync_store_with_metadata(store)
+        metadata = self._spill_catalog_text(self.metadata)
+        if self.embeddings_mmap and not store.is_mmap:
+            store = self._save_embeddings(store)
+
+        # Индекс по нормализованным эмбеддингам (косинусное сходство)
+        self._set_full_catalog(metadata, store, VectorIndex.from_env().build(store))
+    
+    def _load_from_artifact(self):
+        """
+        Загружает метаданные, эмбеддинги и индекс из артефакта и применяет его журнал дельт;
+        False, если артефакт не подходит
+        """
         try:
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i+batch_size]
-                logger.info(f"Обработка пакета {i//batch_size + 1}/{len(texts)//batch_size + 1}")
-                
-                # Получаем эмбеддинги для каждого текста в пакете
-                batch_embeddings = []
-                for text in batch:
-                    embedding = self.get_embedding(text)
-                    if embedding is not None:
-                        batch_embeddings.append(embedding)
-                    else:
-                        # В случае ошибки используем нулевой вектор
-                        logger.warning(f"Не удалось получить эмбеддинг для текста, используем нулевой вектор")
-                        batch_embeddings.append(np.zeros(1024))  # Размерность вектора multilingual-e5-large
-                
-                embeddings.extend(batch_embeddings)
-                
-                # Небольшая пауза между пакетами, чтобы не перегружать API
-                sleep(1)
-            
-            embeddings = np.array(embeddings)
-            
-            # Сохраняем эмбеддинги
-            np.save("movies_embeddings.npy", embeddings)
-            logger.info(f"💾 Эмбеддинги сохранены в файл (форма: {embeddings.shape})")
-            
-            embedding_time = time() - start_time
-            logger.info(f"✅ Эмбеддинги успешно сгенерированы за {embedding_time:.2f} сек!")
-            
-            return embeddings
+            artifact = load_artifact(
+                self.artifact_root,
+                model_name=self.encoder.model_name,
+                index_type=os.getenv("INDEX_TYPE", "flat").lower(),
+                embeddings_dtype=self.embeddings_dtype,
+                mmap=self.embeddings_mmap,
+                verify=os.getenv("SEARCH_ARTIFACT_VERIFY", "1").lower() in ["1", "true", "yes"]
+            )
+            deltas = read_deltas(self.artifact_root, artifact.version)
+        except ArtifactError as e:
+            logger.warning(f"⚠️ Артефакт индекса не используется: {str(e)}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ Ошибка при загрузке артефакта индекса: {str(e)}")
+            return False
+
+        self._set_full_catalog(self._spill_catalog_text(artifact.metadata), artifact.store, artifact.index)
+        self.catalog_watermark = json_util.loads(artifact.manifest.get("catalog_watermark") or "null")
+        self.artifact_version = artifact.version
+        self.pending_deltas = 0
+        self._replay_deltas(deltas)
+        return True
+
+    def write_artifact(self):
+        """Сохраняет текущее состояние поиска как новую версию артефакта"""
+        try:
+            with self.writer_lock:
+                path = write_artifact(
+                    self.artifact_root,
+                    metadata=self.metadata,
+                    store=self.store,
+                    vector_index=self.index,
+                    model_name=self.encoder.model_name,
+                    watermark=json_util.dumps(self.catalog_watermark),
+                    keep_versions=int(os.getenv("SEARCH_ARTIFACT_KEEP", 3))
+                )
+            self.artifact_version = os.path.basename(path)
+            self.pending_deltas = 0
+            return path
         except Exception as e:
-            logger.error(f"❌ Ошибка при генерации эмбеддингов: {str(e)}")
-            raise
-
-    def _precompute_features(self):
-        """Предварительно вычисляем нормализованные признаки"""
-        years = np.array([item.get('year', 2000) for item in self.metadata], dtype=np.float32)
-        self.norm_years = (years - years.min()) / (years.max() - years.min()) if years.max() > years.min() else years
-
-        self.genre_index = {}
-        for idx, item in enumerate(self.metadata):
-            for genre in item.get('genres', []):
-                # Обрабатываем случай, когда жанр представлен как словарь с полем 'name'
-                if isinstance(genre, dict) and 'name' in genre:
-                    genre_name = genre['name']
+            logger.error(f"❌ Не удалось записать артефакт индекса: {str(e)}")
+            return None
+
+    def _replay_deltas(self, deltas):
+        """Применяет записи журнала дельт артефакта (список (номер, массивы) из read_deltas)"""
+        for seq, arrays in deltas:
+            self._apply_delta({
+                "upsert_ids": arrays["upsert_ids"],
+                "vectors": arrays["vectors"],
+                "embedded_ids": arrays["embedded_ids"],
+                "removed_ids": arrays["removed_ids"],
+                "movies": json_util.loads(arrays["movies"].tobytes().decode("utf-8")),
+                "watermark": json_util.loads(arrays["watermark"].tobytes().decode("utf-8"))
+            })
+            self.pending_deltas = seq
+        if deltas:
+            logger.info(f"✅ Применено дельт из журнала артефакта {self.artifact_version}: {len(deltas)}")
+        return bool(deltas)
+
+    def follow_artifact(self):
+        """
+        Применяет изменения, которые записал другой процесс: новые дельты журнала текущей
+        версии артефакта или новую версию после сжатия журнала. True, если поиск обновлён.
+        """
+        if not self.artifact_root:
+            return False
+        with self.update_lock:
+            try:
+                return self._follow_artifact()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось применить изменения артефакта индекса: {str(e)}")
+                return False
+
+    def _follow_artifact(self):
+        """follow_artifact под update_lock"""
+        if not self.artifact_root:
+            return False
+        version = current_version(self.artifact_root)
+        if version is None:
+            return False
+        if version != self.artifact_version:
+            logger.info(f"🔄 Переход на версию артефакта индекса {version}")
+            updated = self._load_from_artifact()
+        else:
+            updated = self._replay_deltas(read_deltas(self.artifact_root, version, after=self.pending_deltas))
+        if updated:
+            self._after_update()
+        return updated
+
+    def _persist_delta(self, delta):
+        """
+        Сохраняет дельту, не переписывая артефакт и матрицу целиком: запись дописывается
+        в журнал артефакта, а полный снимок записывается в фоне после compact_deltas дельт
+        """
+        if self.artifact_root and self.artifact_version:
+            try:
+                self.pending_deltas = append_delta(self.artifact_root, self.artifact_version, {
+                    "upsert_ids": np.asarray(delta["upsert_ids"], dtype=np.int64),
+                    "vectors": delta["vectors"],
+                    "embedded_ids": delta["embedded_ids"],
+                    "removed_ids": delta["removed_ids"],
+                    "movies": np.frombuffer(json_util.dumps(delta["movies"]).encode("utf-8"), dtype=np.uint8),
+                    "watermark": np.frombuffer(json_util.dumps(delta["watermark"]).encode("utf-8"), dtype=np.uint8)
+                })
+            except Exception as e:
+                # Без записи в журнале дельту не увидят другие процессы: сразу пишем полный снимок
+                logger.error(f"❌ Не удалось дописать дельту в журнал артефакта: {str(e)}")
+                self.write_artifact()
+        else:
+            self.pending_deltas += 1
+        # В мастере gunicorn полный снимок записывается синхронно в конце загрузки
+        if 0 < self.compact_deltas <= self.pending_deltas and not self.compaction_running and not self.preload:
+            self.compaction_running = True
+            threading.Thread(target=self._compact, name="artifact-compaction", daemon=True).start()
+
+    def _compact(self):
+        """
+        Записывает полный снимок поиска в фоне: новую версию артефакта (процесс переходит
+        на неё, чтобы снова делить страницы mmap с остальными) или, без артефакта,
+        нормализованную копию эмбеддингов для следующего старта
+        """
+        try:
+            with self.update_lock, self.writer_lock:
+                self._follow_artifact()
+                if self.artifact_root:
+                    if self.write_artifact():
+                        self._load_from_artifact()
                 else:
-                    genre_name = genre
-                
-                if genre_name not in self.genre_index:
-                    self.genre_index[genre_name] = []
-                self.genre_index[genre_name].append(idx)
+                    self._save_embeddings(self.store)
+                    self.pending_deltas = 0
+        except Exception as e:
+            logger.error(f"❌ Не удалось записать полный снимок поиска: {str(e)}")
+        finally:
+            self.compaction_running = False
 
-        self.embeddings = normalize(self.embeddings)
-    
-    def _get_cache_key(self, query, year_filter, genre_filter):
+    def _get_cache_key(self, query, *filters):
         """Создает уникальный ключ для кэширования результатов поиска"""
-        key = f"{query}|{year_filter}|{genre_filter}"
+        key = "|".join(str(item) for item in (query,) + filters)
         return hashlib.md5(key.encode()).hexdigest()
     
-    def check_for_updates(self):
-        """Проверяет, появились ли новые фильмы в базе данных"""
-        # Запрашиваем только количество документов, не загружая их
-        current_count = self.collection.count_documents({})
-        
-        if current_count > self.movie_count:
-            logger.info(f"🔄 Обнаружены новые фильмы! Было: {self.movie_count}, стало: {current_count}")
-            
-            # Перезагружаем метаданные
-            self.metadata = self._load_metadata()
-            self.movie_count = len(self.metadata)
-            
-            # Обновляем эмбеддинги
-            self.embeddings = self._generate_embeddings()
-            
-            # Обновляем FAISS индекс
-            self.index = faiss.IndexFlatL2(self.embeddings.shape[1])
-            self.index.add(self.embeddings)
-            
-            # Пересчитываем признаки
-            self._precompute_features()
-            
-            # Очищаем кэш
-            self.search_cache.clear()
-            self.cache_hits = 0
-            self.total_searches = 0
-            
-            logger.info("✅ Поисковая система обновлена!")
-            return True
-        
-        return False
+    def _index_version(self):
+        """
+        Версия индекса для общего кэша: одинакова у реплик с одним состоянием каталога,
+        моделью и параметрами ранжирования
+        """
+        watermark = self.catalog_watermark or {}
+        key = "|".join(str(item) for item in (
+            self.encoder.model_name,
+            os.getenv("INDEX_TYPE", "flat").lower(),
+            self.search_candidates,
+            watermark.get("_id"),
+            watermark.get("updatedAt"),
+            watermark.get("count")
+        ))
+        return hashlib.md5(key.encode()).hexdigest()[:16]
 
-    def get_embedding(self, text):
-        """Получение эмбеддинга через Hugging Face API"""
+    def _read_catalog_watermark(self):
+        """Водяной знак каталога: последний _id, последний updatedAt и число документов"""
         try:
-            payload = {"inputs": f"query: {text}"}
-            response = requests.post(API_URL, headers=HEADERS, json=payload)
-            if response.status_code != 200:
-                logger.error(f"Ошибка API: {response.text}")
-                return None
-            return np.array(response.json())
+            last_doc = self.collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            last_updated = self.collection.find_one({"updatedAt": {"$exists": True}}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+            return {
+                "_id": last_doc["_id"] if last_doc else None,
+                "updatedAt": last_updated.get("updatedAt") if last_updated else None,
+                "count": self.collection.count_documents({})
+            }
         except Exception as e:
-            logger.error(f"Ошибка при получении эмбеддинга: {str(e)}")
+            logger.warning(f"⚠️ Не удалось прочитать водяной знак каталога: {str(e)}")
             return None
 
-    def search(self, query, top_k=10, year_filter=None, genre_filter=None):
-        """Выполняет векторный поиск фильмов"""
-        start_time = time()
-        self.total_searches += 1
-        
-        # Проверяем кэш
-        cache_key = self._get_cache_key(query, year_filter, genre_filter)
-        if cache_key in self.search_cache:
-            self.cache_hits += 1
-            hit_rate = (self.cache_hits / self.total_searches) * 100
-            logger.info(f"🔍 Кэш-хит! ({self.cache_hits}/{self.total_searches}, {hit_rate:.1f}%)")
-            return self._prepare_results_for_json(self.search_cache[cache_key])
-
-        clean_query, year_boost, genres = self._parse_query(query)
-
-        if year_filter:
-            year_boost = (int(year_filter) - 1900) / 125
-        if genre_filter:
-            genres.append(genre_filter.lower())
-
-        # Получаем эмбеддинг через API
-        query_embedding = self.get_embedding(clean_query)
-        if query_embedding is None:
-            logger.error("Не удалось получить эмбеддинг для запроса")
+    def check_for_updates(self):
+        """
+        Проверяет изменения каталога по водяному знаку (_id и updatedAt) и применяет их
+        инкрементально: эмбеддинги считаются только для новых и изменённых фильмов,
+        индекс обновляется точечно. Возвращает True, если поиск был обновлён.
+        """
+        with self.update_lock, self.writer_lock:
+            # Сначала применяем дельты, которые уже записали другие процессы
+            self._follow_artifact()
+            previous = self.catalog_watermark
+            watermark = self._read_catalog_watermark()
+            if watermark is None:
+                return False
+
+            if previous is None or previous["_id"] is None:
+                # Без водяного знака применить дельту нельзя: полная перезагрузка
+                logger.info("🔄 Полное обновление поисковой системы...")
+                self.metadata = self._load_metadata()
+                self._build_search_structures(self.store)
+                self.catalog_watermark = watermark
+                if self.artifact_root and self.write_artifact():
+                    self._load_from_artifact()
+                self._after_update()
+                return True
+
+            start_time = time()
+            if previous["updatedAt"] is not None:
+                updated_condition = {"updatedAt": {"$gt": previous["updatedAt"]}}
+            else:
+                updated_condition = {"updatedAt": {"$exists": True}}
+            conditions = [{"_id": {"$gt": previous["_id"]}}, updated_condition]
+            if self.embedding_failures:
+                # Повторяем фильмы, для которых в прошлый раз не удалось получить эмбеддинг
+                conditions.append({"_id": {"$in": list(self.embedding_failures)}})
+                self.embedding_failures = set()
+            docs = list(self.collection.find({"$or": conditions}, METADATA_PROJECTION))
+            inserted_count = sum(1 for doc in docs if doc["_id"] > previous["_id"])
+
+            removed_mongodb_ids = set()
+            if watermark["count"] != previous["count"] + inserted_count:
+                # Удаления или вставки с _id ниже водяного знака: сверяем полный список _id
+                current_ids = {doc["_id"] for doc in self.collection.find({}, {"_id": 1})}
+                known_ids = set(self.metadata.mongodb_ids())
+                removed_mongodb_ids = known_ids - {str(object_id) for object_id in current_ids}
+                fetched_ids = {doc["_id"] for doc in docs}
+                missed_ids = [object_id for object_id in current_ids
+                              if str(object_id) not in known_ids and object_id not in fetched_ids]
+                if missed_ids:
+                    docs.extend(self.collection.find({"_id": {"$in": missed_ids}}, METADATA_PROJECTION))
+
+            if not docs and not removed_mongodb_ids:
+                self.catalog_watermark = watermark
+                return False
+
+            logger.info(f"🔄 Изменения каталога: {len(docs)} новых или изменённых документов, {len(removed_mongodb_ids)} удалённых")
+            stats = self._apply_catalog_delta(docs, removed_mongodb_ids, watermark)
+
+            stats["seconds"] = round(time() - start_time, 2)
+            stats["finished_at"] = datetime.now().isoformat()
+            self.last_update = stats
+            self._after_update()
+
+            logger.info(f"✅ Поисковая система обновлена за {stats['seconds']:.2f} сек: {stats}")
+            return True
+
+    def _apply_catalog_delta(self, docs, removed_mongodb_ids, watermark):
+        """
+        Считает дельту по изменённым документам и удалениям (эмбеддинги только для новых
+        и изменённых текстов), применяет её к поиску и сохраняет в журнал
+        """
+        store, metadata = self.store, self.metadata
+
+        removed_ids = set()
+        if removed_mongodb_ids:
+            removed = np.fromiter((mongodb_id in removed_mongodb_ids for mongodb_id in metadata.mongodb_ids()),
+                                  dtype=bool, count=len(metadata))
+            removed_ids = set(metadata.keys[removed].tolist())
+
+        changed = {}
+        for doc in docs:
+            key = movie_key(doc)
+            movie = self._clean_movie(doc)
+            row = store.id_to_row.get(key)
+
+            # Дубликаты по id фильма: как и при полной загрузке, остаётся первый документ
+            if row is not None and metadata.mongodb_id(row) != str(doc["_id"]):
+                continue
+            if key in changed and changed[key]["mongodb_id"] != str(doc["_id"]):
+                continue
+
+            if movie is None:
+                # Фильм перестал проходить фильтры
+                if row is not None:
+                    removed_ids.add(key)
+                continue
+            changed[key] = movie
+
+        # Эмбеддинги пересчитываются только для новых фильмов и фильмов с изменённым текстом
+        embed_keys = [
+            key for key, movie in changed.items()
+            if key not in store or self._movie_text(metadata[store.id_to_row[key]]) != self._movie_text(movie)
+        ]
+        generated = {}
+        if embed_keys:
+            embed_vectors, embedded = self._generate_embeddings([changed[key] for key in embed_keys])
+            generated = {embed_keys[position]: embed_vectors[i] for i, position in enumerate(embedded)}
+
+        # Если эмбеддинг не получен, фильм остаётся в прежнем состоянии (новый не добавляется)
+        # и повторяется при следующем обновлении
+        failed_keys = set(embed_keys) - set(generated)
+        upsert_ids = [key for key in changed if key not in failed_keys]
+        embed_ids = set(generated)
+        vectors = np.empty((len(upsert_ids), store.dim), dtype=np.float32)
+        reused_positions = []
+        for i, key in enumerate(upsert_ids):
+            if key in generated:
+                vectors[i] = generated[key]
+            else:
+                reused_positions.append(i)
+        if reused_positions:
+            vectors[reused_positions] = store.take(store.rows_for([upsert_ids[i] for i in reused_positions]))
+
+        delta = {
+            "upsert_ids": upsert_ids,
+            "vectors": vectors,
+            "embedded_ids": np.array(sorted(embed_ids), dtype=np.int64),
+            "removed_ids": np.array(sorted(removed_ids), dtype=np.int64),
+            "movies": [changed[key] for key in upsert_ids],
+            "watermark": watermark
+        }
+        self._apply_delta(delta)
+        self._persist_delta(delta)
+
+        return {
+            "added": sum(1 for key in upsert_ids if key not in store),
+            "updated": sum(1 for key in upsert_ids if key in store),
+            "removed": len(removed_ids),
+            "embedded": len(embed_ids),
+            "embedding_failures": len(failed_keys)
+        }
+
+    def _apply_delta(self, delta):
+        """
+        Применяет дельту к хранилищу, признакам и индексу: та же функция воспроизводит
+        дельты из журнала артефакта при загрузке и в остальных процессах
+        """
+        store = self.store
+        new_store, keep = store.with_changes(delta["upsert_ids"], delta["vectors"], delta["removed_ids"])
+        new_movies = delta["movies"]
+        # Тексты сохранённых строк остаются в общем отображённом файле; в памяти процесса только
+        # тексты new_movies до следующей полной версии артефакта
+        new_metadata = self.metadata.patched(keep, new_movies)
+        years, filter_index = self._patched_features(keep, new_movies)
+
+        # В индексе id фильмов не зависят от номеров строк: меняются только удалённые и пересчитанные векторы
+        embedded_ids = delta["embedded_ids"].tolist()
+        index_removed = set(delta["removed_ids"].tolist()) | {key for key in embedded_ids if key in store}
+        new_index = self.index.updated(new_store, added_ids=embedded_ids, removed_ids=sorted(index_removed))
+
+        self._set_catalog(new_metadata, new_store, new_index, years, filter_index)
+        self.catalog_watermark = delta["watermark"]
+
+    def _after_update(self):
+        """Переводит кэш на новую версию данных после обновления каталога"""
+        # Записи кэша со старой версией больше не выдаются, очищать кэш не нужно
+        index_version = self._index_version()
+        with self.state_lock:
+            self.dataset_version += 1
+            self.index_version = index_version
+
+    def get_embeddings(self, texts):
+        """
+        Нормализованные эмбеддинги пакета запросов (None при ошибке). Эмбеддинги берутся
+        из кэша, а недостающие тексты кодируются одним вызовом кодировщика.
+        """
+        texts = [normalize_query_text(text) for text in texts]
+        embeddings = self.embedding_cache.get_many(set(texts))
+        missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+        if missing:
+            try:
+                vectors = np.asarray(self.encode_batcher.encode(missing), dtype=np.float32)
+            except Exception as e:
+                logger.error(f"Ошибка при получении эмбеддинга: {str(e)}")
+                return None
+            self.embedding_cache.set_many(missing, vectors)
+            embeddings.update(zip(missing, vectors))
+        return np.stack([embeddings[text] for text in texts])
+
+    def get_embedding(self, text):
+        """Получение нормализованного эмбеддинга запроса через настроенный кодировщик"""
+        embeddings = self.get_embeddings([text])
+        return embeddings[0] if embeddings is not None else None
+
+    def _search_state(self):
+        """Согласованный снимок состояния на случай параллельного обновления каталога"""
+        with self.state_lock:
+            return {
+                "index": self.index,
+                "store": self.store,
+                "metadata": self.metadata,
+                "years": self.years,
+                "filter_index": self.filter_index,
+                "boost_features": self.boost_features,
+                "query_parser": self.query_parser,
+                "version": self.dataset_version,
+                "index_version": self.index_version
+            }
+
+    @classmethod
+    def _exclude_keys(cls, exclude_ids):
+        """Ключи хранилища исключаемых фильмов: список id или строка id через запятую"""
+        if not exclude_ids:
             return []
+        if isinstance(exclude_ids, (str, int)):
+            exclude_ids = str(exclude_ids).split(",")
+        return sorted({cls._request_movie_key(movie_id) for movie_id in exclude_ids if str(movie_id).strip()})
 
-        # Нормализуем эмбеддинг
-        query_embedding = query_embedding / np.linalg.norm(query_embedding)
+    def _session_seen(self, session):
+        """id фильмов, уже показанных в сессии поиска"""
+        seen = self.sessions.get(session) if session else None
+        return seen if seen is not None else np.empty(0, dtype=np.int64)
 
-        # Получаем топ-N фильмов по косинусному сходству
-        faiss_top_k = min(100, len(self.metadata))
-        
-        text_scores = np.dot(self.embeddings, query_embedding.T).flatten()
-        year_scores = np.zeros_like(text_scores)
-        genre_scores = np.zeros_like(text_scores)
+    def _remember_seen(self, session, movie_ids):
+        """Добавляет показанные фильмы в сессию поиска"""
+        with self.session_lock:
+            seen = np.union1d(self._session_seen(session), np.asarray(movie_ids, dtype=np.int64))
+            self.sessions.set(session, seen, size=seen.nbytes + 128)
 
-        if year_boost is not None:
-            year_scores = 1.0 - np.abs(self.norm_years - year_boost)
+    def _plan_query(self, state, query, filters, exclude_keys=()):
+        """
+        Разбирает запрос и фильтры: допустимые строки, исключённые строки (уже просмотренные
+        фильмы), мягкие бусты и текст для эмбеддинга
+        """
+        year_from, year_to = parse_year_range(filters.get("year"))
+        allowed_rows = state["filter_index"].select(
+            year_from=year_from,
+            year_to=year_to,
+            genre=filters.get("genre"),
+            type=filters.get("type"),
+            country=filters.get("country"),
+            category=filters.get("category")
+        )
 
-        if genres:
-            for genre in genres:
-                genre_key = genre
-                if genre_key not in self.genre_index:
-                    for key in self.genre_index.keys():
-                        if key.lower() == genre.lower():
-                            genre_key = key
-                            break
-                if genre_key in self.genre_index:
-                    genre_scores[self.genre_index[genre_key]] += 0.1
+        # Год, десятилетия, жанры, страны и типы из текста запроса дают мягкие бусты
+        parsed = state["query_parser"].parse(query)
+        year_boost = None
+        if parsed.year_from is not None:
+            # Диапазон из запроса ("90-х", "2010-2015") задаётся центром и полушириной:
+            # внутри диапазона буст полный, за границами убывает с расстоянием до них
+            year_boost = ((parsed.year_from + parsed.year_to) / 2, (parsed.year_to - parsed.year_from) / 2)
+        attributes = [("genre", genre) for genre in parsed.genres]
+        attributes += [("country", country) for country in parsed.countries]
+        attributes += [("type", movie_type) for movie_type in parsed.types]
+        if parsed.year_from is not None:
+            attributes += BoostFeatures.decades(parsed.year_from, parsed.year_to)
+
+        if year_from is not None and year_from == year_to:
+            year_boost = (float(year_from), 0.0)
+        # Фильтр жанра может содержать несколько значений через запятую, как в FilterIndex.select
+        attributes += [("genre", genre) for genre in split_values(filters.get("genre"))]
+
+        exclude_rows = None
+        if len(exclude_keys):
+            exclude_rows = state["store"].rows_for(exclude_keys)
+            exclude_rows = np.unique(exclude_rows[exclude_rows >= 0])
+
+        return {
+            "text": parsed.text,
+            "allowed_rows": allowed_rows,
+            "exclude_rows": exclude_rows,
+            "year_boost": year_boost,
+            "attributes": attributes,
+            "boost_columns": state["boost_features"].columns_for(attributes)
+        }
+
+    def _score_candidates(self, state, plan, candidate_scores, candidate_indices, depth=100):
+        """
+        Применяет бусты к кандидатам из индекса. Возвращает не более depth лучших
+        (строки, итоговые оценки) выше порога релевантности по убыванию оценки.
+        """
+        metadata, years = state["metadata"], state["years"]
+        faiss_top_k = min(depth, len(metadata))
+
+        found = candidate_indices >= 0
+        candidates = candidate_indices[found]
+
+        # Итоговая оценка 0.85 * текст + 0.05 * год + 0.1 * атрибуты собирается в буферах потока
+        candidate_total, year_scores = self._score_buffers(len(candidates))
+        np.multiply(candidate_scores[found], 0.85, out=candidate_total)
 
-        total_scores = 0.85 * text_scores + 0.05 * year_scores + 0.1 * genre_scores
+        # Бусты по году, жанру, стране и типу считаются только для кандидатов
+        if plan["year_boost"] is not None:
+            year_center, year_half_width = plan["year_boost"]
+            np.take(years, candidates, out=year_scores)
+            year_scores -= year_center
+            np.abs(year_scores, out=year_scores)
+            # 0.05 * (1 - расстояние в годах от года до диапазона / YEAR_BOOST_SPAN),
+            # внутри диапазона расстояние 0 и буст полный
+            year_scores -= year_half_width
+            np.clip(year_scores, 0, YEAR_BOOST_SPAN, out=year_scores)
+            np.multiply(year_scores, -0.05 / YEAR_BOOST_SPAN, out=year_scores)
+            year_scores += 0.05
+            candidate_total += year_scores
 
-        indices = np.argpartition(total_scores, -faiss_top_k)[-faiss_top_k:]
-        best_indices = indices[np.argsort(-total_scores[indices])]
+        # Атрибуты запроса: строки кандидатов матрицы признаков на вектор весов, сразу в candidate_total
+        if plan["boost_columns"] is not None:
+            state["boost_features"].add_scores(candidates, plan["boost_columns"], candidate_total)
 
-        # Собираем результаты
+        order = np.argsort(-candidate_total)[:faiss_top_k]
+        best_indices = candidates[order]
+        best_scores = candidate_total[order]
+
+        # Пороговое значение релевантности
+        relevant = best_scores > 0.1
+        return best_indices[relevant], best_scores[relevant]
+
+    def _score_buffers(self, count):
+        """Буферы потока для оценок count кандидатов (растут до наибольшего числа кандидатов)"""
+        buffers = getattr(self.score_buffers, "arrays", None)
+        if buffers is None or len(buffers[0]) < count:
+            size = max(count, self.search_candidates)
+            buffers = (np.empty(size, dtype=np.float32), np.empty(size, dtype=np.float32))
+            self.score_buffers.arrays = buffers
+        return buffers[0][:count], buffers[1][:count]
+
+    def _rank_candidates(self, state, plan, candidate_scores, candidate_indices, top_k):
+        """
+        Применяет бусты к кандидатам из индекса и собирает top_k результатов
+        (для переранжирования top_k не меньше RERANK_DEPTH)
+        """
+        metadata = state["metadata"]
+        rows, scores = self._score_candidates(state, plan, candidate_scores, candidate_indices, depth=top_k)
+
+        # Документы собираются из колонок каталога только для итоговых top_k
         results = []
-        for idx in best_indices:
-            if total_scores[idx] > 0.1:  # Пороговое значение релевантности
-                movie = self.metadata[idx].copy()
-                movie["relevance_score"] = float(total_scores[idx])
+        for idx, score in zip(rows, scores):
+            movie = metadata[idx]
+            movie["relevance_score"] = float(score)
+            results.append(movie)
+        return results, rows
+
+    @staticmethod
+    def _hydrate(state, movie_ids, scores):
+        """Результаты по id фильмов и оценкам из общего кэша (удалённые фильмы пропускаются)"""
+        metadata = state["metadata"]
+        results = []
+        for row, score in zip(state["store"].rows_for(movie_ids).tolist(), scores.tolist()):
+            if row >= 0:
+                movie = metadata[row]
+                movie["relevance_score"] = float(score)
                 results.append(movie)
-                if len(results) >= top_k:
-                    break
+        return results
+
+    def _resolve_from_shared_cache(self, state, pending, results):
+        """
+        Отвечает на запросы из общего кэша в Redis. Для промахов берёт блокировки
+        пересчёта, а запросы, которые уже считает другая реплика, ждёт.
+        Возвращает (запросы, которые нужно посчитать, токен блокировок).
+        """
+        version = state["index_version"]
+        keys = list(dict.fromkeys(plan["cache_key"] for plan in pending))
+        found = self.shared_cache.get_many(version, keys)
+        missing = [key for key in keys if key not in found]
+        acquired, token = self.shared_cache.acquire(version, missing)
+        acquired = set(acquired)
+        found.update(self.shared_cache.wait_for(version, [key for key in missing if key not in acquired]))
+
+        remaining = []
+        for plan in pending:
+            hit = found.get(plan["cache_key"])
+            if hit is None:
+                remaining.append(plan)
+                continue
+            hits = self._hydrate(state, *hit)
+            self._store_in_cache(plan["cache_key"], hits, state["version"])
+            results[plan["position"]] = self._prepare_results_for_json(hits)
+        return remaining, token
 
-        # Сохраняем результаты в кэш
-        self.search_cache[cache_key] = results
+    def _store_in_cache(self, cache_key, results, version):
+        """Сохраняет результаты в кэш с версией данных, по которой они получены"""
+        self.result_cache.set(cache_key, results, version=version)
+
+    def search(self, query, top_k=10, year_filter=None, genre_filter=None,
+               type_filter=None, country_filter=None, category_filter=None,
+               exclude_ids=None, session=None, rerank=True):
+        """
+        Выполняет векторный поиск фильмов.
         
-        # Ограничиваем размер кэша
-        if len(self.search_cache) > 1000:
-            random_key = next(iter(self.search_cache))
-            del self.search_cache[random_key]
+        Фильтры жёсткие: year_filter - год или диапазон ("1990-1999"), остальные -
+        одно значение или несколько через запятую. Ранжируются только подходящие фильмы.
+        exclude_ids - id фильмов, которые не должны попасть в результат; session - ключ
+        сессии, в которой исключаются все фильмы, показанные в её предыдущих поисках.
+        rerank - проверять ли лучших кандидатов этапом переранжирования (если он настроен).
+        """
+        request_item = {
+            "query": query,
+            "limit": top_k,
+            "year": year_filter,
+            "genre": genre_filter,
+            "type": type_filter,
+            "country": country_filter,
+            "category": category_filter,
+            "exclude_ids": exclude_ids,
+            "session": session
+        }
+        # Одновременные одинаковые запросы (например, после промо на главной) ждут одного вычисления
+        rerank = rerank and self.reranker is not None
+        flight_key = self._get_cache_key(normalize_query_text(query), top_k, year_filter, genre_filter,
+                                         type_filter, country_filter, category_filter,
+                                         self._exclude_keys(exclude_ids), session, rerank)
+        if rerank:
+            results, shared = self.single_flight.do(flight_key, lambda: self._search_reranked(request_item))
+        else:
+            results, shared = self.single_flight.do(flight_key, lambda: self.search_batch([request_item], top_k=top_k)[0])
+        if shared:
+            results = [dict(movie) for movie in results]
+        return results
 
-        logger.info(f"⏱ Поиск за {time() - start_time:.2f}s | Найдено {len(results)} фильмов")
-        return self._prepare_results_for_json(results)
+    def _search_reranked(self, request_item):
+        """
+        Поиск с переранжированием: RERANK_DEPTH кандидатов векторного поиска проверяются
+        судьёй, в ответ попадают limit подтверждённых. Сессия запоминает только показанные фильмы.
+        """
+        session = request_item["session"]
+        candidates_item = dict(request_item, limit=max(request_item["limit"], self.reranker.depth), session=None)
+        if session:
+            candidates_item["exclude_ids"] = (list(self._exclude_keys(request_item["exclude_ids"]))
+                                              + self._session_seen(session).tolist())
+        candidates = self.search_batch([candidates_item])[0]
+        results = self.reranker.rerank(request_item["query"], candidates, request_item["limit"])
+        if session:
+            self._remember_seen(session, [self._request_movie_key(movie.get("id") or movie["_id"]) for movie in results])
+        return results
 
-    def _parse_query(self, query):
-        """Извлечение фильтров из запроса"""
-        year_match = re.search(r'\b(19\d{2}|20[0-2]\d)\b', query)
-        year_boost = None
-        if year_match:
-            year = int(year_match.group())
-            year_boost = (year - 1900) / 125
+    def search_page(self, query=None, page_size=10, cursor=None, year_filter=None, genre_filter=None,
+                    type_filter=None, country_filter=None, category_filter=None):
+        """
+        Постраничный поиск. Первый вызов (cursor=None) один раз ранжирует до
+        SEARCH_CURSOR_DEPTH кандидатов и сохраняет их id и оценки под курсором с коротким
+        TTL; следующие страницы - срезы сохранённого списка без кодирования и ранжирования.
+        Возвращает {"results", "next_cursor", "total"}; next_cursor - None на последней странице.
+        """
+        if page_size < 1:
+            # Пустая страница не сдвигает курсор: клиент получал бы один и тот же курсор бесконечно
+            raise ValueError("Размер страницы (limit) должен быть не меньше 1")
+        if cursor:
+            cursor_id, _, offset = cursor.partition(":")
+            entry = self.cursors.get(cursor_id)
+            if entry is None or not offset.isdigit():
+                raise SearchCursorError("Курсор поиска некорректен или истёк, повторите поиск")
+            movie_ids, scores = entry
+            offset = int(offset)
+        else:
+            filters = {
+                "year": year_filter,
+                "genre": genre_filter,
+                "type": type_filter,
+                "country": country_filter,
+                "category": category_filter
+            }
+            movie_ids, scores = self._rank_for_cursor(query or "", filters)
+            cursor_id = uuid.uuid4().hex
+            offset = 0
+            if len(movie_ids) > page_size:
+                self.cursors.set(cursor_id, (movie_ids, scores), size=movie_ids.nbytes + scores.nbytes)
 
-        genres = []
-        for genre in self.genre_index.keys():
-            # Нам не нужно обрабатывать словари genres, т.к. self.genre_index уже содержит строки
-            if isinstance(genre, str) and re.search(r'\b' + re.escape(genre) + r'\b', query, re.IGNORECASE):
-                genres.append(genre)
+        end = offset + page_size
+        results = self._hydrate(self._search_state(), movie_ids[offset:end], scores[offset:end])
+        return {
+            "results": self._prepare_results_for_json(results),
+            "next_cursor": f"{cursor_id}:{end}" if end < len(movie_ids) else None,
+            "total": len(movie_ids)
+        }
+
+    def _rank_for_cursor(self, query, filters):
+        """id фильмов и оценки до SEARCH_CURSOR_DEPTH лучших кандидатов запроса"""
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        state = self._search_state()
+        plan = self._plan_query(state, query, filters)
+        if not query or (plan["allowed_rows"] is not None and not len(plan["allowed_rows"])):
+            return empty
 
-        clean_query = query
-        return clean_query, year_boost, genres
+        query_embeddings = self.get_embeddings([plan["text"]])
+        if query_embeddings is None:
+            logger.error("Не удалось получить эмбеддинг для запроса")
+            return empty
+        norms = np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+
+        candidate_scores, candidate_indices = state["index"].search(
+            query_embeddings / norms, max(self.search_candidates, self.cursor_depth), rows=plan["allowed_rows"]
+        )
+        rows, scores = self._score_candidates(state, plan, candidate_scores[0], candidate_indices[0],
+                                              depth=self.cursor_depth)
+        return state["store"].ids[rows], scores.astype(np.float32)
+
+    def search_batch(self, queries, top_k=10):
+        """
+        Пакетный поиск: queries - список строк или словарей {"query", "limit", "year",
+        "genre", "type", "country", "category", "exclude_ids", "session"}. Все запросы кодируются одним вызовом
+        кодировщика, запросы с одинаковыми фильтрами ранжируются одной операцией
+        (матричное умножение для точного поиска или пакетный поиск FAISS).
+        Возвращает списки результатов в порядке запросов.
+        """
+        start_time = time()
+        state = self._search_state()
+
+        items = []
+        for item in queries:
+            if isinstance(item, str):
+                item = {"query": item}
+            filters = {field: item.get(field) for field in ("year", "genre", "type", "country", "category")}
+            items.append({
+                "query": item.get("query") or "",
+                "limit": int(item.get("limit") or top_k),
+                "filters": filters,
+                "exclude_keys": self._exclude_keys(item.get("exclude_ids")),
+                "session": item.get("session")
+            })
+
+        results = [None] * len(items)
+        pending = []
+        for position, item in enumerate(items):
+            filters = item["filters"]
+
+            # Проверяем кэш (результаты сессий зависят от уже показанных фильмов и не кэшируются)
+            cache_key = None
+            cached = None
+            if not item["session"]:
+                cache_key = self._get_cache_key(normalize_query_text(item["query"]), item["limit"], filters["year"], filters["genre"],
+                                                filters["type"], filters["country"], filters["category"],
+                                                *([item["exclude_keys"]] if item["exclude_keys"] else []))
+                cached = self.result_cache.get(cache_key, version=state["version"])
+            if cached is not None:
+                logger.info(f"🔍 Кэш-хит! ({self.result_cache.hits}/{self.result_cache.hits + self.result_cache.misses}, "
+                            f"{self.result_cache.hit_rate * 100:.1f}%)")
+                results[position] = self._prepare_results_for_json(cached)
+                continue
+
+            exclude_keys = item["exclude_keys"]
+            if item["session"]:
+                exclude_keys = np.union1d(np.asarray(exclude_keys, dtype=np.int64), self._session_seen(item["session"]))
+            plan = self._plan_query(state, item["query"], filters, exclude_keys)
+            if not item["query"] or (plan["allowed_rows"] is not None and not len(plan["allowed_rows"])):
+                # Пустой запрос или под фильтры не подходит ни один фильм
+                results[position] = []
+                continue
+            plan.update({"position": position, "cache_key": cache_key, "limit": item["limit"], "session": item["session"]})
+            pending.append(plan)
+
+        lock_token = None
+        if pending and self.shared_cache is not None:
+            session_plans = [plan for plan in pending if plan["cache_key"] is None]
+            pending, lock_token = self._resolve_from_shared_cache(
+                state, [plan for plan in pending if plan["cache_key"] is not None], results
+            )
+            pending += session_plans
+
+        if pending:
+            # Получаем эмбеддинги всех запросов за один проход кодировщика
+            query_embeddings = self.get_embeddings([plan["text"] for plan in pending])
+            if query_embeddings is None:
+                logger.error("Не удалось получить эмбеддинги для запросов")
+                for plan in pending:
+                    results[plan["position"]] = []
+                return results
+
+            # Нормализуем эмбеддинги
+            norms = np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            query_embeddings = query_embeddings / norms
+
+            # Запросы с одинаковыми фильтрами ранжируются одним пакетом
+            shared_entries = {}
+            groups = {}
+            for number, plan in enumerate(pending):
+                group_key = tuple(
+                    None if rows is None else hashlib.md5(rows.tobytes()).hexdigest()
+                    for rows in (plan["allowed_rows"], plan["exclude_rows"])
+                )
+                groups.setdefault(group_key, []).append(number)
+
+            for numbers in groups.values():
+                first = pending[numbers[0]]
+                # Получаем кандидатов из индекса FAISS по косинусному сходству;
+                # при фильтрах ранжируются только подходящие строки, исключённые строки
+                # маскируются до выбора лучших
+                candidate_scores, candidate_indices = state["index"].search(
+                    query_embeddings[numbers], max([self.search_candidates] + [pending[number]["limit"] for number in numbers]),
+                    rows=first["allowed_rows"], exclude=first["exclude_rows"]
+                )
+                for row_number, number in enumerate(numbers):
+                    plan = pending[number]
+                    found, rows = self._rank_candidates(state, plan, candidate_scores[row_number],
+                                                        candidate_indices[row_number], plan["limit"])
+                    results[plan["position"]] = self._prepare_results_for_json(found)
+                    if plan["session"]:
+                        self._remember_seen(plan["session"], state["store"].ids[rows])
+                        continue
+                    self._store_in_cache(plan["cache_key"], found, state["version"])
+                    shared_entries[plan["cache_key"]] = (
+                        state["store"].ids[rows], [movie["relevance_score"] for movie in found]
+                    )
+
+            if self.shared_cache is not None:
+                self.shared_cache.set_many(state["index_version"], shared_entries, token=lock_token)
+
+        found_count = sum(len(result) for result in results)
+        logger.info(f"⏱ Поиск за {time() - start_time:.2f}s | {len(items)} запросов | Найдено {found_count} фильмов")
+        return results
+
+    @staticmethod
+    def _request_movie_key(movie_id):
+        """Ключ хранилища для id из запроса: id Кинопоиска или MongoDB _id фильма без числового id"""
+        if isinstance(movie_id, int) and not isinstance(movie_id, bool):
+            return movie_id
+        movie_id = str(movie_id).strip()
+        if movie_id.startswith("movie:"):
+            movie_id = movie_id[len("movie:"):]
+        if movie_id.lstrip("-").isdigit():
+            return int(movie_id)
+        return movie_key({"mongodb_id": movie_id})
+
+    def similar(self, movie_ids, top_k=10, mode="mean", weights=None):
+        """
+        Фильмы, похожие на заданные, по уже сохранённым векторам (без вызова кодировщика).
+
+        mode: "mean" - ближайшие к среднему вектору, "weighted" - к взвешенному среднему
+        (weights выровнены с movie_ids), "max" - максимум сходства с любым из фильмов.
+        Сами фильмы из movie_ids в результат не попадают. Неизвестные id пропускаются.
+        """
+        if mode not in SIMILAR_MODES:
+            raise ValueError(f"Неизвестный режим: {mode}. Допустимые значения: {', '.join(SIMILAR_MODES)}")
+        if mode == "weighted" and (weights is None or len(weights) != len(movie_ids)):
+            raise ValueError("Для режима weighted нужен список weights той же длины, что и ids")
+
+        start_time = time()
+        state = self._search_state()
+        store, metadata = state["store"], state["metadata"]
+
+        keys = [self._request_movie_key(movie_id) for movie_id in movie_ids]
+        rows = store.rows_for(keys)
+        found = rows >= 0
+        if not found.any():
+            return []
+        input_rows = rows[found]
+        vectors = store.take(input_rows)
+
+        # Кандидатов берём с запасом на исключение самих входных фильмов
+        k = min(top_k + len(input_rows), len(metadata))
+        if mode == "max":
+            scores, indices = state["index"].search(vectors, k)
+            best = {}
+            for source, (row_scores, row_indices) in enumerate(zip(scores, indices)):
+                for score, idx in zip(row_scores.tolist(), row_indices.tolist()):
+                    if idx >= 0 and (idx not in best or score > best[idx][0]):
+                        best[idx] = (score, source)
+            ranked = sorted(best.items(), key=lambda item: -item[1][0])
+        else:
+            if mode == "weighted":
+                query = np.asarray(weights, dtype=np.float32)[found] @ vectors
+            else:
+                query = vectors.mean(axis=0)
+            norm = np.linalg.norm(query)
+            query = (query / norm if norm > 0 else query).reshape(1, -1)
+            scores, indices = state["index"].search(query, k)
+            ranked = [(idx, (score, None)) for score, idx in zip(scores[0].tolist(), indices[0].tolist()) if idx >= 0]
+
+        excluded = set(input_rows.tolist())
+        input_ids = np.asarray(movie_ids, dtype=object)[found]
+        results = []
+        for idx, (score, source) in ranked:
+            if idx in excluded:
+                continue
+            movie = metadata[idx]
+            movie["relevance_score"] = float(score)
+            if source is not None:
+                # Для режима max указываем, на какой из входных фильмов похож результат
+                movie["similar_to"] = input_ids[source]
+            results.append(movie)
+            if len(results) >= top_k:
+                break
+
+        logger.info(f"⏱ Похожие фильмы за {time() - start_time:.2f}s | {int(found.sum())}/{len(movie_ids)} фильмов | режим {mode}")
+        return self._prepare_results_for_json(results)
 
     def _prepare_results_for_json(self, results):
         """Подготавливает результаты для JSON, используя оригинальные ID из MongoDB"""
@@ -475,11 +1476,26 @@ class TurboMovieSearch:
         
         return prepared_results 
 
+def _memory_usage():
+    """Текущий и пиковый RSS процесса в МБ"""
+    usage = {}
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    usage["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        # Вне Linux доступен только пиковый RSS (в КБ)
+        usage["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return usage
+
 # Функция для получения единственного экземпляра TurboMovieSearch (Singleton)
-def get_turbo_movie_search_instance():
+def get_turbo_movie_search_instance(preload=False):
     global _turbo_movie_search_instance
     if _turbo_movie_search_instance is None:
-        _turbo_movie_search_instance = TurboMovieSearch()
+        _turbo_movie_search_instance = TurboMovieSearch(preload=preload)
     return _turbo_movie_search_instance
 
 # API маршруты
@@ -499,20 +1515,131 @@ def search_api():
         query = request.args.get("query", "")
         year_filter = request.args.get("year")
         genre_filter = request.args.get("genre")
+        type_filter = request.args.get("type")
+        country_filter = request.args.get("country")
+        category_filter = request.args.get("category")
+        exclude_ids = request.args.get("exclude_ids")
+        session = request.args.get("session")
         top_k = request.args.get("limit", 10, type=int)
+        cursor = request.args.get("cursor")
+        paginate = request.args.get("paginate", "0").lower() in ["1", "true", "yes"]
+        
+        if cursor or paginate:
+            # Постраничный режим: {"results", "next_cursor", "total"}
+            searcher = get_turbo_movie_search_instance()
+            page = searcher.search_page(
+                query,
+                page_size=top_k,
+                cursor=cursor,
+                year_filter=year_filter,
+                genre_filter=genre_filter,
+                type_filter=type_filter,
+                country_filter=country_filter,
+                category_filter=category_filter
+            )
+            return jsonify(page)
         
         if not query:
             return jsonify([])
         
         searcher = get_turbo_movie_search_instance()
-        results = searcher.search(query, top_k=top_k, year_filter=year_filter, genre_filter=genre_filter)
+        results = searcher.search(
+            query,
+            top_k=top_k,
+            year_filter=year_filter,
+            genre_filter=genre_filter,
+            type_filter=type_filter,
+            country_filter=country_filter,
+            category_filter=category_filter,
+            exclude_ids=exclude_ids,
+            session=session,
+            rerank=request.args.get("rerank", "1").lower() in ["1", "true", "yes"]
+        )
         #logger.info(f"{results}")
         return jsonify(results)
     
+    except SearchCursorError as e:
+        return jsonify({"status": "error", "message": str(e)}), 410
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка при выполнении поиска: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/search/batch", methods=["POST"])
+def search_batch_api():
+    """
+    Пакетный векторный поиск.
+    Тело запроса: {"queries": [{"query": "...", "limit": 10, "year": "1990-1999", "genre": "драма"}, ...], "limit": 10}
+    (элементом может быть и просто строка). Ответ: {"results": [[...], [...]]} в порядке запросов.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get("queries") or []
+        top_k = int(data.get("limit", 10))
+        max_queries = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", 64))
+        
+        if not isinstance(queries, list):
+            return jsonify({"status": "error", "message": "queries должен быть списком"}), 400
+        if len(queries) > max_queries:
+            return jsonify({"status": "error", "message": f"Не более {max_queries} запросов в пакете"}), 400
+        
+        searcher = get_turbo_movie_search_instance()
+        results = searcher.search_batch(queries, top_k=top_k)
+        return jsonify({"results": results})
+    
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении пакетного поиска: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/similar", methods=["POST"])
+def similar_api():
+    """
+    Похожие фильмы по id без повторного вычисления эмбеддингов.
+    Тело запроса: {"ids": [...], "limit": 10, "mode": "mean" | "weighted" | "max", "weights": [...]}.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        movie_ids = data.get("ids") or []
+        top_k = int(data.get("limit", 10))
+        max_ids = int(os.getenv("SIMILAR_MAX_IDS", 500))
+        
+        if not isinstance(movie_ids, list):
+            return jsonify({"status": "error", "message": "ids должен быть списком"}), 400
+        if len(movie_ids) > max_ids:
+            return jsonify({"status": "error", "message": f"Не более {max_ids} id в запросе"}), 400
+        if not movie_ids:
+            return jsonify([])
+        
+        searcher = get_turbo_movie_search_instance()
+        results = searcher.similar(
+            movie_ids,
+            top_k=top_k,
+            mode=data.get("mode", "mean"),
+            weights=data.get("weights")
+        )
+        return jsonify(results)
+    
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при поиске похожих фильмов: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/update_index", methods=["POST"])
+def update_index_api():
+    """Инкрементальное обновление поиска по изменениям каталога (например, после ночной загрузки)"""
+    try:
+        searcher = get_turbo_movie_search_instance()
+        updated = searcher.check_for_updates()
+        return jsonify({"updated": updated, "movies_count": searcher.movie_count, "last_update": searcher.last_update})
+    
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении поиска: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route("/status")
 def status():
     """Информация о состоянии поисковой системы"""
@@ -521,11 +1648,30 @@ def status():
         
         status_info = {
             "movies_count": searcher.movie_count,
-            "cache_size": len(searcher.search_cache),
-            "cache_hit_rate": f"{(searcher.cache_hits / searcher.total_searches * 100):.1f}%" if searcher.total_searches > 0 else "0.0%",
-            "total_searches": searcher.total_searches,
+            "cache_size": len(searcher.result_cache),
+            "cache_hit_rate": f"{searcher.result_cache.hit_rate * 100:.1f}%",
+            "total_searches": searcher.result_cache.hits + searcher.result_cache.misses,
+            "result_cache": searcher.result_cache.stats(),
+            "embedding_cache": searcher.embedding_cache.stats(),
+            "encoder_batching": searcher.encode_batcher.stats(),
+            "single_flight": searcher.single_flight.stats(),
+            "catalog": searcher.metadata.stats(),
+            "reranker": searcher.reranker.stats() if searcher.reranker is not None else None,
+            "search_cursors": len(searcher.cursors),
+            "shared_result_cache": searcher.shared_cache.stats() if searcher.shared_cache is not None else None,
+            "index_version": searcher.index_version,
+            "dataset_version": searcher.dataset_version,
             "embeddings_shape": list(searcher.embeddings.shape),
-            "genres_count": len(searcher.genre_index)
+            "embeddings_storage": searcher.store.describe(),
+            "memory": _memory_usage(),
+            "encoder_backend": searcher.encoder.backend,
+            "index": searcher.index.describe(),
+            "artifact_version": searcher.artifact_version,
+            "last_update": searcher.last_update,
+            "embedding_failures": len(searcher.embedding_failures),
+            "genres_count": len(searcher.genre_index),
+            "filters": searcher.filter_index.describe(),
+            "boost_features": searcher.boost_features.describe()
         }
         
         return jsonify(status_info)
@@ -536,7 +1682,7 @@ def status():
 
 if __name__ == "__main__":
     # Инициализируем поисковую систему при запуске
-    get_turbo_movie_search_instance()
+    get_turbo_movie_search_instance().start_artifact_follower()
     
     # Запускаем Flask-сервер
     port = int(os.getenv("PORT", 5002))
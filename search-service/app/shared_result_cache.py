@@ -0,0 +1,173 @@
+"""
+Общий для реплик search-service кэш результатов поиска в Redis.
+
+В Redis хранятся не готовые документы, а только top-K id фильмов и их оценки
+в компактном виде (int64 id + float32 оценки), поэтому попадание превращается в
+результаты локальным поиском метаданных по id. Ключ - ключ запроса (нормализованный
+текст, лимит, фильтры) и версия индекса: реплики с одинаковым состоянием каталога
+используют одни записи, а после обновления каталога версия меняется.
+
+Чтобы популярный запрос после промаха не считали одновременно все реплики, первая
+из них берёт короткую блокировку (SET NX), а остальные ждут появления результата
+до RESULT_CACHE_LOCK_WAIT секунд и только потом считают сами. Блокировка снимается
+скриптом Lua, который сравнивает владельца и удаляет ключ атомарно: блокировку, взятую
+другой репликой после истечения RESULT_CACHE_LOCK_TTL, он не трогает.
+"""
+import os
+import uuid
+import logging
+from time import monotonic, sleep
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "search:res"
+
+# Удаляет блокировку KEYS[1], только если её значение - токен ARGV[1]
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def encode_hits(ids, scores):
+    """Компактное представление результатов: id int64, затем оценки float32"""
+    return np.asarray(ids, dtype=np.int64).tobytes() + np.asarray(scores, dtype=np.float32).tobytes()
+
+
+def decode_hits(value):
+    """Обратное преобразование encode_hits: (id, оценки)"""
+    count = len(value) // 12
+    ids = np.frombuffer(value, dtype=np.int64, count=count)
+    scores = np.frombuffer(value, dtype=np.float32, count=count, offset=count * 8)
+    return ids, scores
+
+
+class SharedResultCache:
+    """Кэш id и оценок результатов в Redis с TTL и защитой от одновременного пересчёта"""
+
+    def __init__(self, redis_client, ttl=600, lock_ttl=5.0, lock_wait=0.5, poll_interval=0.02, backoff=30.0):
+        self.redis = redis_client
+        self.release_lock = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.disabled_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.waited_hits = 0
+        self.lock_timeouts = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls):
+        """Кэш по RESULT_CACHE_REDIS_URL или None, если он не настроен"""
+        redis_url = os.getenv("RESULT_CACHE_REDIS_URL")
+        if not redis_url:
+            return None
+        import redis
+
+        timeout = float(os.getenv("RESULT_CACHE_REDIS_TIMEOUT", 0.1))
+        logger.info(f"🗄 Общий кэш результатов поиска в Redis: {redis_url}")
+        return cls(
+            redis.Redis.from_url(redis_url, socket_timeout=timeout, socket_connect_timeout=timeout),
+            ttl=int(os.getenv("RESULT_CACHE_REDIS_TTL", 600)),
+            lock_ttl=float(os.getenv("RESULT_CACHE_LOCK_TTL", 5)),
+            lock_wait=float(os.getenv("RESULT_CACHE_LOCK_WAIT", 0.5)),
+            backoff=float(os.getenv("RESULT_CACHE_REDIS_BACKOFF", 30))
+        )
+
+    @staticmethod
+    def _key(version, key):
+        return f"{KEY_PREFIX}:{version}:{key}"
+
+    @property
+    def available(self):
+        return monotonic() >= self.disabled_until
+
+    def _failed(self, e):
+        self.errors += 1
+        self.disabled_until = monotonic() + self.backoff
+        logger.warning(f"⚠️ Общий кэш результатов в Redis недоступен, пауза {self.backoff:.0f} сек: {str(e)}")
+
+    def get_many(self, version, keys):
+        """Найденные записи: {ключ: (id, оценки)}"""
+        if not keys or not self.available:
+            return {}
+        try:
+            values = self.redis.mget([self._key(version, key) for key in keys])
+        except Exception as e:
+            self._failed(e)
+            return {}
+        found = {key: decode_hits(value) for key, value in zip(keys, values) if value is not None}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def acquire(self, version, keys):
+        """
+        Берёт блокировки пересчёта. Возвращает (ключи, для которых блокировка получена
+        или Redis недоступен, токен для снятия блокировок в set_many).
+        """
+        token = uuid.uuid4().hex
+        if not keys or not self.available:
+            return list(keys), token
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipeline.set(f"{self._key(version, key)}:lock", token, nx=True, px=int(self.lock_ttl * 1000))
+            return [key for key, ok in zip(keys, pipeline.execute()) if ok], token
+        except Exception as e:
+            self._failed(e)
+            return list(keys), token
+
+    def wait_for(self, version, keys):
+        """Ждёт результатов, которые считает другая реплика; возвращает найденные за RESULT_CACHE_LOCK_WAIT"""
+        found = {}
+        waiting = list(keys)
+        deadline = monotonic() + self.lock_wait
+        while waiting and monotonic() < deadline and self.available:
+            sleep(self.poll_interval)
+            try:
+                values = self.redis.mget([self._key(version, key) for key in waiting])
+            except Exception as e:
+                self._failed(e)
+                break
+            for key, value in zip(list(waiting), values):
+                if value is not None:
+                    found[key] = decode_hits(value)
+                    waiting.remove(key)
+        self.waited_hits += len(found)
+        self.lock_timeouts += len(waiting)
+        return found
+
+    def set_many(self, version, entries, token=None):
+        """Сохраняет {ключ: (id, оценки)} и снимает блокировки, взятые с токеном token"""
+        if not entries or not self.available:
+            return
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for key, (ids, scores) in entries.items():
+                pipeline.set(self._key(version, key), encode_hits(ids, scores), ex=self.ttl)
+                if token is not None:
+                    # Снимаем только свои блокировки: чужие могли появиться после истечения lock_ttl
+                    self.release_lock(keys=[f"{self._key(version, key)}:lock"], args=[token], client=pipeline)
+            pipeline.execute()
+        except Exception as e:
+            self._failed(e)
+
+    def stats(self):
+        """Статистика для /status"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "waited_hits": self.waited_hits,
+            "lock_timeouts": self.lock_timeouts,
+            "errors": self.errors,
+            "ttl": self.ttl
+        }
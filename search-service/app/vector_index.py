@@ -0,0 +1,347 @@
+"""
+Обёртка над индексами FAISS для векторного поиска фильмов.
+
+Все варианты используют скалярное произведение (METRIC_INNER_PRODUCT) по
+нормализованным векторам, то есть косинусное сходство:
+- flat     - точный поиск прямо по матрице EmbeddingStore (без второй копии в FAISS)
+- ivf_flat - инвертированные списки без сжатия (SQfp16 для float16), параметр поиска nprobe
+- ivf_pq   - инвертированные списки с product quantization, параметр поиска nprobe
+- hnsw     - граф HNSW (SQfp16 для float16), параметр поиска efSearch
+
+Векторы добавляются в FAISS с id фильмов из EmbeddingStore (add_with_ids), поэтому
+индекс можно обновлять точечно (updated), не перестраивая его при сдвиге строк матрицы.
+
+Точный поиск по большой матрице (от SEARCH_SHARD_MIN_ROWS строк) делится на части,
+которые считаются в общем пуле из SEARCH_THREADS потоков: каждая часть выбирает свой
+top-k через argpartition, затем частичные результаты сливаются. Пул фиксирован на процесс
+и не зависит от потоков BLAS (OMP_NUM_THREADS), поэтому одновременные запросы делят
+одни и те же потоки, а не умножают их число.
+"""
+import os
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# FAISS рекомендует не менее 39 обучающих векторов на кластер
+MIN_POINTS_PER_CENTROID = 39
+MAX_TRAINING_POINTS_PER_CENTROID = 256
+
+
+_shard_pools = {}
+_shard_pools_lock = threading.Lock()
+
+
+def shard_pool(threads):
+    """Общий на процесс пул потоков для точного поиска по частям матрицы"""
+    with _shard_pools_lock:
+        pool = _shard_pools.get(threads)
+        if pool is None:
+            pool = _shard_pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="exact-search")
+        return pool
+
+
+def default_nlist(count):
+    """Число кластеров IVF по эмпирическому правилу 4*sqrt(N)"""
+    nlist = int(4 * np.sqrt(max(count, 1)))
+    return max(1, min(nlist, count // MIN_POINTS_PER_CENTROID))
+
+
+class VectorIndex:
+    """Индекс FAISS с настраиваемым типом и параметрами поиска"""
+
+    def __init__(self, index_type="flat", nlist=None, nprobe=16, pq_m=64, pq_bits=8,
+                 hnsw_m=32, ef_construction=200, ef_search=128, filter_exact_max=20000,
+                 search_threads=1, shard_min_rows=20000):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Неизвестный тип индекса: {index_type}. Допустимые значения: {', '.join(INDEX_TYPES)}")
+
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.pq_bits = pq_bits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        # До такого числа отфильтрованных строк точный поиск по ним быстрее ANN с селектором
+        self.filter_exact_max = filter_exact_max
+        # Точный поиск по частям матрицы в пуле потоков (1 - без деления)
+        self.search_threads = max(1, search_threads)
+        self.shard_min_rows = shard_min_rows
+        self.index = None
+        self.store = None
+
+    @classmethod
+    def from_env(cls):
+        """Создаёт индекс по переменным окружения INDEX_*"""
+        nlist = int(os.getenv("INDEX_NLIST", 0)) or None
+        return cls(
+            index_type=os.getenv("INDEX_TYPE", "flat").lower(),
+            nlist=nlist,
+            nprobe=int(os.getenv("INDEX_NPROBE", 16)),
+            pq_m=int(os.getenv("INDEX_PQ_M", 64)),
+            pq_bits=int(os.getenv("INDEX_PQ_BITS", 8)),
+            hnsw_m=int(os.getenv("INDEX_HNSW_M", 32)),
+            ef_construction=int(os.getenv("INDEX_EF_CONSTRUCTION", 200)),
+            ef_search=int(os.getenv("INDEX_EF_SEARCH", 128)),
+            filter_exact_max=int(os.getenv("INDEX_FILTER_EXACT_MAX", 20000)),
+            search_threads=int(os.getenv("SEARCH_THREADS", min(os.cpu_count() or 1, 4))),
+            shard_min_rows=int(os.getenv("SEARCH_SHARD_MIN_ROWS", 20000))
+        )
+
+    @classmethod
+    def from_description(cls, info):
+        """Восстанавливает параметры по describe(); параметры поиска берутся из окружения"""
+        vector_index = cls.from_env()
+        vector_index.index_type = info["type"]
+        vector_index.nlist = info.get("nlist", vector_index.nlist)
+        vector_index.pq_m = info.get("pq_m", vector_index.pq_m)
+        vector_index.pq_bits = info.get("pq_bits", vector_index.pq_bits)
+        vector_index.hnsw_m = info.get("hnsw_m", vector_index.hnsw_m)
+        return vector_index
+
+    def attach(self, store, faiss_index=None):
+        """Подключает готовый индекс FAISS (например, прочитанный с диска) без перестроения"""
+        self.store = store
+        self.index = faiss_index
+        if faiss_index is not None:
+            self._apply_search_params()
+        return self
+
+    def _create_index(self, count, dim, half_precision):
+        """Создаёт пустой индекс FAISS и возвращает его вместе с описанием"""
+        if self.index_type == "hnsw":
+            if half_precision:
+                index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+            # HNSW не хранит собственные id: оборачиваем в IndexIDMap2
+            return faiss.IndexIDMap2(index), f"HNSW{self.hnsw_m}{',SQfp16' if half_precision else ''}"
+
+        self.nlist = max(1, min(self.nlist or default_nlist(count), count))
+        if self.index_type == "ivf_flat":
+            factory_string = f"IVF{self.nlist},{'SQfp16' if half_precision else 'Flat'}"
+        else:
+            if dim % self.pq_m != 0:
+                raise ValueError(f"Размерность {dim} должна делиться на INDEX_PQ_M={self.pq_m}")
+            factory_string = f"IVF{self.nlist},PQ{self.pq_m}x{self.pq_bits}"
+
+        return faiss.index_factory(dim, factory_string, faiss.METRIC_INNER_PRODUCT), factory_string
+
+    def build(self, store):
+        """Строит индекс по хранилищу нормализованных эмбеддингов (EmbeddingStore)"""
+        start_time = time()
+        self.store = store
+
+        if self.index_type == "flat":
+            # Точный поиск идёт по матрице хранилища, FAISS-копия не нужна
+            self.index = None
+            logger.info(f"✅ Точный поиск по общей матрице эмбеддингов {store.dtype.name}: {store.count} векторов")
+            return self
+
+        count, dim = store.shape
+        index, description = self._create_index(count, dim, store.dtype == np.float16)
+
+        if not index.is_trained:
+            # Для обучения достаточно случайной подвыборки
+            max_points = self.nlist * MAX_TRAINING_POINTS_PER_CENTROID
+            if count > max_points:
+                sample = np.random.default_rng(0).choice(count, max_points, replace=False)
+                index.train(store.take(np.sort(sample)))
+            else:
+                index.train(store.take(slice(None)))
+
+        for start, chunk in store.iter_float32_chunks():
+            index.add_with_ids(chunk, store.ids[start:start + len(chunk)])
+
+        self.index = index
+        self._apply_search_params()
+
+        logger.info(f"✅ Индекс FAISS {description} (IP) построен за {time() - start_time:.2f} сек: {index.ntotal} векторов")
+        return self
+
+    def updated(self, store, added_ids=(), removed_ids=()):
+        """
+        Возвращает индекс для изменённого хранилища store: из копии текущего индекса
+        удаляются removed_ids и добавляются векторы added_ids (remove_ids/add_with_ids).
+        Текущий индекс не меняется, поэтому параллельные поиски работают с ним до подмены.
+        HNSW не поддерживает удаление, поэтому при удалениях граф строится заново.
+        """
+        vector_index = copy.copy(self)
+        vector_index.store = store
+
+        if self.index is None:
+            # Точный поиск читает матрицу хранилища напрямую
+            return vector_index
+        if len(removed_ids) and self.index_type == "hnsw":
+            logger.info(f"🔄 Перестроение HNSW: удаление {len(removed_ids)} векторов не поддерживается графом")
+            return vector_index.build(store)
+
+        start_time = time()
+        vector_index.index = faiss.clone_index(self.index)
+        if len(removed_ids):
+            vector_index.index.remove_ids(np.asarray(removed_ids, dtype=np.int64))
+        if len(added_ids):
+            added_ids = np.asarray(added_ids, dtype=np.int64)
+            vector_index.index.add_with_ids(store.take(store.rows_for(added_ids)), added_ids)
+        vector_index._apply_search_params()
+
+        logger.info(f"✅ Индекс обновлён за {time() - start_time:.2f} сек: +{len(added_ids)} / -{len(removed_ids)} векторов")
+        return vector_index
+
+    def _apply_search_params(self):
+        parameters = faiss.ParameterSpace()
+        if self.index_type in ("ivf_flat", "ivf_pq"):
+            parameters.set_index_parameter(self.index, "nprobe", self.nprobe)
+        elif self.index_type == "hnsw":
+            parameters.set_index_parameter(self.index, "efSearch", self.ef_search)
+
+    @property
+    def ntotal(self):
+        if self.index is not None:
+            return self.index.ntotal
+        return self.store.count if self.store is not None else 0
+
+    def search(self, queries, k, rows=None, exclude=None):
+        """
+        Возвращает (scores, indices) размерности (len(queries), k).
+        Отсутствующие результаты помечаются индексом -1.
+
+        rows - необязательный массив номеров строк (жёсткий фильтр): результаты берутся
+        только из них. Небольшие подмножества ранжируются точно, большие - через индекс
+        FAISS с IDSelector.
+        exclude - необязательный массив номеров строк, которые не должны попасть в
+        результат (уже просмотренные фильмы). Исключение применяется до выбора top-k,
+        поэтому возвращаются следующие лучшие фильмы.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+
+        if exclude is not None and len(exclude):
+            excluded = np.zeros(self.store.count, dtype=bool)
+            excluded[np.asarray(exclude, dtype=np.int64)] = True
+            if rows is None:
+                remaining = self.store.count - int(excluded.sum())
+                if remaining <= 0:
+                    return (np.empty((queries.shape[0], 0), dtype=np.float32),
+                            np.empty((queries.shape[0], 0), dtype=np.int64))
+                k = max(1, min(int(k), remaining))
+                if self.index is None:
+                    return self._exact_search(queries, k, excluded=excluded)
+                return self._excluding_search(queries, k, np.flatnonzero(excluded))
+            rows = np.asarray(rows, dtype=np.int64)
+            rows = rows[~excluded[rows]]
+
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            if not len(rows):
+                return (np.empty((queries.shape[0], 0), dtype=np.float32),
+                        np.empty((queries.shape[0], 0), dtype=np.int64))
+            if self.index is None or len(rows) <= self.filter_exact_max:
+                return self._exact_search(queries, max(1, min(int(k), len(rows))), rows)
+            return self._filtered_search(queries, max(1, min(int(k), len(rows))), rows)
+
+        k = max(1, min(int(k), self.ntotal))
+        if self.index is not None:
+            scores, movie_ids = self.index.search(queries, k)
+            return scores, self._movie_ids_to_rows(movie_ids)
+        return self._exact_search(queries, k)
+
+    def _movie_ids_to_rows(self, movie_ids):
+        # FAISS возвращает id фильмов, переводим их в номера строк хранилища
+        return self.store.rows_for(movie_ids.ravel()).reshape(movie_ids.shape)
+
+    def _filtered_search(self, queries, k, rows):
+        """ANN-поиск только среди строк rows через SearchParameters с IDSelectorBatch"""
+        allowed_ids = np.ascontiguousarray(self.store.ids[rows])
+        selector = faiss.IDSelectorBatch(len(allowed_ids), faiss.swig_ptr(allowed_ids))
+        return self._selector_search(queries, k, selector)
+
+    def _excluding_search(self, queries, k, rows):
+        """ANN-поиск по всем строкам, кроме rows, через IDSelectorNot"""
+        excluded_ids = np.ascontiguousarray(self.store.ids[rows])
+        excluded_selector = faiss.IDSelectorBatch(len(excluded_ids), faiss.swig_ptr(excluded_ids))
+        selector = faiss.IDSelectorNot(excluded_selector)
+        return self._selector_search(queries, k, selector)
+
+    def _selector_search(self, queries, k, selector):
+        if self.index_type == "hnsw":
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.ef_search, k))
+        else:
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        scores, movie_ids = self.index.search(queries, k, params=params)
+        return scores, self._movie_ids_to_rows(movie_ids)
+
+    def _exact_search(self, queries, k, rows=None, excluded=None):
+        """
+        Точный top-k по матрице хранилища (или строкам rows): argpartition + сортировка только k лучших.
+        excluded - битовая маска строк, которые не участвуют в выборе top-k.
+        """
+        if self.search_threads > 1 and (self.store.count if rows is None else len(rows)) >= self.shard_min_rows:
+            return self._sharded_exact_search(queries, k, rows, excluded)
+
+        scores = self.store.dot(queries, rows)
+        if excluded is not None:
+            scores[excluded] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        top_scores = np.take_along_axis(scores, top, axis=0)
+        order = np.argsort(-top_scores, axis=0)
+        indices = np.take_along_axis(top, order, axis=0).T.astype(np.int64)
+        if rows is not None:
+            indices = rows[indices]
+        return np.take_along_axis(top_scores, order, axis=0).T, indices
+
+    def _sharded_exact_search(self, queries, k, rows=None, excluded=None):
+        """
+        Точный top-k по частям матрицы (или строк rows) в пуле SEARCH_THREADS потоков:
+        каждая часть считает скалярные произведения и свой top-k, затем top-k по всем частям.
+        """
+        total = self.store.count if rows is None else len(rows)
+        bounds = np.linspace(0, total, min(self.search_threads, total) + 1).astype(np.int64).tolist()
+
+        def score_shard(start, end):
+            if rows is None:
+                scores = self.store.dot(queries, start=start, end=end)
+                if excluded is not None:
+                    scores[excluded[start:end]] = -np.inf
+            else:
+                scores = self.store.dot(queries, rows[start:end])
+            # k лучших части без сортировки: argpartition по возрастанию, хвост из shard_k строк
+            shard_k = min(k, end - start)
+            top = np.argpartition(scores, end - start - shard_k, axis=0)[end - start - shard_k:]
+            return np.take_along_axis(scores, top, axis=0), top + start
+
+        shards = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        parts = list(shard_pool(self.search_threads).map(lambda shard: score_shard(*shard), shards))
+        scores = np.concatenate([part[0] for part in parts])
+        positions = np.concatenate([part[1] for part in parts])
+
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        top_scores = np.take_along_axis(scores, top, axis=0)
+        order = np.argsort(-top_scores, axis=0)
+        indices = np.take_along_axis(np.take_along_axis(positions, top, axis=0), order, axis=0).T.astype(np.int64)
+        if rows is not None:
+            indices = rows[indices]
+        return np.take_along_axis(top_scores, order, axis=0).T, indices
+
+    def describe(self):
+        """Параметры индекса для /status"""
+        info = {"type": self.index_type, "ntotal": self.ntotal, "search_threads": self.search_threads}
+        if self.index_type in ("ivf_flat", "ivf_pq"):
+            info.update({"nlist": self.nlist, "nprobe": self.nprobe})
+        if self.index_type == "ivf_pq":
+            info.update({"pq_m": self.pq_m, "pq_bits": self.pq_bits})
+        if self.index_type == "hnsw":
+            info.update({"hnsw_m": self.hnsw_m, "ef_search": self.ef_search})
+        return info
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули сервиса импортируют друг друга по имени, как при запуске из каталога app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
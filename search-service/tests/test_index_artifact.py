@@ -0,0 +1,177 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+from index_artifact import (CATALOG_DIR, DELTAS_DIR, ArtifactError, append_delta, current_version,
+                            load_artifact, read_deltas)
+from movie_catalog import MovieCatalog
+from process_lock import ProcessLock
+from search_service import TurboMovieSearch
+from vector_index import VectorIndex
+
+DIM = 8
+MODEL_NAME = "test-model"
+WATERMARK = {"_id": None, "updatedAt": None, "count": 0}
+
+
+def make_movie(movie_id, name=None):
+    return {
+        "_id": f"{movie_id:024x}",
+        "mongodb_id": f"{movie_id:024x}",
+        "id": movie_id,
+        "name": name or f"Фильм {movie_id}",
+        "year": 1980 + movie_id % 40,
+        "description": f"описание фильма {movie_id}",
+        "genres": [{"name": "драма" if movie_id % 2 else "комедия"}],
+        "countries": [{"name": "США"}],
+        "type": "movie",
+        "rating": {"kp": 7.5}
+    }
+
+
+def make_vectors(movie_ids):
+    rng = np.random.default_rng(sum(movie_ids))
+    vectors = rng.standard_normal((len(movie_ids), DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class StubEncoder:
+    model_name = MODEL_NAME
+
+
+def make_searcher(root):
+    """TurboMovieSearch без MongoDB и кодировщика: только состояние поиска и артефакт в root"""
+    searcher = TurboMovieSearch.__new__(TurboMovieSearch)
+    searcher.encoder = StubEncoder()
+    searcher.embeddings_dtype = "float32"
+    searcher.embeddings_mmap = True
+    searcher.catalog_text_mmap = False
+    searcher.artifact_root = str(root)
+    searcher.artifact_version = None
+    searcher.pending_deltas = 0
+    searcher.compact_deltas = 0
+    searcher.compaction_running = False
+    searcher.preload = False
+    searcher.catalog_watermark = dict(WATERMARK)
+    searcher.state_lock = threading.Lock()
+    searcher.update_lock = threading.Lock()
+    searcher.writer_lock = ProcessLock(os.path.join(str(root), ".writer.lock"))
+    return searcher
+
+
+def build_searcher(root, movie_ids):
+    searcher = make_searcher(root)
+    movies = [make_movie(movie_id) for movie_id in movie_ids]
+    store = EmbeddingStore(make_vectors(movie_ids), ids=np.asarray(movie_ids, dtype=np.int64), normalized=True)
+    searcher._set_full_catalog(MovieCatalog.from_movies(movies), store, VectorIndex().build(store))
+    assert searcher.write_artifact()
+    return searcher
+
+
+def delta(upserts=(), vectors=None, embedded_ids=(), removed_ids=(), count=0):
+    """Дельта в формате TurboMovieSearch._apply_delta"""
+    return {
+        "upsert_ids": [movie["id"] for movie in upserts],
+        "vectors": vectors if vectors is not None else np.empty((0, DIM), dtype=np.float32),
+        "embedded_ids": np.asarray(embedded_ids, dtype=np.int64),
+        "removed_ids": np.asarray(removed_ids, dtype=np.int64),
+        "movies": list(upserts),
+        "watermark": dict(WATERMARK, count=count)
+    }
+
+
+def searcher_contents(searcher):
+    """id строк, векторы и документы поиска по id фильма"""
+    store = searcher.store
+    return {
+        movie_id: (store.take(np.array([row]))[0], searcher.metadata[row])
+        for row, movie_id in enumerate(store.ids.tolist())
+    }
+
+
+def assert_same_contents(expected, actual):
+    assert sorted(actual) == sorted(expected)
+    for movie_id, (vector, movie) in expected.items():
+        np.testing.assert_allclose(actual[movie_id][0], vector, rtol=1e-6)
+        assert actual[movie_id][1] == movie
+
+
+def test_artifact_round_trip(tmp_path):
+    movie_ids = list(range(1, 21))
+    searcher = build_searcher(tmp_path, movie_ids)
+
+    artifact = load_artifact(str(tmp_path), MODEL_NAME, "flat", "float32")
+    assert artifact.version == current_version(str(tmp_path)) == searcher.artifact_version
+    np.testing.assert_array_equal(artifact.ids, movie_ids)
+    np.testing.assert_allclose(artifact.store.take(slice(None)), make_vectors(movie_ids), rtol=1e-6)
+    assert [artifact.metadata[row] for row in range(len(movie_ids))] == list(searcher.metadata)
+
+
+def test_delta_log_appends_in_order(tmp_path):
+    version = build_searcher(tmp_path, [1, 2, 3]).artifact_version
+    records = [{"removed_ids": np.array([seq], dtype=np.int64)} for seq in range(1, 4)]
+
+    assert [append_delta(str(tmp_path), version, record) for record in records] == [1, 2, 3]
+    deltas = read_deltas(str(tmp_path), version)
+    assert [seq for seq, _ in deltas] == [1, 2, 3]
+    for (_, arrays), record in zip(deltas, records):
+        np.testing.assert_array_equal(arrays["removed_ids"], record["removed_ids"])
+    # Процесс, применивший первую запись, читает только следующие
+    assert [seq for seq, _ in read_deltas(str(tmp_path), version, after=1)] == [2, 3]
+
+
+def test_deltas_replayed_after_restart(tmp_path):
+    searcher = build_searcher(tmp_path, list(range(1, 11)))
+
+    # Добавление нового фильма, изменение текста и вектора существующего, удаление
+    changes = [
+        delta([make_movie(11)], make_vectors([11]), embedded_ids=[11], count=11),
+        delta([make_movie(3, name="Новое название")], make_vectors([103]), embedded_ids=[3], count=11),
+        delta(removed_ids=[5, 7], count=9)
+    ]
+    for change in changes:
+        searcher._apply_delta(change)
+        searcher._persist_delta(change)
+    assert searcher.pending_deltas == len(changes)
+
+    restarted = make_searcher(tmp_path)
+    assert restarted._load_from_artifact()
+    assert restarted.artifact_version == searcher.artifact_version
+    assert restarted.pending_deltas == len(changes)
+    assert restarted.catalog_watermark == changes[-1]["watermark"]
+    assert_same_contents(searcher_contents(searcher), searcher_contents(restarted))
+
+    contents = searcher_contents(restarted)
+    assert sorted(contents) == [1, 2, 3, 4, 6, 8, 9, 10, 11]
+    assert contents[3][1]["name"] == "Новое название"
+    np.testing.assert_allclose(contents[3][0], make_vectors([103])[0], rtol=1e-6)
+
+
+def test_tampered_artifact_file_rejected(tmp_path):
+    version = build_searcher(tmp_path, list(range(1, 11))).artifact_version
+    catalog_dir = os.path.join(str(tmp_path), version, CATALOG_DIR)
+    # Байты строк каталога (названия, описания): самый большой файл .bin
+    path = max((os.path.join(catalog_dir, name) for name in os.listdir(catalog_dir) if name.endswith(".bin")),
+               key=os.path.getsize)
+    with open(path, "r+b") as target:
+        first = target.read(1)
+        target.seek(0)
+        target.write(bytes([first[0] ^ 0xFF]))
+
+    with pytest.raises(ArtifactError, match="Контрольная сумма"):
+        load_artifact(str(tmp_path), MODEL_NAME, "flat", "float32")
+    # Процесс с повреждённым артефактом не переходит на него, а пересобирает поиск
+    assert not make_searcher(tmp_path)._load_from_artifact()
+
+
+def test_corrupted_delta_rejected(tmp_path):
+    version = build_searcher(tmp_path, [1, 2, 3]).artifact_version
+    append_delta(str(tmp_path), version, {"removed_ids": np.array([1], dtype=np.int64)})
+    with open(os.path.join(str(tmp_path), version, DELTAS_DIR, "000001.npz"), "r+b") as target:
+        target.truncate(20)
+
+    with pytest.raises(ArtifactError):
+        read_deltas(str(tmp_path), version)
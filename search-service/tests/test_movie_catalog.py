@@ -0,0 +1,36 @@
+import mmap
+
+from movie_catalog import MovieCatalog
+
+
+def make_movie(movie_id, name=None):
+    return {"_id": f"{movie_id:024x}", "mongodb_id": f"{movie_id:024x}", "id": movie_id,
+            "name": name or f"Фильм {movie_id}", "year": 2000, "description": f"описание {movie_id}"}
+
+
+def test_patched_catalog_keeps_mapped_strings(tmp_path):
+    MovieCatalog.from_movies([make_movie(movie_id) for movie_id in range(1, 11)]).save(str(tmp_path))
+    catalog = MovieCatalog.load(str(tmp_path), keys=list(range(1, 11)))
+    base = catalog.columns["name"].data
+    assert isinstance(base, mmap.mmap)
+
+    keep = [movie_id not in (3, 7) for movie_id in range(1, 11)]
+    patched = catalog.patched(keep, [make_movie(11, name="Новый фильм")])
+    patched = patched.patched([True] * len(patched), [make_movie(12)])
+
+    # Строки сохранённых фильмов ссылаются на отображённый файл, в памяти только строки новых
+    name_column = patched.columns["name"]
+    assert name_column.parts[0] is base
+    assert all(not isinstance(part, mmap.mmap) for part in name_column.parts[1:])
+    assert sum(len(part) for part in name_column.parts[1:]) == len("Новый фильм".encode("utf-8")) + len("Фильм 12".encode("utf-8"))
+    assert [movie["name"] for movie in patched] == (
+        [f"Фильм {movie_id}" for movie_id in (1, 2, 4, 5, 6, 8, 9, 10)] + ["Новый фильм", "Фильм 12"]
+    )
+    assert [patched.mongodb_id(row) for row in range(len(patched))] == (
+        [f"{movie_id:024x}" for movie_id in (1, 2, 4, 5, 6, 8, 9, 10, 11, 12)]
+    )
+
+    # Каталог после дельт сохраняется и загружается в том же формате
+    patched.save(str(tmp_path / "patched"))
+    reloaded = MovieCatalog.load(str(tmp_path / "patched"), keys=patched.keys)
+    assert list(reloaded) == list(patched)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from movie_catalog import MovieCatalog
+from movie_filters import FilterIndex, parse_year_range, split_values
+
+MOVIES = [
+    {"id": 1, "name": "A", "year": 1994, "genres": [{"name": "Драма"}], "countries": [{"name": "США"}], "type": "movie"},
+    {"id": 2, "name": "B", "year": 1999, "genres": [{"name": "Комедия"}], "countries": [{"name": "Франция"}], "type": "movie"},
+    {"id": 3, "name": "C", "year": 2005, "genres": [{"name": "Драма"}, {"name": "Комедия"}], "countries": [{"name": "США"}],
+     "type": "tv-series", "category": "Сериалы"},
+    {"id": 4, "name": "D", "year": 2012, "genres": [{"name": "Фантастика"}], "countries": [{"name": "США"}, {"name": "Франция"}],
+     "type": "movie"},
+    {"id": 5, "name": "E", "year": 1987, "genres": [], "countries": [{"name": "Россия"}], "type": "cartoon"}
+]
+
+
+@pytest.fixture
+def filter_index():
+    return FilterIndex.from_catalog(MovieCatalog.from_movies(MOVIES))
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, (None, None)),
+    ("", (None, None)),
+    (1999, (1999, 1999)),
+    ("1999", (1999, 1999)),
+    ("1990-1999", (1990, 1999)),
+    ("1990..1999", (1990, 1999)),
+    ("1990-", (1990, None)),
+    ("-1999", (None, 1999))
+])
+def test_parse_year_range(value, expected):
+    assert parse_year_range(value) == expected
+
+
+@pytest.mark.parametrize("value", ["девяностые", "-", "1990-1999-2000"])
+def test_parse_year_range_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_year_range(value)
+
+
+def test_split_values():
+    assert split_values(" Драма, комедия ,,") == ["драма", "комедия"]
+    assert split_values(["США", ""]) == ["сша"]
+    assert split_values(None) == []
+
+
+def test_postings_from_catalog(filter_index):
+    np.testing.assert_array_equal(filter_index.postings["genre"]["драма"], [0, 2])
+    np.testing.assert_array_equal(filter_index.postings["country"]["франция"], [1, 3])
+    np.testing.assert_array_equal(filter_index.postings["type"]["movie"], [0, 1, 3])
+    np.testing.assert_array_equal(filter_index.postings["category"]["сериалы"], [2])
+
+
+def test_select_without_filters(filter_index):
+    assert filter_index.select() is None
+    assert filter_index.select(genre="", country=None) is None
+
+
+@pytest.mark.parametrize("filters, rows", [
+    ({"genre": "драма"}, [0, 2]),
+    ({"genre": "Драма,комедия"}, [0, 1, 2]),
+    ({"genre": "драма", "country": "сша"}, [0, 2]),
+    ({"country": "сша,франция", "type": "movie"}, [0, 1, 3]),
+    ({"year_from": 1990, "year_to": 1999}, [0, 1]),
+    ({"year_from": 2000}, [2, 3]),
+    ({"year_to": 1990}, [4]),
+    ({"year_from": 1990, "year_to": 2010, "genre": "комедия"}, [1, 2])
+])
+def test_select(filter_index, filters, rows):
+    np.testing.assert_array_equal(filter_index.select(**filters), rows)
+
+
+@pytest.mark.parametrize("filters", [
+    {"genre": "ужасы"},
+    {"genre": "фантастика", "country": "россия"},
+    {"year_from": 2020},
+    {"year_from": 1995, "year_to": 1990},
+    {"type": "cartoon", "year_from": 2000}
+])
+def test_select_no_matches(filter_index, filters):
+    assert len(filter_index.select(**filters)) == 0
+
+
+def test_select_rejects_unknown_filter(filter_index):
+    with pytest.raises(ValueError):
+        filter_index.select(director="кэмерон")
+
+
+def test_patched_shifts_rows_and_drops_empty_values(filter_index):
+    keep = np.array([True, True, True, True, False])
+    patched = filter_index.patched(keep, [{"year": 2020, "genres": [{"name": "Ужасы"}], "countries": ["США"], "type": "movie"}])
+
+    assert patched.count == 5
+    assert "россия" not in patched.postings["country"]
+    np.testing.assert_array_equal(patched.select(genre="ужасы"), [4])
+    np.testing.assert_array_equal(patched.select(country="сша"), [0, 2, 3, 4])
+    np.testing.assert_array_equal(patched.select(year_from=2010), [3, 4])
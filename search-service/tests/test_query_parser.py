@@ -0,0 +1,69 @@
+import pytest
+
+from query_parser import QueryParser
+
+
+@pytest.fixture
+def parser():
+    return QueryParser(
+        genres=["драма", "комедия", "фантастика"],
+        countries=["сша", "франция"],
+        types=["movie", "tv-series", "animated-series"]
+    )
+
+
+@pytest.mark.parametrize("query, year_from, year_to", [
+    ("драма 1999", 1999, 1999),
+    ("фильмы 2010-2015", 2010, 2015),
+    ("фильмы 2015 по 2010", 2010, 2015),
+    ("комедии 90-х", 1990, 1999),
+    ("комедии 80-е", 1980, 1989),
+    ("фильмы 1970-х", 1970, 1979),
+    ("мультфильмы 00-х", 2000, 2009),
+    ("сериалы 10-х", 2010, 2019)
+])
+def test_year_range_and_decade(parser, query, year_from, year_to):
+    parsed = parser.parse(query)
+    assert (parsed.year_from, parsed.year_to) == (year_from, year_to)
+
+
+def test_range_takes_precedence_over_single_year(parser):
+    parsed = parser.parse("1999 фантастика 2001-2003")
+    assert (parsed.year_from, parsed.year_to) == (2001, 2003)
+
+
+def test_genres_countries_and_types(parser):
+    parsed = parser.parse("ДРАМА и комедия из США, сериал")
+    assert parsed.genres == ["драма", "комедия"]
+    assert parsed.countries == ["сша"]
+    assert parsed.types == ["tv-series"]
+    # Исходный текст запроса не меняется: он кодируется целиком
+    assert parsed.text == "ДРАМА и комедия из США, сериал"
+
+
+def test_longer_term_wins(parser):
+    assert parser.parse("мультсериал про космос").types == ["animated-series"]
+
+
+def test_repeated_term_counted_once(parser):
+    assert parser.parse("драма драма").genres == ["драма"]
+
+
+@pytest.mark.parametrize("query", [
+    "драматический фильм",
+    "фильм 1899 года",
+    "код 12345",
+    "фильм 2099",
+    "франциск",
+    "мультфильм"
+])
+def test_no_false_matches(parser, query):
+    parsed = parser.parse(query)
+    assert parsed.year_from is None and parsed.year_to is None
+    assert parsed.genres == [] and parsed.countries == [] and parsed.types == []
+
+
+def test_type_synonyms_only_for_catalog_types():
+    parser = QueryParser(genres=["драма"], types=["movie"])
+    assert parser.parse("сериал драма").types == []
+    assert parser.parse("сериал драма").genres == ["драма"]
@@ -0,0 +1,111 @@
+import threading
+from time import monotonic
+
+from reranker import Reranker, StubJudge
+
+
+class CountingJudge(StubJudge):
+    """StubJudge, который считает проверенные фильмы и может ждать события перед ответом"""
+
+    def __init__(self, delay=0.0, gate=None):
+        super().__init__(delay=delay)
+        self.gate = gate
+        self.texts = 0
+        self.lock = threading.Lock()
+
+    def score(self, query, texts):
+        if self.gate is not None:
+            self.gate.wait(5)
+        with self.lock:
+            self.texts += len(texts)
+        return super().score(query, texts)
+
+
+def make_candidates(count, relevant=()):
+    return [
+        {"id": movie_id, "name": "космос драма" if movie_id in relevant else f"фильм {movie_id}"}
+        for movie_id in range(count)
+    ]
+
+
+def test_stub_judge_is_deterministic():
+    judge = StubJudge()
+    texts = ["Космос. Драма", "Комедия", "космос"]
+    assert judge.score("космос драма", texts) == [1.0, 0.0, 0.5]
+    assert judge.score("космос драма", texts) == judge.score("космос драма", texts)
+
+
+def test_early_stop_checks_only_first_window():
+    judge = CountingJudge()
+    reranker = Reranker(judge, depth=100, batch_size=5, workers=2, budget=5)
+    candidates = make_candidates(100, relevant=range(0, 100, 2))
+
+    results = reranker.rerank("космос драма", candidates, limit=3)
+
+    assert [movie["id"] for movie in results] == [0, 2, 4]
+    assert all(movie["rerank_score"] == 1.0 for movie in results)
+    # Окно - batch_size * workers кандидатов, в нём уже 5 релевантных
+    assert judge.texts == 10
+    assert reranker.early_stops == 1
+    assert reranker.budget_exceeded == 0
+
+
+def test_irrelevant_candidates_are_dropped_and_verdicts_cached():
+    judge = CountingJudge()
+    reranker = Reranker(judge, depth=20, batch_size=5, workers=2, budget=5)
+    candidates = make_candidates(20, relevant={7, 15})
+
+    first = reranker.rerank("космос драма", candidates, limit=5)
+    second = reranker.rerank("Космос  драма", candidates, limit=5)
+
+    assert [movie["id"] for movie in first] == [7, 15]
+    assert second == first
+    assert judge.texts == 20
+
+
+def test_budget_returns_unchecked_candidates_and_cancels_pending_batches():
+    gate = threading.Event()
+    judge = CountingJudge(gate=gate)
+    reranker = Reranker(judge, depth=40, batch_size=5, workers=1, budget=0.05, queue_size=4)
+    candidates = make_candidates(40, relevant=range(40))
+
+    start = monotonic()
+    first = reranker.rerank("космос драма", candidates, limit=5)
+    # Пакет второго запроса стоит в очереди за зависшим пакетом первого
+    second = reranker.rerank("драма космос", candidates, limit=5)
+    elapsed = monotonic() - start
+
+    assert elapsed < 1
+    # Ни один пакет не успел: кандидаты в исходном порядке без оценки судьи
+    for results in (first, second):
+        assert [movie["id"] for movie in results] == [0, 1, 2, 3, 4]
+        assert all("rerank_score" not in movie for movie in results)
+    assert reranker.budget_exceeded == 2
+    # Пакет у судьи продолжает работу, пакет в очереди отменён
+    assert reranker.cancelled == 1
+
+    gate.set()
+    reranker.executor.shutdown(wait=True)
+    # Начатый пакет дописал вердикты в кэш, места в очереди освобождены
+    assert judge.texts == 5
+    assert all(reranker.slots.acquire(blocking=False) for _ in range(reranker.queue_size))
+
+
+def test_full_queue_rejects_instead_of_waiting():
+    gate = threading.Event()
+    judge = CountingJudge(gate=gate)
+    reranker = Reranker(judge, depth=10, batch_size=5, workers=1, budget=0.5, queue_size=1)
+    candidates = make_candidates(10, relevant=range(10))
+
+    reranker.rerank("космос драма", candidates, limit=5)
+    start = monotonic()
+    results = reranker.rerank("другой запрос", candidates, limit=5)
+
+    # Второй запрос не ждёт бюджет за чужим пакетом
+    assert monotonic() - start < 0.25
+    assert [movie["id"] for movie in results] == [0, 1, 2, 3, 4]
+    assert reranker.rejected == 1
+
+    gate.set()
+    reranker.executor.shutdown(wait=True)
+    assert reranker.slots.acquire(blocking=False)
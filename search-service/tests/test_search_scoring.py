@@ -0,0 +1,104 @@
+import threading
+
+import numpy as np
+import pytest
+
+from boost_features import BoostFeatures
+from movie_filters import FilterIndex
+from query_parser import QueryParser
+from search_service import TurboMovieSearch
+
+# Каталог не совпадает с 1900-2025: годы 1960-2024 по одному фильму на год
+YEARS = np.arange(1960, 2025)
+
+
+def make_searcher():
+    """TurboMovieSearch без MongoDB и кодировщика: только ранжирование кандидатов"""
+    searcher = TurboMovieSearch.__new__(TurboMovieSearch)
+    searcher.score_buffers = threading.local()
+    searcher.search_candidates = 16
+    return searcher
+
+
+def make_state(years=YEARS):
+    rows = np.arange(len(years), dtype=np.int64)
+    postings = {
+        "genre": {"драма": rows[::2], "комедия": rows[1::2]},
+        "type": {"movie": rows},
+        "country": {"сша": rows},
+        "category": {}
+    }
+    filter_index = FilterIndex(years, postings)
+    return {
+        "metadata": [{"id": row} for row in range(len(years))],
+        "years": np.asarray(years, dtype=np.float32),
+        "filter_index": filter_index,
+        "boost_features": BoostFeatures.from_filter_index(filter_index),
+        "query_parser": QueryParser.from_filter_index(filter_index),
+        "store": None
+    }
+
+
+def year_boosts(searcher, state, plan):
+    """Вклад буста по году в оценку каждой строки каталога (разница оценок с бустом и без)"""
+    rows = np.arange(len(state["years"]), dtype=np.int64)
+    scores = np.ones(len(rows), dtype=np.float32)
+
+    def score(year_boost):
+        found_rows, found_scores = searcher._score_candidates(state, dict(plan, year_boost=year_boost),
+                                                              scores, rows, depth=len(rows))
+        by_row = np.zeros(len(rows), dtype=np.float32)
+        by_row[found_rows] = found_scores
+        return by_row
+
+    return score(plan["year_boost"]) - score(None)
+
+
+@pytest.mark.parametrize("query, year_from, year_to", [
+    ("драма 90-х", 1990, 1999),
+    ("фильмы 2010-2015", 2010, 2015),
+    ("фильм 1975", 1975, 1975)
+])
+def test_year_range_gets_full_boost(query, year_from, year_to):
+    searcher, state = make_searcher(), make_state()
+    plan = searcher._plan_query(state, query, {})
+    boosts = year_boosts(searcher, state, plan)
+
+    inside = (YEARS >= year_from) & (YEARS <= year_to)
+    np.testing.assert_allclose(boosts[inside], 0.05, atol=1e-6)
+    assert (boosts[~inside] < 0.05 - 1e-6).all()
+    # За границами диапазона буст убывает с расстоянием в годах до ближайшей границы
+    distance = np.maximum(year_from - YEARS, YEARS - year_to)[~inside]
+    order = np.argsort(distance, kind="stable")
+    assert (np.diff(boosts[~inside][order]) <= 1e-6).all()
+
+
+def test_year_filter_gets_full_boost():
+    searcher, state = make_searcher(), make_state()
+    plan = searcher._plan_query(state, "фильм", {"year": "1984"})
+    boosts = year_boosts(searcher, state, plan)
+
+    np.testing.assert_allclose(boosts[YEARS == 1984], 0.05, atol=1e-6)
+    assert (boosts[YEARS != 1984] < 0.05 - 1e-6).all()
+
+
+def test_multi_genre_filter_boosts_every_genre():
+    searcher, state = make_searcher(), make_state()
+    plan = searcher._plan_query(state, "фильм", {"genre": "Драма, комедия"})
+
+    columns = state["boost_features"].columns
+    assert sorted(plan["boost_columns"]) == sorted([columns[("genre", "драма")], columns[("genre", "комедия")]])
+    # Жёсткий фильтр - объединение жанров
+    np.testing.assert_array_equal(plan["allowed_rows"], np.arange(len(YEARS)))
+
+
+def test_rank_candidates_beyond_default_depth():
+    # Переранжирование запрашивает RERANK_DEPTH кандидатов, в том числе больше 100
+    searcher, state = make_searcher(), make_state(np.repeat(YEARS, 4))
+    plan = searcher._plan_query(state, "фильм", {})
+    count = len(state["years"])
+    scores = np.linspace(1.0, 0.5, count).astype(np.float32)
+
+    results, rows = searcher._rank_candidates(state, plan, scores, np.arange(count, dtype=np.int64), 150)
+    assert len(results) == len(rows) == 150
+    np.testing.assert_array_equal(rows, np.arange(150))
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+from vector_index import VectorIndex
+
+COUNT = 1000
+DIM = 16
+K = 10
+
+
+def make_store(dtype):
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((COUNT, DIM)).astype(np.float32)
+    return EmbeddingStore(vectors, ids=np.arange(100, 100 + COUNT, dtype=np.int64), dtype=dtype)
+
+
+def make_queries(count=3):
+    rng = np.random.default_rng(11)
+    queries = rng.standard_normal((count, DIM)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_indexes(store):
+    """Однопоточный точный поиск и поиск по частям (порог частей ниже размера каталога)"""
+    single = VectorIndex(search_threads=1).attach(store)
+    sharded = VectorIndex(search_threads=4, shard_min_rows=1).attach(store)
+    return single, sharded
+
+
+def assert_same_results(single_result, sharded_result):
+    single_scores, single_indices = single_result
+    sharded_scores, sharded_indices = sharded_result
+    assert sharded_indices.shape == single_indices.shape
+    np.testing.assert_array_equal(sharded_indices, single_indices)
+    np.testing.assert_allclose(sharded_scores, single_scores, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_sharded_exact_search_matches_single_thread(dtype):
+    store = make_store(dtype)
+    single, sharded = exact_indexes(store)
+    queries = make_queries()
+
+    assert_same_results(single._exact_search(queries, K), sharded._sharded_exact_search(queries, K))
+    # Поиск через search() тоже уходит в части, когда строк не меньше shard_min_rows
+    assert_same_results(single.search(queries, K), sharded.search(queries, K))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_sharded_exact_search_matches_single_thread_with_rows(dtype):
+    store = make_store(dtype)
+    single, sharded = exact_indexes(store)
+    queries = make_queries()
+    rows = np.random.default_rng(3).choice(COUNT, 300, replace=False).astype(np.int64)
+
+    assert_same_results(single._exact_search(queries, K, rows), sharded._sharded_exact_search(queries, K, rows))
+    assert_same_results(single.search(queries, K, rows=rows), sharded.search(queries, K, rows=rows))
+    # Строк меньше, чем потоков и k: части из одной строки и k, урезанный до числа строк
+    assert_same_results(single.search(queries, K, rows=rows[:3]), sharded.search(queries, K, rows=rows[:3]))
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_sharded_exact_search_matches_single_thread_with_exclude(dtype):
+    store = make_store(dtype)
+    single, sharded = exact_indexes(store)
+    queries = make_queries()
+    # Исключаем лучшие строки однопоточного поиска, чтобы исключение меняло top-k
+    exclude = np.unique(single._exact_search(queries, K)[1][:, :K // 2])
+    excluded = np.zeros(COUNT, dtype=bool)
+    excluded[exclude] = True
+
+    single_result = single._exact_search(queries, K, excluded=excluded)
+    sharded_result = sharded._sharded_exact_search(queries, K, excluded=excluded)
+    assert_same_results(single_result, sharded_result)
+    assert not np.isin(sharded_result[1], exclude).any()
+
+    assert_same_results(single.search(queries, K, exclude=exclude), sharded.search(queries, K, exclude=exclude))
+
+    rows = np.random.default_rng(5).choice(COUNT, 300, replace=False).astype(np.int64)
+    rows_result = sharded.search(queries, K, rows=rows, exclude=exclude)
+    assert_same_results(single.search(queries, K, rows=rows, exclude=exclude), rows_result)
+    assert np.isin(rows_result[1], rows).all()
+    assert not np.isin(rows_result[1], exclude).any()
@@ -8,6 +8,7 @@ import uuid
 import threading
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -24,6 +25,16 @@ logger = logging.getLogger(__name__)
 SEARCH_SERVICE_URL = os.getenv("SEARCH_SERVICE_URL", "http://search:5002")
 DATABASE_SERVICE_URL = os.getenv("DATABASE_SERVICE_URL", "http://database:5001")
 
+# Гибридный поиск: полнотекстовый (RediSearch) и векторный (FAISS) параллельно, слияние по RRF
+HYBRID_SEARCH_DEADLINE = float(os.getenv("HYBRID_SEARCH_DEADLINE", 2.0))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", 1.0))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+hybrid_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HYBRID_SEARCH_WORKERS", 16)),
+    thread_name_prefix="hybrid-search"
+)
+
 # Инициализация индекса Redis при запуске приложения
 def init_redis_index():
     """
@@ -75,6 +86,110 @@ thread.daemon = True
 thread.start()
 logger.info("Запущен поток для отложенной инициализации индекса Redis")
 
+def _normalize_title(text):
+    """Название или запрос для сравнения: регистр, ё/е и пробелы не учитываются"""
+    return " ".join(str(text or "").casefold().replace("ё", "е").split())
+
+
+def _fetch_movies(url, params, timeout):
+    """Список фильмов из ответа сервиса поиска"""
+    response = requests.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, dict):
+        data = data.get("results") or data.get("movies") or []
+    return [movie for movie in data if isinstance(movie, dict)]
+
+
+def fuse_rankings(rankings, limit):
+    """
+    Слияние ранжированных списков методом Reciprocal Rank Fusion:
+    оценка фильма - сумма weight / (HYBRID_RRF_K + позиция) по всем спискам.
+    rankings - {источник: (вес, список фильмов)}.
+    """
+    scores = {}
+    movies = {}
+    sources = {}
+    for source, (weight, ranking) in rankings.items():
+        for rank, movie in enumerate(ranking, start=1):
+            movie_id = str(movie.get("id", ""))
+            if not movie_id:
+                continue
+            scores[movie_id] = scores.get(movie_id, 0.0) + weight / (HYBRID_RRF_K + rank)
+            sources.setdefault(movie_id, []).append(source)
+            # Оставляем более полный документ из двух источников
+            if movie_id not in movies or len(movie) > len(movies[movie_id]):
+                movies[movie_id] = movie
+
+    fused = []
+    for movie_id in sorted(scores, key=scores.get, reverse=True)[:limit]:
+        movie = dict(movies[movie_id])
+        movie["relevance_score"] = round(scores[movie_id], 6)
+        movie["match_sources"] = sources[movie_id]
+        fused.append(movie)
+    return fused
+
+
+def hybrid_search(query, filters, limit):
+    """
+    Гибридный поиск: database-service (полнотекстовый) и search-service (векторный)
+    опрашиваются параллельно с общим дедлайном HYBRID_SEARCH_DEADLINE, ответы
+    сливаются по RRF. Источник, не успевший к дедлайну или вернувший ошибку,
+    пропускается. Если полнотекстовый поиск нашёл точное совпадение названия,
+    векторный поиск не ждём: точные совпадения идут первыми, за ними остальные
+    полнотекстовые результаты.
+    """
+    params = {"query": query, "limit": limit, **filters}
+    started = time.monotonic()
+    deadline = started + HYBRID_SEARCH_DEADLINE
+    futures = {
+        hybrid_executor.submit(_fetch_movies, f"{DATABASE_SERVICE_URL}/search_movies", params, HYBRID_SEARCH_DEADLINE): "lexical",
+        hybrid_executor.submit(_fetch_movies, f"{SEARCH_SERVICE_URL}/search", params, HYBRID_SEARCH_DEADLINE): "vector"
+    }
+    by_source = {source: future for future, source in futures.items()}
+    results = {}
+
+    def collect(future):
+        source = futures[future]
+        try:
+            results[source] = future.result()
+        except Exception as e:
+            logger.warning(f"⚠️ Гибридный поиск: источник {source} вернул ошибку: {str(e)}")
+
+    # Полнотекстовый ответ обычно приходит первым - проверяем точное совпадение названия
+    lexical = by_source["lexical"]
+    wait([lexical], timeout=max(0.0, deadline - time.monotonic()))
+    if lexical.done():
+        collect(lexical)
+        normalized = _normalize_title(query)
+        exact = [movie for movie in results.get("lexical", [])
+                 if normalized in (_normalize_title(movie.get("name")), _normalize_title(movie.get("alternativeName")))]
+        if exact:
+            logger.info(f"🎯 Гибридный поиск: точное совпадение названия '{query}', векторный поиск не ждём")
+            exact_ids = {id(movie) for movie in exact}
+            rest = [movie for movie in results["lexical"] if id(movie) not in exact_ids]
+            return fuse_rankings({"lexical": (HYBRID_LEXICAL_WEIGHT, exact + rest)}, int(limit))
+
+    vector = by_source["vector"]
+    wait([vector], timeout=max(0.0, deadline - time.monotonic()))
+    for future in futures:
+        if future.done():
+            if futures[future] not in results:
+                collect(future)
+        else:
+            future.cancel()
+            logger.warning(f"⚠️ Гибридный поиск: источник {futures[future]} не успел за {HYBRID_SEARCH_DEADLINE} сек")
+
+    rankings = {}
+    if "lexical" in results:
+        rankings["lexical"] = (HYBRID_LEXICAL_WEIGHT, results["lexical"])
+    if "vector" in results:
+        rankings["vector"] = (HYBRID_VECTOR_WEIGHT, results["vector"])
+    fused = fuse_rankings(rankings, int(limit))
+    logger.info(f"🔀 Гибридный поиск '{query}': {', '.join(f'{s}={len(r)}' for s, r in results.items())}, "
+                f"итог {len(fused)} за {time.monotonic() - started:.3f} сек")
+    return fused
+
 # Эндпоинт для поиска фильмов
 @app.route("/search_movies")
 def search_movies_api():
@@ -96,7 +211,13 @@ def search_movies_api():
     
     # Определяем, какой сервис использовать для поиска
     try:
-        if search_mode == "faiss":
+        result_data = None
+        if search_mode == "hybrid" and query:
+            # Полнотекстовый и векторный поиск параллельно, слияние рейтингов
+            search_url = "hybrid"
+            filters = {"year": year, "genre": genre, "type": type_param, "country": country, "category": category}
+            result_data = hybrid_search(query, {k: v for k, v in filters.items() if v}, limit)
+        elif search_mode == "faiss":
             # Используем search-service (векторный поиск)
             search_url = f"{SEARCH_SERVICE_URL}/search"
             
@@ -170,9 +291,10 @@ def search_movies_api():
                     timeout=60
                 )
         
-        if response.status_code == 200:
+        if result_data is not None or response.status_code == 200:
             # Получаем результаты поиска
-            result_data = response.json()
+            if result_data is None:
+                result_data = response.json()
             
             # При запросе популярных фильмов возможен особый формат ответа
             if "/get_popular_movies" in search_url and isinstance(result_data, dict) and "movies" in result_data:
@@ -204,6 +326,10 @@ def search_movies_api():
                     "category": movie.get("category", ""),
                     "status": movie.get("status", None)
                 }
+                if "match_sources" in movie:
+                    # Гибридный режим: итоговая оценка RRF и источники, нашедшие фильм
+                    transformed_movie["relevance_score"] = movie.get("relevance_score")
+                    transformed_movie["match_sources"] = movie["match_sources"]
                 
                 # Обработка постера
                 poster = movie.get("poster")
@@ -590,59 +716,40 @@ def get_recommendations_api(user_id):
             logger.info(f"У пользователя {user_id} нет лайкнутых фильмов")
             return jsonify({"movies": [], "total": 0})
         
-        # 2. Группируем описания лайкнутых фильмов для более эффективного поиска
+        # 2. Ищем похожие фильмы по сохранённым векторам лайкнутых фильмов (без повторного кодирования описаний)
         all_recommendations = []
         
         # Ограничиваем количество фильмов для рекомендаций
-        sample_size = min(5, len(liked_movies))
+        sample_size = min(20, len(liked_movies))
         import random
-        # Берем случайные фильмы из лайкнутых, если их больше 5
+        # Берем случайные фильмы из лайкнутых, если их больше 20
         sampled_movies = random.sample(liked_movies, sample_size) if len(liked_movies) > sample_size else liked_movies
+        sampled_ids = [str(movie.get("id")) for movie in sampled_movies if movie.get("id")]
+        names_by_id = {str(movie.get("id")): movie.get("name", "") for movie in sampled_movies}
         
-        # Группируем фильмы по 3 для комбинированного поиска
-        for i in range(0, len(sampled_movies), 3):
-            movie_batch = sampled_movies[i:i+3]
-            
-            # Собираем описания из группы фильмов
-            descriptions = []
-            for movie in movie_batch:
-                desc = movie.get("description", "")
-                if not desc and movie.get("name"):
-                    desc = movie.get("name", "")
-                if desc:
-                    descriptions.append(desc)
-            
-            if not descriptions:
-                continue
-                
-            # Объединяем описания для поиска
-            combined_description = " ".join(descriptions)
-            
-            # Используем векторный поиск для нахождения похожих фильмов
-            search_url = f"{SEARCH_SERVICE_URL}/search"
-            search_params = {"query": combined_description, "limit": 10}
+        if sampled_ids:
+            similar_url = f"{SEARCH_SERVICE_URL}/similar"
             
             try:
-                search_response = requests.get(search_url, params=search_params, timeout=20)
+                # Режим max: фильм рекомендуется за сходство с любым из лайкнутых
+                similar_response = requests.post(
+                    similar_url,
+                    json={"ids": sampled_ids, "limit": 30, "mode": "max"},
+                    timeout=10
+                )
                 
-                if search_response.status_code == 200:
-                    # Добавляем найденные фильмы в список рекомендаций
-                    similar_movies = search_response.json()
-                    
-                    # Добавляем информацию о релевантности для каждого фильма
-                    for similar_movie in similar_movies:
+                if similar_response.status_code == 200:
+                    for similar_movie in similar_response.json():
                         # Проверяем, что имеем корректную структуру данных
                         if isinstance(similar_movie, dict):
-                            # Указываем источник рекомендации (группа фильмов)
-                            source_names = [m.get("name", "") for m in movie_batch if m.get("name")]
-                            similar_movie["source_movie_names"] = source_names
+                            # Указываем источник рекомендации (лайкнутый фильм)
+                            source_name = names_by_id.get(str(similar_movie.get("similar_to")))
+                            similar_movie["source_movie_names"] = [source_name] if source_name else []
                             all_recommendations.append(similar_movie)
-                        else:
-                            logger.error(f"Ошибка при поиске похожих фильмов: {search_response.text}")
-                            continue
+                else:
+                    logger.error(f"Ошибка при поиске похожих фильмов: {similar_response.text}")
             except Exception as e:
                 logger.error(f"Исключение при поиске похожих фильмов: {str(e)}")
-                continue
         
         # 3. Отфильтровываем дубликаты и уже лайкнутые фильмы
         unique_recommendations = {}